@@ -101,6 +101,7 @@ void Smarticle::init_mode(){
     // flags
     _read_sensors = 0;
     _transmit = 0;
+    _binary_transmit = 0;
     _plank = 0;
     _light_plank = 0;
     // parameters
@@ -186,6 +187,18 @@ bool Smarticle::toggle_transmit(char state){
   }
 }
 
+bool Smarticle::toggle_binary_transmit(char state){
+  //write to value of _binary_transmit to send sensor data as binary records instead of text
+  if (state==1)
+  {
+    _binary_transmit = state;
+    return 1;
+  }else{
+    _binary_transmit=0;
+    return 0;
+  }
+}
+
 uint8_t Smarticle:: set_gait_epsilon(char eps){
   // interpets set epsilon command
   _gait_epsilon = eps;
@@ -271,6 +284,11 @@ uint8_t Smarticle::set_id(uint8_t val){
   return id;
 }
 
+void Smarticle::echo(uint8_t seq){
+  // reply to ping with sequence number, time the ping was received and time of reply (ms)
+  NeoSerial1.printf("E%d,%lu,%lu\n",seq,_msg_rx_time,millis());
+}
+
 uint16_t Smarticle::set_sync_noise(uint16_t max_noise_val){
   _sync_noise = max_noise_val;
   return _sync_noise;
@@ -319,7 +337,8 @@ void Smarticle::rx_interrupt(uint8_t c){
       _input_msg[ind][len++]= c;
       _input_msg[ind][len]='\0';
   } else if (c=='\n'){
-    //set flag that message has ben received
+    //record time of reception and set flag that message has ben received
+    _msg_t[ind] = millis();
     _msg_rx++;
     len = 0;
   }
@@ -329,6 +348,7 @@ void Smarticle::manage_msg(void){
   // if received messages is more than read messages
   if ((_msg_rx-_msg_rd)>0){
     int ind = (_msg_rd)%MSG_BUFF_SIZE;
+    _msg_rx_time = _msg_t[ind];
     _msg_rd++;
     if(_debug>=2){NeoSerial1.printf("msg!>>");}
     //ensure message matches command structure of leading with a colon ':'
@@ -381,7 +401,19 @@ void Smarticle::transmit_data(void){
     count++;
 
     if (count >= _transmit_counts){
-      NeoSerial1.printf("%d,%d,%d,%d\n",sensor_dat[0], sensor_dat[1], sensor_dat[2],sensor_dat[3]);
+      if (_binary_transmit){
+        // TELEMETRY_MAGIC, sequence number, sensor values as little endian uint16
+        uint8_t record[TELEMETRY_RECORD_SIZE];
+        record[0] = TELEMETRY_MAGIC;
+        record[1] = _transmit_seq++;
+        for (int ii=0; ii<SENSOR_COUNT; ii++){
+          record[2+2*ii] = sensor_dat[ii]&0xFF;
+          record[3+2*ii] = sensor_dat[ii]>>8;
+        }
+        NeoSerial1.write(record, TELEMETRY_RECORD_SIZE);
+      }else{
+        NeoSerial1.printf("%d,%d,%d,%d\n",sensor_dat[0], sensor_dat[1], sensor_dat[2],sensor_dat[3]);
+      }
       count = 0;
     }
 
@@ -506,6 +538,15 @@ void Smarticle::_interp_msg(volatile char* msg){
         ret = set_id(value1);
         if(_debug>=1){NeoSerial1.printf("DEBUG: set id: %d\n",ret);}
         break;
+      case 0x2C:
+        // ping
+        echo(value1);
+        break;
+      case 0x2D:
+        // toggle binary transmit
+        ret = toggle_binary_transmit(value1);
+        if(_debug>=1){NeoSerial1.printf("DEBUG: toggle binary transmit: %d\n",ret);}
+        break;
     }
   } else if ((msg_code >= 0x30) && (msg_code <= 0x34)){
     uint8_t value1 = msg[VALUE_OFFSET]-ASCII_OFFSET;
@@ -62,6 +62,9 @@
 #define MSG_BUFF_SIZE 4
 //default sensor read time
 #define DEFAULT_SAMPLE_TIME_MS 10
+//binary sensor data: magic byte, sequence number and SENSOR_COUNT little endian uint16 values
+#define TELEMETRY_MAGIC 0x02
+#define TELEMETRY_RECORD_SIZE (2+2*SENSOR_COUNT)
 
 
 enum STATES{IDLE = 0, STREAM=1, INTERP=2};
@@ -83,6 +86,7 @@ class Smarticle
     uint8_t select_gait(char n);
     bool toggle_read_sensors(char state);
     bool toggle_transmit(char state);
+    bool toggle_binary_transmit(char state);
     uint8_t set_gait_epsilon(char eps);
     uint8_t set_pose_noise(char noise_range);
     void set_plank(uint8_t);
@@ -94,6 +98,7 @@ class Smarticle
     uint8_t set_transmit_counts(uint8_t counts);
     uint8_t set_debug(uint8_t debug);
     uint8_t set_id(uint8_t val);
+    void echo(uint8_t seq);
 
     void set_light_plank_threshold(uint16_t* thresh);
     void init_gait(volatile char* msg);
@@ -127,6 +132,8 @@ class Smarticle
     // rx_interrupt
     volatile char _input_msg[MSG_BUFF_SIZE][MAX_MSG_SIZE];
     volatile uint32_t _msg_rx = 0;
+    // millis() at which each buffered message was completely received
+    volatile uint32_t _msg_t[MSG_BUFF_SIZE];
     volatile bool _stream_cmd=0;
     volatile uint16_t _half_t4_TOP = 1953;
     volatile uint16_t _sync_noise = 0;
@@ -146,6 +153,7 @@ class Smarticle
 
     uint8_t _stream_arr[20];
     uint32_t _msg_rd=0;
+    uint32_t _msg_rx_time=0;
     uint16_t _sensor_threshold_constant[SENSOR_COUNT]={1500,1500,1500,1500};
     uint16_t _sensor_threshold[SENSOR_COUNT]={1500,1500,1500,1500};
     uint32_t _transmit_dat[4]={0,0,0,0};
@@ -154,6 +162,8 @@ class Smarticle
     uint8_t _debug=0;
     bool _read_sensors=0;
     bool _transmit=0;
+    bool _binary_transmit=0;
+    uint8_t _transmit_seq=0;
     bool _light_plank=0;
     uint8_t _sample_time_ms= DEFAULT_SAMPLE_TIME_MS;
     bool _servos_attached= 0;
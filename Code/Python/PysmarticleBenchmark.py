@@ -0,0 +1,178 @@
+# PysmarticleBenchmark.py
+# Benchmarks of the pysmarticle hot paths against a VirtualRadio, so results are
+# repeatable on any machine and can be compared between versions
+#
+# usage: python PysmarticleBenchmark.py [--quick] [--out results.json]
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pysmarticle'))
+
+import io
+import json
+import time
+import argparse
+import platform
+import contextlib
+import numpy as np
+
+from SmarticleSwarm import SmarticleSwarm
+from StreamThread import StreamThread
+from MsgEncoder import MsgEncoder
+from VirtualSwarm import VirtualRadio
+
+
+def virtual_swarm(n, **radio_kwargs):
+    '''returns SmarticleSwarm connected to `n` discovered virtual smarticles, without send queue pacing'''
+    radio = VirtualRadio(n, **radio_kwargs)
+    with contextlib.redirect_stdout(io.StringIO()):
+        swarm = SmarticleSwarm(base=radio, paced=False)
+        swarm.build_network(n)
+    return swarm, radio
+
+
+def close_swarm(swarm):
+    with contextlib.redirect_stdout(io.StringIO()):
+        swarm.close()
+
+
+def summary(x):
+    x = np.asarray(x, dtype=float)
+    if x.size == 0:
+        return {'n': 0}
+    return {'n': int(x.size), 'mean': float(x.mean()), 'std': float(x.std()), 'min': float(x.min()),
+            'p50': float(np.percentile(x, 50)), 'p99': float(np.percentile(x, 99)), 'max': float(x.max())}
+
+
+def throughput(fun, n_iter):
+    '''calls `fun` `n_iter` times and returns calls per second and mean time per call'''
+    fun()
+    t0 = time.perf_counter()
+    for __ in range(n_iter):
+        fun()
+    dt = time.perf_counter()-t0
+    return {'calls': n_iter, 'calls_per_s': n_iter/dt, 'us_per_call': 1e6*dt/n_iter}
+
+
+def bench_encoding(n_iter):
+    '''message encoding throughput, both of the encoder alone and of the swarm methods sending to a virtual radio'''
+    enc = MsgEncoder()
+    swarm, radio = virtual_swarm(8)
+    poses = np.column_stack((np.arange(1, 9), np.random.randint(0, 180, (8, 2))))
+    gait = [list(np.random.randint(0, 180, 15)), list(np.random.randint(0, 180, 15))]
+    results = {
+        'format_msg': throughput(lambda: SmarticleSwarm._format_msg(bytearray([0x22, 0x21])), n_iter),
+        'encoder_value_frame': throughput(lambda: enc.value_frame('set_mode', 2), n_iter),
+        'encoder_two_value_frame': throughput(lambda: enc.two_value_frame('set_pose', 90, 45), n_iter),
+        'encoder_batch_frame_8': throughput(lambda: enc.batch_frame('stream_pose', poses), n_iter),
+        'encoder_gait_frame_15': throughput(lambda: enc.gait_frame(0, 2000, gait[0], gait[1]), n_iter),
+        'set_pose': throughput(lambda: swarm.set_pose(90, 45), n_iter),
+        'stream_pose_8': throughput(lambda: swarm.stream_pose(poses), n_iter),
+    }
+    # gait_init sleeps after every command when commands are not paced, so measure it through a send queue
+    # (includes the serial airtime of the frame, but not waiting for the smarticles to consume messages)
+    swarm.xb.start_send_queue(consume_s=0)
+    def gait_init():
+        swarm.gait_init(gait, 250)
+        swarm.flush()
+    results['gait_init_15'] = throughput(gait_init, n_iter//10)
+    close_swarm(swarm)
+    return results
+
+
+def bench_stream(duration_s, period_ms):
+    '''StreamThread period accuracy and process CPU usage while streaming to 8 smarticles'''
+    swarm, radio = virtual_swarm(8)
+    ids = np.arange(1, 9)
+    gait_f = lambda t: np.column_stack((ids, np.full(8, 90+int(45*np.sin(t))), np.full(8, 90)))
+    stream = StreamThread(swarm.xb, gait_f, period_ms)
+    cpu0 = time.process_time()
+    t0 = time.monotonic()
+    stream.start()
+    time.sleep(duration_s)
+    stream.kill()
+    stream.join()
+    wall = time.monotonic()-t0
+    cpu = time.process_time()-cpu0
+    close_swarm(swarm)
+    stats = stream.stats()
+    stats['period_ms'] = period_ms
+    stats['cpu_fraction'] = cpu/wall
+    stats['frames_sent'] = radio.stats['tx_frames']
+    return stats
+
+
+def bench_ack_broadcast(sizes, n_iter, ack_latency_s):
+    '''latency of ack_broadcast vs number of smarticles, sequential and concurrent'''
+    results = {}
+    for n in sizes:
+        swarm, radio = virtual_swarm(n)
+        for smart in radio.smarticles.values():
+            smart.ack_latency_s = ack_latency_s
+        msg = swarm.enc.value_frame('set_mode', 0)
+        entry = {}
+        for concurrent in [False, True]:
+            latency = []
+            for __ in range(n_iter):
+                t0 = time.perf_counter()
+                swarm.xb.ack_broadcast(msg, concurrent=concurrent)
+                latency.append(time.perf_counter()-t0)
+            entry['concurrent' if concurrent else 'sequential'] = summary(latency)
+        close_swarm(swarm)
+        results[str(n)] = entry
+    return results
+
+
+def bench_sync(duration_s, gait_len, delay_ms):
+    '''sync pulse period error with the fixed correction and with online calibration, with simulated airtime'''
+    results = {}
+    for calibrate in [False, True]:
+        swarm, radio = virtual_swarm(8, airtime=True)
+        swarm.gait_len = gait_len
+        swarm.delay_ms = delay_ms
+        with contextlib.redirect_stdout(io.StringIO()):
+            swarm.init_sync_thread(keep_time=True, calibrate=calibrate)
+        swarm.sync_flag.set()
+        time.sleep(duration_s)
+        swarm.timer_counts.set()
+        swarm.sync_thread.join()
+        with swarm.lock:
+            pulses = np.array(swarm.sync_time_list)
+        entry = {'sync_period_s': swarm.sync_period_s, 'period_error_s': summary(np.diff(pulses)-swarm.sync_period_s)}
+        if calibrate:
+            entry['timing'] = swarm.sync_timing()
+        close_swarm(swarm)
+        results['calibrated' if calibrate else 'fixed'] = entry
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pysmarticle against a virtual radio')
+    parser.add_argument('--out', default='pysmarticle_benchmark.json', help='JSON file to write results to')
+    parser.add_argument('--quick', action='store_true', help='shorter runs, for a quick check')
+    args = parser.parse_args()
+
+    scale = 0.2 if args.quick else 1.
+    config = {'encoding_iter': int(20000*scale), 'stream_duration_s': 5*scale, 'stream_period_ms': 20,
+              'ack_sizes': [1, 2, 4, 8, 16, 32], 'ack_iter': max(int(20*scale), 3), 'ack_latency_s': 0.005,
+              'sync_duration_s': 10*scale, 'sync_gait_len': 10, 'sync_delay_ms': 50}
+
+    results = {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                        'numpy': np.__version__, 'platform': platform.platform(), 'machine': platform.machine(),
+                        'config': config}}
+    print('encoding...')
+    results['encoding'] = bench_encoding(config['encoding_iter'])
+    print('stream thread...')
+    results['stream'] = bench_stream(config['stream_duration_s'], config['stream_period_ms'])
+    print('ack broadcast...')
+    results['ack_broadcast'] = bench_ack_broadcast(config['ack_sizes'], config['ack_iter'], config['ack_latency_s'])
+    print('sync thread...')
+    results['sync'] = bench_sync(config['sync_duration_s'], config['sync_gait_len'], config['sync_delay_ms'])
+
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('results written to {}'.format(args.out))
+
+
+if __name__ == '__main__':
+    main()
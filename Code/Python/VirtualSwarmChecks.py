@@ -0,0 +1,434 @@
+# VirtualSwarmChecks.py
+# Behaviour checks of pysmarticle against a VirtualRadio: each check drives the swarm
+# through a command sequence and compares the state of the virtual smarticles with
+# what the firmware would hold
+#
+# usage: python VirtualSwarmChecks.py [check names]
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pysmarticle'))
+
+import asyncio
+import contextlib
+import io
+import shutil
+import struct
+import tempfile
+import time
+import traceback
+
+import numpy as np
+from digi.xbee.exception import TimeoutException
+
+from SmarticleSwarm import SmarticleSwarm
+from AsyncSmarticleSwarm import AsyncSmarticleSwarm
+from StreamThread import StreamThread
+from SendQueue import SendQueue
+from PoseDelta import PoseDelta
+from LatencyProbe import LatencyProbe
+from Telemetry import Telemetry
+from Recorder import Recorder, load_recording
+from VirtualSwarm import VirtualRadio, VirtualSmarticle, VirtualMessage, T4_TICK_MS
+
+GAIT = [[0, 180, 180, 0], [0, 0, 180, 180]]
+
+
+def virtual_swarm(n, paced=False, **radio_kwargs):
+    '''returns SmarticleSwarm connected to `n` discovered virtual smarticles'''
+    radio = VirtualRadio(n, **radio_kwargs)
+    with contextlib.redirect_stdout(io.StringIO()):
+        swarm = SmarticleSwarm(base=radio, paced=paced)
+        swarm.build_network(n)
+    return swarm, radio
+
+
+def multi_radio_swarm(n_radios, n_per_radio):
+    '''returns SmarticleSwarm connected to `n_radios` virtual radios with `n_per_radio` virtual smarticles each'''
+    radios = []
+    for ii in range(n_radios):
+        radio = VirtualRadio(0)
+        for n in range(ii*n_per_radio+1, (ii+1)*n_per_radio+1):
+            radio.add_smarticle(VirtualSmarticle(n))
+        radios.append(radio)
+    with contextlib.redirect_stdout(io.StringIO()):
+        swarm = SmarticleSwarm(base=radios, paced=False)
+        swarm.build_network(n_radios*n_per_radio)
+    return swarm, radios
+
+
+def close_swarm(swarm):
+    with contextlib.redirect_stdout(io.StringIO()):
+        swarm.close()
+
+
+def check_virtual_swarm_commands():
+    '''broadcasts reach every virtual smarticle, unicasts only their destination, and unicasts to an unreachable
+    smarticle time out'''
+    swarm, radio = virtual_swarm(3, ack_timeout_s=0.05)
+    assert sorted(swarm.xb.devices) == [1, 2, 3], swarm.xb.devices
+    swarm.set_mode(2)
+    swarm.set_pose(10, 20, swarm.xb.devices[2])
+    states = radio.states()
+    assert all(state['mode'] == 2 for state in states.values()), states
+    assert [states[n]['pose'] for n in (1, 2, 3)] == [[90, 90], [10, 20], [90, 90]], states
+    radio.smarticles[3].reachable = False
+    try:
+        swarm.set_mode(0, swarm.xb.devices[3])
+    except TimeoutException:
+        pass
+    else:
+        raise AssertionError('unicast to unreachable smarticle did not time out')
+    close_swarm(swarm)
+
+
+def check_encoded_settings():
+    '''settings and gaits encoded by `MsgEncoder` are interpreted as intended by the smarticles'''
+    swarm, radio = virtual_swarm(2)
+    swarm.set_pose_epsilon(0.07)
+    swarm.set_pose_noise(5)
+    swarm.gait_init(GAIT, 250, 3)
+    for n, state in radio.states().items():
+        assert state['gait_epsilon'] == 7 and state['pose_noise'] == 10, (n, state)
+        assert state['gaits'][3] == GAIT, (n, state['gaits'])
+    close_swarm(swarm)
+
+
+def check_ack_broadcast_report():
+    '''acknowledged broadcasts raise on a timeout one unicast at a time, and report it when sent concurrently'''
+    swarm, radio = virtual_swarm(3, ack_timeout_s=0.05)
+    radio.smarticles[2].reachable = False
+    msg = swarm.enc.value_frame('set_mode', 2)
+    try:
+        swarm.xb.command(msg, True)
+    except TimeoutException:
+        pass
+    else:
+        raise AssertionError('timeout of acknowledged broadcast not raised')
+    swarm.xb.concurrent_ack = True
+    report = swarm.xb.command(msg, True)
+    assert sorted(entry['status'] for entry in report.values()) == ['ok', 'ok', 'timeout'], report
+    assert [radio.states()[n]['mode'] for n in (1, 2, 3)] == [2, 0, 2]
+    close_swarm(swarm)
+
+
+def check_queued_command_results():
+    '''with the send queue running, broadcasts are paced while acknowledged commands still wait until sent, return
+    their delivery report and raise their errors'''
+    swarm, radio = virtual_swarm(3, paced=True, ack_timeout_s=0.05)
+    radio.smarticles[2].reachable = False
+    swarm.set_mode(2)
+    assert swarm.flush(1)
+    assert [radio.states()[n]['mode'] for n in (1, 2, 3)] == [2, 0, 2]
+    for send in (lambda: swarm.set_mode(0, swarm.xb.devices[2]), swarm.send_ids,
+                 lambda: swarm.xb.command(swarm.enc.value_frame('set_mode', 0), True)):
+        try:
+            send()
+        except TimeoutException:
+            pass
+        else:
+            raise AssertionError('timeout of queued acknowledged command not raised')
+    swarm.xb.concurrent_ack = True
+    msg = swarm.enc.value_frame('set_mode', 1)
+    t_sent = time.monotonic()
+    report = swarm.xb.command(msg, True)
+    assert sorted(entry['status'] for entry in report.values()) == ['ok', 'ok', 'timeout'], report
+    # the acknowledged broadcast occupies the link for one frame per smarticle
+    airtime = (len(msg)+SendQueue.FRAME_OVERHEAD)*10/swarm.xb.baud_rate
+    assert swarm.xb.send_queue._link_free >= t_sent+3*airtime
+    close_swarm(swarm)
+
+
+class StreamLog(object):
+    '''stands in for the radio of a `StreamThread`, logging the poses it streams'''
+
+    def __init__(self):
+        self.sent = []
+
+    def format_stream_msg(self, poses):
+        return poses
+
+    def command(self, msg, remote_device=None, **kwargs):
+        self.sent.append((time.monotonic(), msg))
+
+
+def check_stream_thread_skipped_ticks():
+    '''the gait time of the stream skips the ticks skipped by its timer, so it stays in step with real time'''
+    times = []
+
+    def gait(t):
+        times.append(t)
+        if len(times) == 3:
+            # overrun of several periods
+            time.sleep(0.2)
+        return [0, 90, 90]
+    stream = StreamThread(StreamLog(), gait, 50)
+    stream.start()
+    time.sleep(0.6)
+    stream.kill()
+    stream.join()
+    assert stream.stats()['skipped'] > 0, stream.stats()
+    # a stream of 0.6 s ends near t = 0.6 s, not earlier by the skipped ticks
+    assert times[-1] >= 0.5, times
+
+
+
+def check_recorder_errors():
+    '''a stream that cannot be written is reported by `stop()` without stopping the writer thread, and recordings
+    load as memory mapped chunks'''
+    swarm, radio = virtual_swarm(1)
+    remote = swarm.xb.devices[1]
+    path = tempfile.mkdtemp()
+    try:
+        recorder = Recorder(path, chunk_size=4)
+        recorder.start()
+        shutil.rmtree(os.path.join(path, 'plank'))
+        for ii in range(10):
+            recorder.record_rx(VirtualMessage(b'1,2,3,4\nPLANK 1\n', remote, time.time()))
+            recorder.record_tx(remote, b'x')
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = recorder.stop()
+        assert stats['errors'] > 0 and stats['telemetry'] == 10 and stats['commands'] == 10, stats
+        telemetry = load_recording(path, 'telemetry')
+        assert sum(len(chunk) for chunk in telemetry['current']) == 10, telemetry
+        assert all(isinstance(chunk, np.memmap) for chunk in telemetry['current'])
+    finally:
+        shutil.rmtree(path)
+        close_swarm(swarm)
+
+
+def check_stream_pose_sharding():
+    '''with several radios, every radio only streams the poses of its own smarticles'''
+    swarm, radios = multi_radio_swarm(2, 8)
+    swarm.send_ids()
+    swarm.set_mode(1)
+    sent = [dict(radio.stats) for radio in radios]
+    poses = [[n, 10+n, 20+n] for n in range(1, 17)]
+    n_sent = swarm.stream_pose(poses)
+    assert n_sent == 2, n_sent
+    own_rows = len(swarm.enc.batch_frame('stream_pose', poses[:8]))
+    assert [radio.stats['tx_frames']-s['tx_frames'] for radio, s in zip(radios, sent)] == [1, 1]
+    assert [radio.stats['tx_bytes']-s['tx_bytes'] for radio, s in zip(radios, sent)] == [own_rows, own_rows]
+    for radio in radios:
+        for n, state in radio.states().items():
+            assert state['pose'] == [10+n, 20+n], (n, state['pose'])
+    close_swarm(swarm)
+
+
+def check_async_sync_timing():
+    '''the sync task of the asyncio interface is calibrated like the sync thread and reported by `sync_timing()`'''
+    swarm, radio = virtual_swarm(2)
+
+    async def run():
+        async_swarm = AsyncSmarticleSwarm(swarm)
+        with contextlib.redirect_stdout(io.StringIO()):
+            await async_swarm.gait_init(GAIT, 50)
+        async_swarm.start_sync(keep_time=True, initial_correction_s=0.0357)
+        await asyncio.sleep(0.9)
+        await async_swarm.stop_sync()
+        return async_swarm.sync_timing(), len(async_swarm.sync_time_list)
+    timing, n_pulses = asyncio.run(run())
+    assert timing['dispatch_latency_s']['n'] == n_pulses >= 3, (timing, n_pulses)
+    # the correction converges from its initial value towards the (short) dispatch latency of the virtual radio
+    assert timing['correction_s'] < 0.0357, timing
+    close_swarm(swarm)
+
+
+def check_stream_thread_frames_per_radio():
+    '''stream frames of all radios are counted per tick'''
+    swarm, radios = multi_radio_swarm(2, 8)
+    stream = StreamThread(swarm.xb, lambda t: [[n, 90, 90] for n in range(1, 17)], 50)
+    stream.start()
+    time.sleep(0.3)
+    stream.kill()
+    stream.join()
+    stats = stream.stats()
+    assert stats['max_frames_per_tick'] == 2, stats
+    close_swarm(swarm)
+
+
+def check_pose_delta_broadcast():
+    '''after an id 0 pose every smarticle holds it, so individual poses differing from it are sent again'''
+    swarm, radio = virtual_swarm(2)
+    swarm.send_ids()
+    swarm.set_mode(1)
+    delta = PoseDelta(refresh_ticks=1000)
+    for poses in ([[1, 10, 10], [2, 20, 20]], [[0, 90, 90]], [[1, 10, 10], [2, 90, 90]]):
+        swarm.stream_pose(poses, delta=delta)
+    states = radio.states()
+    assert states[1]['pose'] == [10, 10] and states[2]['pose'] == [90, 90], states
+    close_swarm(swarm)
+
+
+def check_gait_delay_cache():
+    '''gait uploads are only skipped when the smarticles also hold the requested delay, which all slots share'''
+    swarm, radio = virtual_swarm(4)
+    sent = [swarm.gait_init(GAIT, 250, 0), swarm.gait_init(GAIT, 100, 1), swarm.gait_init(GAIT, 250, 0),
+            swarm.gait_init(GAIT, 250, 0)]
+    assert sent == [True, True, True, False], sent
+    for n, state in radio.states().items():
+        assert state['t4_top'] == int(250/T4_TICK_MS), (n, state['delay_ms'])
+    close_swarm(swarm)
+
+
+def check_apply_servos_after_gait_upload():
+    '''a gait upload stops the servos on the smarticles, so a following `servos` setting must be resent'''
+    swarm, radio = virtual_swarm(4)
+    swarm.apply({'mode': 2, 'gaits': {0: (GAIT, 250)}, 'servos': 1})
+    assert all(state['servos'] == 1 for state in radio.states().values())
+    other = [GAIT[1], GAIT[0]]
+    n_sent = swarm.apply({'mode': 2, 'gaits': {0: (other, 250)}, 'servos': 1})
+    assert n_sent == 2, n_sent
+    for n, state in radio.states().items():
+        assert state['servos'] == 1, n
+        assert state['gaits'][0] == other, n
+    close_swarm(swarm)
+
+
+def check_multi_radio_stats():
+    '''with several radios, `stats()` has the shape of a single radio's with the counters of all radios added up'''
+    swarm, radios = multi_radio_swarm(2, 4)
+    for comm in swarm.xb.comms:
+        comm.metrics.reset()
+    for ii in range(3):
+        swarm.set_mode(2)
+    swarm.set_pose(10, 20, swarm.xb.devices[5])
+    stats = swarm.xb.stats()
+    single = swarm.xb.comms[0].stats()
+    assert set(single) <= set(stats) and set(single['gauges']) == set(stats['gauges']), stats
+    counters = stats['counters']
+    assert counters['tx_frames.broadcast'] == 3*len(radios) and counters['tx_frames.unicast'] == 1, counters
+    assert [r['counters'].get('tx_frames.unicast', 0) for r in stats['radios']] == [0, 1], stats['radios']
+    assert stats['histograms']['broadcast_call_s']['n'] == 3*len(radios), stats['histograms']
+    assert swarm.xb.metrics.counters == counters
+    close_swarm(swarm)
+
+
+def check_replay_multi_radio():
+    '''a recording made with several radios is replayed with every frame sent by the radio that recorded it'''
+    swarm, radios = multi_radio_swarm(2, 4)
+    swarm.send_ids()
+    path = tempfile.mkdtemp()
+    try:
+        frames = [radio.stats['tx_frames'] for radio in radios]
+        swarm.start_recording(path)
+        swarm.set_mode(1)
+        swarm.stream_pose([[n, 10+n, 20+n] for n in range(1, 9)])
+        swarm.set_pose(30, 40, swarm.xb.devices[6])
+        swarm.stop_recording()
+        recorded = [radio.stats['tx_frames']-f for radio, f in zip(radios, frames)]
+        frames = [radio.stats['tx_frames'] for radio in radios]
+        stats = swarm.replay(path, realtime=False)
+        assert stats['frames'] == sum(recorded) and stats['skipped'] == 0, stats
+        assert [radio.stats['tx_frames']-f for radio, f in zip(radios, frames)] == recorded == [2, 3], recorded
+    finally:
+        shutil.rmtree(path)
+        close_swarm(swarm)
+
+def check_latency_compensation():
+    '''measured latencies are compensated on every radio, and broadcasts with a deadline are sent early by the
+    largest latency'''
+    swarm, radios = multi_radio_swarm(2, 1)
+    radios[0].smarticles[1].latency_s = 0.01
+    radios[1].smarticles[2].latency_s = 0.03
+    compensation = swarm.measure_latency(count=3, interval_s=0.01, compensate=True)
+    assert len(compensation) == 2, compensation
+    for comm in swarm.xb.comms:
+        assert sorted(comm.latency_compensation) == sorted(compensation), comm.latency_compensation
+        assert 0.025 < comm.broadcast_compensation < 0.05, comm.broadcast_compensation
+    deadline = time.monotonic()+0.1
+    t_call, t_done = swarm._sync_pulse(deadline)
+    assert t_call < deadline-0.02, (t_call, deadline)
+    close_swarm(swarm)
+
+
+def check_rate_control_multi_radio():
+    '''the rate controller uses the swarm's baud rate and sets the transmit periods of the smarticles of every radio'''
+    swarm, radios = multi_radio_swarm(2, 2)
+    for radio in radios:
+        radio.start()
+    swarm.send_ids()
+    swarm.set_read_sensors(1)
+    swarm.set_transmit_period(50)
+    swarm.set_transmit(1)
+    controller = swarm.start_rate_control(interval_s=0.3)
+    assert controller.capacity == swarm.xb.baud_rate/10, controller.capacity
+    time.sleep(1)
+    rates = swarm.stop_rate_control()
+    for radio in radios:
+        radio.stop()
+    assert [radio['devices'] for radio in rates['radios']] == [[1, 2], [3, 4]], rates['radios']
+    assert all(device['rate_hz'] for device in rates['devices'].values()), rates['devices']
+    close_swarm(swarm)
+
+
+def check_rate_control_binary_loss():
+    '''the rate controller uses the swarm's baud rate and takes the loss of binary telemetry from sequence gaps'''
+    radio = VirtualRadio(4, baud_rate=115200)
+    with contextlib.redirect_stdout(io.StringIO()):
+        swarm = SmarticleSwarm(base=radio, baud_rate=115200, paced=False)
+        swarm.build_network(4)
+    radio.start()
+    swarm.send_ids()
+    swarm.set_read_sensors(1)
+    swarm.set_binary_transmit(1)
+    swarm.set_transmit_period(50)
+    swarm.set_transmit(1)
+    controller = swarm.start_rate_control(interval_s=0.3)
+    assert controller.capacity == 11520, controller.capacity
+    time.sleep(1.5)
+    swarm.stop_rate_control()
+    radio.stop()
+    losses = [device['loss'] for device in controller.rates()['devices'].values()]
+    assert losses and all(loss == 0 for loss in losses), losses
+    close_swarm(swarm)
+
+
+def check_latency_probe_between_records():
+    '''ping echoes are found between binary telemetry records containing b'E' and b'\\n' bytes'''
+    swarm, radio = virtual_swarm(1)
+    remote = swarm.xb.devices[1]
+    probe = LatencyProbe(swarm.xb)
+    record = struct.pack('<BB4H', Telemetry.MAGIC, ord('E'), ord('\n'), ord('E'), 10, 20)
+    # the second frame starts with the end of a record split across frames
+    for data in (record+b'E0,5,6\n'+record, record[4:]+b'E1,5,6\n'):
+        probe._send_ping(remote)
+        probe._receive(VirtualMessage(data, remote, time.time()))
+    assert probe.stats['received'] == 2, probe.stats
+    close_swarm(swarm)
+
+
+def check_telemetry_wire_order_and_resync():
+    '''mixed text samples and binary records keep their wire order, and a frame starting with the end of a split
+    record whose start was lost resynchronises on the next record'''
+    telemetry = Telemetry()
+
+    def record(seq, value):
+        return struct.pack('<BB4H', Telemetry.MAGIC, seq, value, ord('\n'), ord('E'), 0)
+    samples, other = telemetry.parse(1, record(0, 1)+b'2,0,0,0\n'+record(1, 3)+b'4,0,0,0\nPLANK 1\n')
+    assert list(samples[:, 0]) == [1, 2, 3, 4] and other == [b'PLANK 1'], (samples, other)
+    # the frame with record 2 and the start of record 3 was lost
+    samples, other = telemetry.parse(1, record(3, 5)[4:]+record(4, 6)+record(5, 7))
+    assert list(samples[:, 0]) == [6, 7] and other == [], (samples, other)
+    assert telemetry.lost(1) == 2 and telemetry.stats['resyncs'] == 1, telemetry.stats
+
+
+CHECKS = {name[len('check_'):]: fun for name, fun in sorted(globals().items()) if name.startswith('check_')}
+
+
+def main():
+    names = sys.argv[1:] or list(CHECKS)
+    failed = 0
+    for name in names:
+        try:
+            CHECKS[name]()
+            print('{:<40} ok'.format(name))
+        except Exception:
+            failed += 1
+            print('{:<40} FAILED'.format(name))
+            traceback.print_exc()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+# AsyncSmarticleSwarm.py
+# Alex Samland
+# October 17, 2026
+# asyncio interface to SmarticleSwarm: awaitable commands, received messages as an
+# async iterator, and gait sync and streaming as tasks on the event loop
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from SmarticleSwarm import SmarticleSwarm
+from DeadlineTimer import RunningStats
+from GaitTable import GaitTable
+
+
+class AsyncSmarticleSwarm(object):
+    '''
+    ## Description
+    ---
+    asyncio wrapper around `SmarticleSwarm`. Commands (`set_mode`, `set_pose`, `gait_init`, ...) take the same arguments
+    as in `SmarticleSwarm` but are coroutines; the blocking radio I/O runs on a thread pool, so many command sequences
+    (e.g. one per smarticle) can run concurrently as tasks. Received messages are available with
+    `async for msg in swarm.messages()`, and the gait sync and servo streaming loops run as tasks on the event loop
+    (`start_sync()`, `stream()`) instead of in their own threads.
+
+    By default commands are not paced by a send queue, so awaiting a command returns when it has been sent
+    (acknowledged, for unicasts). With `paced=True`, awaiting only waits until the command is queued; use `flush()`.
+    Attributes that are not commands (e.g. `xb`, `telemetry`) are those of the wrapped `SmarticleSwarm`.
+
+    ## Arguments
+    ---
+
+    | Argument        | Type             | Description                                                          | Default Value |
+    | :------:        | :--:             | :---------:                                                          | :-----------: |
+    | swarm           | `SmarticleSwarm` | swarm to wrap; if `None`, one is created with the keyword arguments  | `None`        |
+    | max_workers     | `int`            | number of threads used for radio I/O                                 | 16            |
+    | **kwargs        | --               | arguments of `SmarticleSwarm` (`paced` defaults to False)            | --            |
+    |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+    ## Example
+    ---
+    ```
+    async def main():
+        async with AsyncSmarticleSwarm(port=PORT_NAME) as swarm:
+            await swarm.build_network(4)
+            await asyncio.gather(*[swarm.set_pose(90, 90, dev) for dev in swarm.xb.devices.values()])
+            async for msg in swarm.messages():
+                print(msg.data)
+    ```
+    '''
+    COMMANDS = ('build_network', 'send_ids', 'flush', 'set_servos', 'set_transmit', 'set_binary_transmit',
+                'set_light_plank', 'set_sensor_threshold', 'set_read_sensors', 'set_transmit_period', 'set_debug', 'set_pose_epsilon',
+                'set_mode', 'set_plank', 'set_pose', 'stream_pose', 'set_delay', 'set_pose_noise', 'set_sync_noise',
+                'gait_init', 'select_gait', 'apply', 'start_telemetry', 'start_recording', 'stop_recording', 'replay',
+                'measure_latency', 'start_plank_controller', 'stop_plank_controller',
+                'start_rate_control', 'stop_rate_control')
+
+    def __init__(self, swarm=None, max_workers=16, **kwargs):
+        if swarm is None:
+            kwargs.setdefault('paced', False)
+            swarm = SmarticleSwarm(**kwargs)
+        self.swarm = swarm
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='async_swarm')
+        self.sync_task = None
+        self._streams = {}
+
+    def __getattr__(self, name):
+        if name == 'swarm':
+            raise AttributeError(name)
+        if name in AsyncSmarticleSwarm.COMMANDS:
+            fun = getattr(self.swarm, name)
+            async def command(*args, **kwargs):
+                return await self.run(fun, *args, **kwargs)
+            command.__name__ = name
+            command.__doc__ = fun.__doc__
+            return command
+        return getattr(self.swarm, name)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def run(self, fun, *args, **kwargs):
+        '''
+        ## Description
+        ---
+        Runs blocking function `fun(*args, **kwargs)` on the I/O thread pool and returns its result
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: fun(*args, **kwargs))
+
+    async def messages(self, maxsize=1024):
+        '''
+        ## Description
+        ---
+        Async iterator of received `XbeeMessage`s. Every iterator gets all messages received while it is iterated;
+        if the consumer falls more than `maxsize` messages behind, the oldest messages are dropped
+
+        ## Arguments
+        ---
+
+        | Argument        | Type       | Description                                                          | Default Value |
+        | :------:        | :--:       | :---------:                                                          | :-----------: |
+        | maxsize         | `int`      | maximum number of buffered messages                                  | 1024          |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+        '''
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize)
+
+        def offer(msg):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(msg)
+
+        def callback(msg):
+            # called on the digi reader thread
+            try:
+                loop.call_soon_threadsafe(offer, msg)
+            except RuntimeError:
+                # event loop closed
+                pass
+
+        self.swarm.xb.add_rx_callback(callback)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.swarm.xb.del_rx_callback(callback)
+
+    async def _sleep_until(self, deadline):
+        loop = asyncio.get_running_loop()
+        delay = deadline-loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _sync_loop(self, sync_period_s, keep_time):
+        # the event loop clock is time.monotonic(), the clock of the calibration in SmarticleSwarm
+        loop = asyncio.get_running_loop()
+        await self.set_servos(1)
+        await self.flush()
+        # wait 1/3 of gait delay to begin sync sequence, as in SmarticleSwarm.start_sync
+        await asyncio.sleep(self.swarm.delay_ms/3000)
+        correction_s = self.swarm.sync_correction_s
+        t_start = loop.time()
+        t_last = None
+        tick = 0
+        while True:
+            tick += 1
+            deadline = t_start+tick*sync_period_s
+            await self._sleep_until(deadline-correction_s)
+            t_call, t_done = await self.run(self.swarm._sync_pulse)
+            correction_s = self.swarm._sync_calibration(sync_period_s, deadline, t_call, t_done, t_last, keep_time)
+            t_last = t_done
+
+    def start_sync(self, keep_time=False, initial_correction_s=0.0357, gain=0.1):
+        '''
+        ## Description
+        ---
+        Starts gait sequence (`set_servos(1)`) and a task sending a sync pulse every gait period, see
+        `SmarticleSwarm.init_sync_thread()` for the arguments. Pulses are calibrated as with
+        `init_sync_thread(calibrate=True)`, see `sync_timing()`. `gait_init()` must have been called. Must be called
+        from the event loop
+
+        ## Returns
+        ---
+        `asyncio.Task` of the sync loop
+        '''
+        if self.sync_task is not None:
+            self.sync_task.cancel()
+        self.sync_period_s = (self.swarm.gait_len*self.swarm.delay_ms)/1000
+        if keep_time:
+            self.swarm.sync_time_list = []
+        self.swarm._reset_sync_calibration(initial_correction_s, gain)
+        self.sync_task = asyncio.ensure_future(self._sync_loop(self.sync_period_s, keep_time))
+        return self.sync_task
+
+    async def stop_sync(self):
+        '''
+        ## Description
+        ---
+        Stops the sync task and the gait sequence (`set_servos(0)`)
+        '''
+        if self.sync_task is not None:
+            self.sync_task.cancel()
+            self.sync_task = None
+        await self.set_servos(0)
+
+    async def _stream_loop(self, gait_f, period_s, remote_device, late):
+        loop = asyncio.get_running_loop()
+        xb = self.swarm.xb
+        table = gait_f if isinstance(gait_f, GaitTable) else None
+        t_start = loop.time()
+        tick = 0
+        while True:
+            deadline = t_start+tick*period_s
+            if table is not None:
+                msg = table[tick]
+            else:
+                msg = xb.format_stream_msg(gait_f(tick*period_s))
+            await self._sleep_until(deadline)
+            late.update(max(loop.time()-deadline, 0.))
+            await self.run(xb.command, msg, remote_device)
+            tick += 1
+            behind = loop.time()-(t_start+tick*period_s)
+            if behind > period_s:
+                # skip missed ticks instead of sending them in a burst
+                tick += int(behind/period_s)
+
+    def stream(self, gait_f, period_ms, remote_device=None):
+        '''
+        ## Description
+        ---
+        Starts a task streaming servo commands from `gait_f(t)` every `period_ms` (the task version of `StreamThread`).
+        Cancel the returned task to stop streaming. Must be called from the event loop
+
+        ## Arguments
+        ---
+
+        | Argument        | Type       | Description                                                          | Default Value |
+        | :------:        | :--:       | :---------:                                                          | :-----------: |
+        | gait_f          | function   | function of time (s) returning poses, see `XbeeComm.format_stream_msg()`, or a `GaitTable` | N/A |
+        | period_ms       | `int`      | stream period in ms                                                  | N/A           |
+        | remote_device   | --         | see `SmarticleSwarm` class description                               | `None`        |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `asyncio.Task` of the stream loop
+        '''
+        late = RunningStats()
+        task = asyncio.ensure_future(self._stream_loop(gait_f, round(period_ms/1000, 3), remote_device, late))
+        self._streams[task] = late
+        task.add_done_callback(lambda task: self._streams.pop(task, None))
+        return task
+
+    def stream_stats(self, task):
+        '''
+        ## Description
+        ---
+        Returns statistics of how late (s) the ticks of a running stream task were sent, see `DeadlineTimer.RunningStats`
+        '''
+        return self._streams[task].summary()
+
+    async def close(self):
+        '''
+        ## Description
+        ---
+        Cancels the sync and stream tasks and closes the swarm
+        '''
+        tasks = list(self._streams)
+        if self.sync_task is not None:
+            tasks.append(self.sync_task)
+            self.sync_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.run(self.swarm.close)
+        self.executor.shutdown(wait=False)
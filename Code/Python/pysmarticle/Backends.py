@@ -0,0 +1,85 @@
+# Backends.py
+# Alex Samland
+# October 17, 2026
+# Module selecting the radio implementation used by XbeeComm; backends are only imported when first used
+
+import importlib
+
+
+class DigiBackend(object):
+    '''
+    ## Description
+    ---
+    Local XBee connected over USB serial, using the Digi XBee python library
+    '''
+    name = 'digi'
+
+    def __init__(self):
+        from digi.xbee.devices import Raw802Device, RemoteRaw802Device
+        from digi.xbee.models.address import XBee64BitAddress
+        from digi.xbee.models.status import NetworkDiscoveryStatus
+        from digi.xbee.exception import TimeoutException
+        self._Raw802Device = Raw802Device
+        self._RemoteRaw802Device = RemoteRaw802Device
+        self._XBee64BitAddress = XBee64BitAddress
+        self.TimeoutException = TimeoutException
+        self.DISCOVERY_SUCCESS = NetworkDiscoveryStatus.SUCCESS
+
+    def create_base(self, port, baud_rate):
+        return self._Raw802Device(port, baud_rate)
+
+    def create_remote(self, base, address, node_id):
+        return self._RemoteRaw802Device(base, x64bit_addr=self._XBee64BitAddress.from_hex_string(address), node_id=node_id)
+
+
+class VirtualBackend(object):
+    '''
+    ## Description
+    ---
+    In-process swarm of virtual smarticles (`VirtualSwarm.VirtualRadio`); runs without any radio attached.
+    `port` is the number of virtual smarticles if it is an `int`, otherwise 8 are created
+    '''
+    name = 'virtual'
+
+    def __init__(self):
+        self._vs = importlib.import_module('VirtualSwarm')
+        self.TimeoutException = self._vs.TimeoutException
+        self.DISCOVERY_SUCCESS = self._vs.DISCOVERY_SUCCESS
+
+    def create_base(self, port, baud_rate):
+        return self._vs.VirtualRadio(port if isinstance(port, int) else 8, baud_rate=baud_rate)
+
+    def create_remote(self, base, address, node_id):
+        return base.create_remote(address, node_id)
+
+
+BACKENDS = {'digi': DigiBackend, 'virtual': VirtualBackend}
+_loaded = {}
+
+
+def register_backend(name, backend_class):
+    '''
+    ## Description
+    ---
+    Adds a backend that can be selected with the `backend` argument of `XbeeComm`. `backend_class()` must provide
+    `create_base(port, baud_rate)`, `create_remote(base, address, node_id)`, `TimeoutException` (raised by the base
+    when a unicast is not acknowledged) and `DISCOVERY_SUCCESS` (status passed to discovery finished callbacks)
+    '''
+    BACKENDS[name] = backend_class
+    _loaded.pop(name, None)
+
+
+def get_backend(name):
+    '''
+    ## Description
+    ---
+    Returns the backend registered as `name`, importing it on first use
+    '''
+    backend = _loaded.get(name)
+    if backend is None:
+        try:
+            backend_class = BACKENDS[name]
+        except KeyError:
+            raise ValueError("Unknown backend '{}', expected one of {}".format(name, sorted(BACKENDS)))
+        backend = _loaded[name] = backend_class()
+    return backend
@@ -0,0 +1,165 @@
+# DeadlineTimer.py
+# Alex Samland
+# October 17, 2026
+# Module providing drift-free periodic timing with low CPU usage for
+# StreamThread and other periodic senders
+
+import time
+import math
+
+
+def sleep_until(deadline, spin_s=0.002):
+    '''
+    ## Description
+    ---
+    Blocks until `time.monotonic()` reaches `deadline`. Sleeps until shortly before the
+    deadline and then spins for the remaining time to get sub-millisecond accuracy without
+    occupying a core
+
+    ## Arguments
+    ---
+
+    | Argument        | Type       | Description                                                 | Default Value |
+    | :------:        | :--:       | :---------:                                                 | :-----------: |
+    | deadline        | `float`    | absolute deadline in `time.monotonic()` seconds             | N/A           |
+    | spin_s          | `float`    | time before the deadline at which to stop sleeping and spin | 0.002         |
+    |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+    ## Returns
+    ---
+    `float` monotonic time at which the function returned
+    '''
+    remaining = deadline-time.monotonic()
+    if remaining > spin_s:
+        time.sleep(remaining-spin_s)
+    now = time.monotonic()
+    while now < deadline:
+        now = time.monotonic()
+    return now
+
+
+class RunningStats(object):
+    '''
+    ## Description
+    ---
+    Running mean, standard deviation and extrema of a series of values (Welford's algorithm)
+    '''
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.
+        self._m2 = 0.
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def update(self, x):
+        self.n += 1
+        delta = x-self.mean
+        self.mean += delta/self.n
+        self._m2 += delta*(x-self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def std(self):
+        return math.sqrt(self._m2/(self.n-1)) if self.n > 1 else 0.
+
+    def summary(self):
+        '''
+        ## Description
+        ---
+        Returns `dict` with n, mean, std, min and max
+        '''
+        if self.n == 0:
+            return {'n': 0, 'mean': 0., 'std': 0., 'min': 0., 'max': 0.}
+        return {'n': self.n, 'mean': self.mean, 'std': self.std(), 'min': self.min, 'max': self.max}
+
+
+class DeadlineTimer(object):
+    '''
+    ## Description
+    ---
+    Periodic timer based on absolute monotonic deadlines. Deadline k is `t_start + k*period_s`,
+    so time spent between calls to `wait()` does not accumulate as drift.
+    Keeps statistics on how late each tick fired (jitter), on overruns, i.e. ticks whose deadline
+    had already passed when `wait()` was called, and on ticks skipped because the caller fell
+    more than a full period behind
+
+    ## Arguments
+    ---
+
+    | Argument        | Type       | Description                                                 | Default Value |
+    | :------:        | :--:       | :---------:                                                 | :-----------: |
+    | period_s        | `float`    | timer period in seconds                                     | N/A           |
+    | spin_s          | `float`    | time before each deadline at which to stop sleeping and spin | 0.002        |
+    |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+    '''
+
+    def __init__(self, period_s, spin_s=0.002):
+        self.period_s = period_s
+        self.spin_s = spin_s
+        self.reset_stats()
+        self.start()
+
+    def start(self, t_start=None):
+        '''
+        ## Description
+        ---
+        (Re)bases the timer so that the next deadline is one period after `t_start` (default: now)
+        '''
+        if t_start is None:
+            t_start = time.monotonic()
+        self.t_start = t_start
+        self.tick = 0
+
+    def reset_stats(self):
+        '''
+        ## Description
+        ---
+        Clears jitter and overrun statistics
+        '''
+        self.overruns = 0
+        self.skipped = 0
+        self.late = RunningStats()
+
+    def next_deadline(self):
+        return self.t_start+(self.tick+1)*self.period_s
+
+    def wait(self, offset_s=0):
+        '''
+        ## Description
+        ---
+        Blocks until the next deadline plus `offset_s`. `offset_s` only shifts the current tick
+        (e.g. for timing noise) and does not move later deadlines.
+
+        ## Returns
+        ---
+        `int` index of the tick that fired (ticks missed by more than a period are skipped)
+        '''
+        self.tick += 1
+        deadline = self.t_start+self.tick*self.period_s
+        now = time.monotonic()
+        if now > deadline+offset_s:
+            self.overruns += 1
+        if now-deadline > self.period_s:
+            # more than a period behind: skip missed ticks instead of firing them back to back
+            missed = int(math.floor((now-deadline)/self.period_s))
+            self.skipped += missed
+            self.tick += missed
+            deadline += missed*self.period_s
+        now = sleep_until(deadline+offset_s, self.spin_s)
+        self.late.update(now-(deadline+offset_s))
+        return self.tick
+
+    def stats(self):
+        '''
+        ## Description
+        ---
+        Returns timing statistics
+
+        ## Returns
+        ---
+        `dict` with number of ticks, overruns, skipped ticks and mean/std/max lateness in seconds
+        '''
+        late = self.late.summary()
+        return {'ticks': late['n'], 'overruns': self.overruns, 'skipped': self.skipped, 'mean_late_s': late['mean'],
+                'jitter_s': late['std'], 'max_late_s': late['max']}
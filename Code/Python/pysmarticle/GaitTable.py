@@ -0,0 +1,64 @@
+# GaitTable.py
+# Alex Samland
+# October 17, 2026
+# Module for precomputing the stream messages of a periodic gait
+
+from LazyImport import lazy_import
+np = lazy_import('numpy', globals(), 'np')
+
+
+class GaitTable(object):
+    '''
+    ## Description
+    ---
+    Table of ready to send stream messages covering one period of a periodic gait. The gait function is evaluated
+    once, at all stream ticks of the period, and every message is encoded once; streaming then only indexes into the
+    table, so the time per tick does not depend on the cost of the gait function.
+
+    Pass a `GaitTable` to `StreamThread` (or `AsyncSmarticleSwarm.stream()`) in place of the gait function.
+
+    ## Arguments
+    ---
+
+    | Argument        | Type       | Description                                                          | Default Value |
+    | :------:        | :--:       | :---------:                                                          | :-----------: |
+    | xbee            | `XbeeComm` | used to format the messages (`XbeeComm.format_stream_msg()`)         | N/A           |
+    | gait_f          | function   | gait function of time (s), see below                                 | N/A           |
+    | gait_period_s   | `float`    | period of the gait; must be a multiple of the stream period          | N/A           |
+    | period_ms       | `int`      | stream period in ms                                                  | N/A           |
+    | vectorized      | `bool`     | if True, `gait_f` is called once with the array of all tick times    | True          |
+    |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+    ## Gait function
+    ---
+    Non vectorized, `gait_f(t)` returns the poses at time `t` as taken by `StreamThread`: an Nx3 array of
+    [id, angL, angR] rows or a single [angL, angR] pose. Vectorized, `gait_f(t)` is passed a 1-D array of K times
+    and returns a KxNx3 or Kx2 array of the poses at all times. Poses are rounded to integers.
+    '''
+
+    def __init__(self, xbee, gait_f, gait_period_s, period_ms, vectorized=True):
+        self.period_s = round(period_ms/1000, 3)
+        n_ticks = int(round(gait_period_s/self.period_s))
+        if n_ticks < 1 or abs(n_ticks*self.period_s-gait_period_s) > 1e-6:
+            raise ValueError('Gait period of {}s is not a multiple of the stream period of {}s'.format(gait_period_s, self.period_s))
+        self.gait_period_s = gait_period_s
+        self.t = np.arange(n_ticks)*self.period_s
+        if vectorized:
+            poses = np.asarray(gait_f(self.t))
+            if poses.ndim not in (2, 3) or poses.shape[0] != n_ticks:
+                raise ValueError('Vectorized gait function must return a {0}x2 or {0}xNx3 array, got shape {1}'.format(n_ticks, poses.shape))
+        else:
+            poses = np.array([gait_f(t) for t in self.t])
+        self.poses = np.rint(poses).astype(int)
+        self.frames = [xbee.format_stream_msg(p) for p in self.poses]
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, tick):
+        '''
+        ## Description
+        ---
+        Returns the message of stream tick `tick`; ticks wrap around at the end of the gait period
+        '''
+        return self.frames[tick%len(self.frames)]
@@ -0,0 +1,215 @@
+# LatencyProbe.py
+# Alex Samland
+# October 17, 2026
+# Module for measuring the link latency and clock offset of every smarticle with ping/echo messages
+
+import collections
+import statistics
+import threading
+import time
+from MsgEncoder import MsgEncoder
+from SendQueue import Dispatch
+from Telemetry import Telemetry
+
+
+class LatencyProbe(object):
+    '''
+    ## Description
+    ---
+    Estimates the one way latency, its jitter and the clock offset of every smarticle from ping messages.
+
+    A ping (`ping` message with a sequence number) is answered by `Smarticle::echo` with `E<seq>,<t_rx>,<t_reply>`:
+    the smarticle's `millis()` when the ping was completely received and when the reply was sent. For every reply the
+    round trip time is measured on the host, the smarticle's processing time (`t_reply-t_rx`, which includes the time
+    the ping waited in the smarticle's message buffer) is removed and half of the rest is taken as one way latency.
+    Since sync pulses are handled on reception, this is the latency that matters for synchronized events. The clock
+    offset is the smarticle's `millis()` (in s) minus `time.monotonic()` at the same instant.
+
+    Estimates are medians over the last `samples` replies of each smarticle, so they are robust to single retried or
+    delayed frames. `compensate()` makes `XbeeComm.command()` send unicasts with a deadline early by the latency of
+    their smarticle and broadcasts with a deadline (sync pulses, streamed poses) early by the largest latency of all
+    smarticles, so that they arrive at their deadline.
+
+    ## Arguments
+    ---
+
+    | Argument        | Type       | Description                                                          | Default Value |
+    | :------:        | :--:       | :---------:                                                          | :-----------: |
+    | xbee            | `XbeeComm` | radio to ping on (`XbeeComm` or `MultiXbeeComm`)                     | N/A           |
+    | samples         | `int`      | number of replies per smarticle used for the estimates               | 32            |
+    |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+    '''
+    # sequence numbers are sent as single characters
+    N_SEQ = MsgEncoder.MAX_VALUE+1
+
+    def __init__(self, xbee, samples=32):
+        self.xb = xbee
+        self.samples = samples
+        self.encoder = MsgEncoder()
+        self._lock = threading.RLock()
+        self._sent = {}
+        self._seq = collections.defaultdict(int)
+        self._replies = {}
+        self._names = {}
+        self.stats = {'sent': 0, 'received': 0, 'unmatched': 0}
+        self._started = False
+
+    def start(self):
+        '''
+        ## Description
+        ---
+        Starts listening for ping replies; called by `ping()`
+        '''
+        if not self._started:
+            self.xb.add_rx_callback(self._receive)
+            self._started = True
+
+    def stop(self):
+        '''
+        ## Description
+        ---
+        Stops listening for ping replies
+        '''
+        if self._started:
+            self.xb.del_rx_callback(self._receive)
+            self._started = False
+
+    def reset(self):
+        '''
+        ## Description
+        ---
+        Forgets all replies
+        '''
+        with self._lock:
+            self._sent = {}
+            self._replies = {}
+
+    def ping(self, remote_devices=None, count=10, interval_s=0.05, timeout_s=0.5):
+        '''
+        ## Description
+        ---
+        Pings every smarticle `count` times, one smarticle at a time, and waits for the replies
+
+        ## Arguments
+        ---
+
+        | Argument        | Type       | Description                                                          | Default Value |
+        | :------:        | :--:       | :---------:                                                          | :-----------: |
+        | remote_devices  | `list`     | remote devices to ping, all devices if `None`                        | `None`        |
+        | count           | `int`      | number of pings per smarticle                                        | 10            |
+        | interval_s      | `float`    | time between pings                                                   | 0.05          |
+        | timeout_s       | `float`    | time to wait for the last replies                                    | 0.5           |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `dict` of estimates, see `estimates()`
+        '''
+        self.start()
+        if remote_devices is None:
+            remote_devices = list(self.xb.devices.values())
+        for ii in range(count):
+            for remote in remote_devices:
+                self._send_ping(remote)
+                time.sleep(interval_s)
+        deadline = time.monotonic()+timeout_s
+        while self._sent and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with self._lock:
+            # pings without reply are lost
+            self._sent = {}
+        return self.estimates()
+
+    def _send_ping(self, remote):
+        addr = str(remote.get_64bit_addr())
+        with self._lock:
+            seq = self._seq[addr]
+            self._seq[addr] = (seq+1)%self.N_SEQ
+            self._names[addr] = remote.get_node_id()
+            # replies may arrive before command() returns, so the send time is stored first; with the send queue
+            # running it is replaced by the Dispatch, which holds the time the ping was actually sent
+            self._sent[(addr, seq)] = time.monotonic()
+            queued = self.xb.command(self.encoder.value_frame('ping', seq), remote, asynch=True)
+            if isinstance(queued, Dispatch):
+                self._sent[(addr, seq)] = queued
+            self.stats['sent'] += 1
+
+    @staticmethod
+    def _lines(data):
+        # text lines of received data; binary telemetry records (see `Telemetry`), which may contain b'E' and b'\n',
+        # are skipped
+        pos = 0
+        end = len(data)
+        while pos < end:
+            if data[pos] == Telemetry.MAGIC:
+                pos += Telemetry.RECORD_SIZE
+                continue
+            eol = data.find(b'\n', pos)
+            if eol < 0:
+                eol = end
+            yield data[pos:eol]
+            pos = eol+1
+
+    def _receive(self, xbee_message):
+        t_rx = time.monotonic()
+        data = bytes(xbee_message.data)
+        if b'E' not in data:
+            return
+        addr = str(xbee_message.remote_device.get_64bit_addr())
+        for line in self._lines(data):
+            # the echo ends its line; anything before its 'E' is the rest of a record split across frames
+            start = line.rfind(b'E')
+            if start < 0:
+                continue
+            try:
+                seq, t_dev_rx, t_dev_reply = [int(f) for f in line[start+1:].split(b',')]
+            except ValueError:
+                continue
+            with self._lock:
+                sent = self._sent.pop((addr, seq), None)
+                if sent is None:
+                    self.stats['unmatched'] += 1
+                    continue
+                t_sent = sent.t_sent if isinstance(sent, Dispatch) else sent
+                rtt = t_rx-t_sent
+                processing = (t_dev_reply-t_dev_rx)/1000
+                one_way = max(rtt-processing, 0.)/2
+                offset = t_dev_rx/1000-(t_sent+one_way)
+                replies = self._replies.setdefault(addr, collections.deque(maxlen=self.samples))
+                replies.append((rtt, one_way, processing, offset))
+                self.stats['received'] += 1
+
+    def estimates(self):
+        '''
+        ## Description
+        ---
+        Returns `dict` of 64 bit address (hex string) to `dict` with the node ID (`name`), number of replies (`n`),
+        median round trip time (`rtt_s`), one way latency (`latency_s`), standard deviation of the one way latency
+        (`jitter_s`), smarticle processing time (`processing_s`) and clock offset (`clock_offset_s`)
+        '''
+        out = {}
+        with self._lock:
+            for addr, replies in self._replies.items():
+                rtt, one_way, processing, offset = zip(*replies)
+                out[addr] = {'name': self._names.get(addr), 'n': len(replies), 'rtt_s': statistics.median(rtt),
+                             'latency_s': statistics.median(one_way),
+                             'jitter_s': statistics.pstdev(one_way) if len(one_way) > 1 else 0.,
+                             'processing_s': statistics.median(processing), 'clock_offset_s': statistics.median(offset)}
+        return out
+
+    def compensate(self, enable=True):
+        '''
+        ## Description
+        ---
+        Sets (or with `enable` False clears) `XbeeComm.latency_compensation` to the estimated one way latency of every
+        smarticle, so that unicasts with a deadline are sent that much earlier, and `XbeeComm.broadcast_compensation`
+        to the largest of them, so that broadcasts with a deadline reach the slowest smarticle on time
+
+        ## Returns
+        ---
+        `dict` of 64 bit address to compensation in seconds
+        '''
+        compensation = {addr: est['latency_s'] for addr, est in self.estimates().items()} if enable else {}
+        self.xb.latency_compensation = dict(compensation)
+        self.xb.broadcast_compensation = max(compensation.values(), default=0.)
+        return compensation
@@ -0,0 +1,44 @@
+# LazyImport.py
+# Alex Samland
+# October 17, 2026
+# Module for deferring the import of heavy dependencies (numpy, digi) until they are first used
+
+import importlib
+
+
+class LazyModule(object):
+    '''
+    ## Description
+    ---
+    Placeholder for a module that is imported on first attribute access. If `namespace` is given, the placeholder
+    replaces itself with the module in `namespace[name]` (usually the `globals()` of the importing module) once
+    imported, so later uses of the name cost the same as with a regular import
+    '''
+
+    def __init__(self, module_name, namespace=None, name=None):
+        self._module_name = module_name
+        self._namespace = namespace
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._module_name)
+            if self._namespace is not None:
+                self._namespace[self._name] = self._module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return "<lazy module '{}'{}>".format(self._module_name, '' if self._module is None else ' (imported)')
+
+
+def lazy_import(module_name, namespace=None, name=None):
+    '''
+    ## Description
+    ---
+    Returns a `LazyModule` for `module_name`, e.g. `np = lazy_import('numpy', globals(), 'np')`
+    '''
+    return LazyModule(module_name, namespace, name)
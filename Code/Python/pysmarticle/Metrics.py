@@ -0,0 +1,177 @@
+# Metrics.py
+# Alex Samland
+# October 17, 2026
+# Module for counting and timing radio I/O, with snapshots and periodic export to file
+
+import bisect
+import json
+import threading
+import time
+
+
+class Histogram(object):
+    '''
+    ## Description
+    ---
+    Histogram of durations (s) with logarithmic buckets (4 per decade from 10us to 100s).
+    Percentiles are estimated as the upper bound of the bucket they fall in
+    '''
+    BOUNDS = [10**(e/4) for e in range(-20, 9)]
+
+    def __init__(self):
+        self.counts = [0]*(len(self.BOUNDS)+1)
+        self.n = 0
+        self.total = 0.
+        self.min = float('inf')
+        self.max = 0.
+
+    def observe(self, x):
+        self.counts[bisect.bisect_left(self.BOUNDS, x)] += 1
+        self.n += 1
+        self.total += x
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def merge(self, other):
+        for ii, c in enumerate(other.counts):
+            self.counts[ii] += c
+        self.n += other.n
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        if self.n == 0:
+            return 0.
+        rank = q/100*self.n
+        cumulative = 0
+        for ii, c in enumerate(self.counts):
+            cumulative += c
+            if cumulative >= rank and c:
+                return min(self.BOUNDS[ii], self.max) if ii < len(self.BOUNDS) else self.max
+        return self.max
+
+    def summary(self):
+        if self.n == 0:
+            return {'n': 0}
+        return {'n': self.n, 'mean': self.total/self.n, 'min': self.min, 'max': self.max,
+                'p50': self.percentile(50), 'p90': self.percentile(90), 'p99': self.percentile(99)}
+
+
+class Metrics(object):
+    '''
+    ## Description
+    ---
+    Thread safe collection of named counters and duration histograms. Names are dotted strings,
+    e.g. `tx_frames.broadcast` or `rx_msgs.S01`. `snapshot()` returns all values as a `dict` that can be
+    serialized to JSON, and `start_dump()` periodically appends snapshots to a file
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.t_start = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self._dump_thread = None
+        self._dump_exit = threading.Event()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0)+n
+
+    def observe(self, name, x):
+        with self.lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = self.histograms[name] = Histogram()
+            hist.observe(x)
+
+    def reset(self):
+        with self.lock:
+            self.t_start = time.time()
+            self.counters = {}
+            self.histograms = {}
+
+    @classmethod
+    def combine(cls, metrics):
+        '''
+        ## Description
+        ---
+        Returns a new `Metrics` with the counters and histograms of all `metrics` added up, e.g. of several radios.
+        Its uptime starts with the earliest of them
+        '''
+        combined = cls()
+        for m in metrics:
+            with m.lock:
+                combined.t_start = min(combined.t_start, m.t_start)
+                for name, value in m.counters.items():
+                    combined.counters[name] = combined.counters.get(name, 0)+value
+                for name, h in m.histograms.items():
+                    if name not in combined.histograms:
+                        combined.histograms[name] = Histogram()
+                    combined.histograms[name].merge(h)
+        return combined
+
+    def snapshot(self):
+        '''
+        ## Description
+        ---
+        Returns `dict` with `time`, `uptime_s`, `counters` (name to count) and `histograms` (name to summary)
+        '''
+        with self.lock:
+            now = time.time()
+            return {'time': now, 'uptime_s': now-self.t_start, 'counters': dict(sorted(self.counters.items())),
+                    'histograms': {name: h.summary() for name, h in sorted(self.histograms.items())}}
+
+    def start_dump(self, path, period_s=10, fmt='json', snapshot_fun=None):
+        '''
+        ## Description
+        ---
+        Starts a thread that appends a snapshot to `path` every `period_s`, and once more when `stop_dump()` is called
+
+        ## Arguments
+        ---
+
+        | Argument        | Type       | Description                                                          | Default Value |
+        | :------:        | :--:       | :---------:                                                          | :-----------: |
+        | path            | `string`   | file to append to                                                    | N/A           |
+        | period_s        | `float`    | time between snapshots                                               | 10            |
+        | fmt             | `string`   | 'json' (one JSON object per line) or 'text'                          | 'json'        |
+        | snapshot_fun    | function   | returns the snapshot `dict` to write; `snapshot()` if `None`         | `None`        |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+        '''
+        self.stop_dump()
+        if snapshot_fun is None:
+            snapshot_fun = self.snapshot
+        self._dump_exit = threading.Event()
+        exit_flag = self._dump_exit
+
+        def target():
+            while not exit_flag.wait(period_s):
+                self._write(path, fmt, snapshot_fun())
+            self._write(path, fmt, snapshot_fun())
+
+        self._dump_thread = threading.Thread(target=target, daemon=True)
+        self._dump_thread.start()
+
+    def stop_dump(self):
+        if self._dump_thread is not None:
+            self._dump_exit.set()
+            self._dump_thread.join()
+            self._dump_thread = None
+
+    @staticmethod
+    def _write(path, fmt, snap):
+        with open(path, 'a') as f:
+            if fmt == 'json':
+                f.write(json.dumps(snap)+'\n')
+                return
+            f.write('# {} (uptime {:.1f}s)\n'.format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snap['time'])), snap['uptime_s']))
+            for name, value in snap.get('counters', {}).items():
+                f.write('{:<40} {}\n'.format(name, value))
+            for name, value in snap.get('gauges', {}).items():
+                f.write('{:<40} {}\n'.format(name, value))
+            for name, h in snap.get('histograms', {}).items():
+                if h['n']:
+                    f.write('{:<40} n={n} mean={mean:.6f} p50={p50:.6f} p99={p99:.6f} max={max:.6f}\n'.format(name, **h))
+            f.write('\n')
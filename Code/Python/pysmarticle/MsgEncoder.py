@@ -0,0 +1,221 @@
+# MsgEncoder.py
+# Alex Samland
+# October 17, 2026
+# Module for encoding smarticle command frames with cached constant frames
+# and reusable buffers, used by SmarticleSwarm and XbeeComm
+
+import threading
+from LazyImport import lazy_import
+np = lazy_import('numpy', globals(), 'np')
+
+
+class MsgEncoder(object):
+    '''
+    ## Description
+    ---
+    Encodes messages in the format interpreted by `Smarticle::_interp_msg`:
+    `msg_prefix + [msg_code, values...] + msg_end`, with values offset by `ASCII_OFFSET`.
+
+    Frames that only depend on a single small value (e.g. `set_mode(2)`, `set_servos(1)`) are built once
+    and cached. Variable frames are written into preallocated buffers, and batch frames (`stream_pose`,
+    `set_plank`) are encoded from whole numpy arrays with vectorized operations.
+    All encoders return immutable `bytes`, so frames can safely be queued or reused by the caller.
+    '''
+    msg_code_dict = {'toggle_led': 0x20, 'set_mode': 0x21, 'toggle_t4_interrupt': 0x22,\
+        'set_transmit_counts': 0x23, 'select_gait': 0x24, 'toggle_read_sensors': 0x25,\
+        'toggle_transmit': 0x26, 'set_gait_epsilon': 0x27, 'set_pose_noise': 0x28,\
+        'toggle_light_plank': 0x29, 'set_debug': 0x2A, 'set_id': 0x2B, 'ping': 0x2C,\
+        'toggle_binary_transmit': 0x2D, 'set_pose': 0x30,\
+        'set_sync_noise': 0x31, 'set_stream_timing_noise': 0x32,\
+        'set_light_plank_threshold': 0x40, 'init_gait': 0x41, 'stream_pose': 0x42, 'set_plank': 0x43}
+    msg_prefix = bytes([0x13,0x13])
+    msg_end = bytes([0x0A])
+
+    ASCII_OFFSET = 32
+    # largest value that can be sent in a single character
+    MAX_VALUE = 0xFF-ASCII_OFFSET
+    # maximum payload of an xbee frame
+    MAX_PAYLOAD = 108
+    # size of a smarticle's message buffer (MAX_MSG_SIZE in Smarticle.h), holds a frame without '\n' plus '\0'
+    MAX_MSG_SIZE = 40
+    # prefix + msg_code + length character
+    BATCH_HEADER = 4
+
+    def __init__(self):
+        self._const = {}
+        self._lock = threading.Lock()
+        self._two = bytearray(self.msg_prefix+bytes(3)+self.msg_end)
+        # allocated on first use, so that encoders of single value messages do not import numpy
+        self._batch = None
+
+    @classmethod
+    def convert_to_2_chars(cls, val):
+        '''
+        ## Description
+        ---
+        Splits a 14 bit value into two 7 bit characters, see `Smarticle::_convert_to_16bit`
+        '''
+        val = int(val)&0x3ffff
+        return [(val>>7)+cls.ASCII_OFFSET, (val&0x7f)+cls.ASCII_OFFSET]
+
+    def frame(self, payload):
+        '''
+        ## Description
+        ---
+        Wraps an arbitrary raw payload (message code and already offset values) with prefix and end characters
+        '''
+        return self.msg_prefix+bytes(payload)+self.msg_end
+
+    def value_frame(self, name, value):
+        '''
+        ## Description
+        ---
+        Returns the cached frame for a message with a single value, building it on first use
+
+        ## Arguments
+        ---
+
+        | Argument        | Type       | Description                                 | Default Value |
+        | :------:        | :--:       | :---------:                                 | :-----------: |
+        | name            | `string`   | key of `msg_code_dict`                      | N/A           |
+        | value           | `int`      | value between 0 and `MAX_VALUE`             | N/A           |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+        '''
+        key = (name, value)
+        try:
+            return self._const[key]
+        except KeyError:
+            msg = self.frame([self.msg_code_dict[name], self.ASCII_OFFSET+int(value)])
+            self._const[key] = msg
+            return msg
+
+    def two_value_frame(self, name, v1, v2):
+        '''
+        ## Description
+        ---
+        Encodes a message with two single character values (e.g. `set_pose`) in a reusable buffer
+        '''
+        with self._lock:
+            buf = self._two
+            buf[2] = self.msg_code_dict[name]
+            buf[3] = self.ASCII_OFFSET+int(v1)
+            buf[4] = self.ASCII_OFFSET+int(v2)
+            return bytes(buf)
+
+    def wide_value_frame(self, name, values):
+        '''
+        ## Description
+        ---
+        Encodes a message whose values are each split into two 7 bit characters (e.g. `set_sync_noise`)
+        '''
+        payload = [self.msg_code_dict[name]]
+        for v in values:
+            payload += self.convert_to_2_chars(v)
+        return self.frame(payload)
+
+    def gait_frame(self, gait_num, delay_counts, gaitL, gaitR):
+        '''
+        ## Description
+        ---
+        Encodes an `init_gait` message; see `SmarticleSwarm.gait_init`
+        '''
+        assert len(gaitL)==len(gaitR),'Gait lists must be same length'
+        n = len(gaitL)
+        off = self.ASCII_OFFSET
+        payload = [self.msg_code_dict['init_gait'], gait_num+off, n+off]+self.convert_to_2_chars(delay_counts)
+        payload += [int(x)+off for x in gaitL]
+        payload += [int(x)+off for x in gaitR]
+        return self.frame(payload)
+
+    def batch_frame(self, name, arr):
+        '''
+        ## Description
+        ---
+        Encodes a batch message (`stream_pose` or `set_plank`) from an NxM integer array in one vectorized pass.
+        Each row is one entry, e.g. [id, angL, angR] for `stream_pose` or [id, state] for `set_plank`
+
+        ## Arguments
+        ---
+
+        | Argument        | Type       | Description                                 | Default Value |
+        | :------:        | :--:       | :---------:                                 | :-----------: |
+        | name            | `string`   | key of `msg_code_dict`                      | N/A           |
+        | arr             | `np.array` | NxM array of entries                        | N/A           |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+        '''
+        arr = np.asarray(arr)
+        if arr.ndim == 1:
+            arr = arr.reshape(1, -1)
+        n_rows = arr.shape[0]
+        n = arr.size
+        end = self.BATCH_HEADER+n
+        if end >= self.MAX_MSG_SIZE:
+            raise ValueError('Batch message with {} entries exceeds smarticle message buffer of {} bytes, use batch_frames()'.format(n_rows, self.MAX_MSG_SIZE))
+        if n and (arr.min() < 0 or arr.max() > self.MAX_VALUE):
+            raise ValueError('Values must be between 0 and {}'.format(self.MAX_VALUE))
+        with self._lock:
+            buf = self._batch
+            if buf is None:
+                buf = self._batch = np.zeros(self.MAX_PAYLOAD, dtype=np.uint8)
+                buf[:2] = list(self.msg_prefix)
+            buf[2] = self.msg_code_dict[name]
+            buf[3] = n_rows+self.ASCII_OFFSET
+            body = buf[self.BATCH_HEADER:end]
+            np.add(arr.reshape(-1), self.ASCII_OFFSET, out=body, casting='unsafe')
+            buf[end] = self.msg_end[0]
+            return buf[:end+1].tobytes()
+
+    def batch_capacity(self, width):
+        '''
+        ## Description
+        ---
+        Returns the maximum number of entries of `width` values that fit in one batch message
+        '''
+        return (self.MAX_MSG_SIZE-1-self.BATCH_HEADER)//width
+
+    def batch_frames(self, name, arr):
+        '''
+        ## Description
+        ---
+        Packs the entries of a batch message into the minimum number of messages that fit the smarticles'
+        message buffer, with entries spread evenly over the messages and kept in order
+
+        ## Returns
+        ---
+        `list` of `bytes` messages
+        '''
+        arr = np.asarray(arr)
+        if arr.ndim == 1:
+            arr = arr.reshape(1, -1)
+        capacity = self.batch_capacity(arr.shape[1])
+        n_frames = max(1, -(-arr.shape[0]//capacity))
+        if n_frames == 1:
+            return [self.batch_frame(name, arr)]
+        return [self.batch_frame(name, rows) for rows in np.array_split(arr, n_frames)]
+
+    def _poses(self, poses):
+        poses = np.asarray(poses)
+        if poses.ndim == 1 and poses.size == 2:
+            poses = np.array([[0, poses[0], poses[1]]])
+        return poses
+
+    def stream_frame(self, poses):
+        '''
+        ## Description
+        ---
+        Encodes a `stream_pose` message. `poses` is either an Nx3 array of [id, angL, angR] rows or a single
+        [angL, angR] pose, which is sent with id 0 (i.e. to all smarticles)
+        '''
+        return self.batch_frame('stream_pose', self._poses(poses))
+
+    def stream_frames(self, poses):
+        '''
+        ## Description
+        ---
+        Same as `stream_frame()` but packs any number of poses into as few messages as possible (11 poses per message)
+
+        ## Returns
+        ---
+        `list` of `bytes` messages
+        '''
+        return self.batch_frames('stream_pose', self._poses(poses))
@@ -0,0 +1,387 @@
+# MultiXbeeComm.py
+# Alex Samland
+# October 17, 2026
+# Module for communicating with a smarticle swarm over several local Xbee3s,
+# each serving its own share of the smarticles
+
+import os
+import json
+import threading
+from LazyImport import lazy_import
+np = lazy_import('numpy', globals(), 'np')
+from concurrent.futures import ThreadPoolExecutor
+from XbeeComm import XbeeComm
+from MsgEncoder import MsgEncoder
+from Metrics import Metrics
+from SendQueue import SendQueue, Dispatch
+
+
+class MultiXbeeComm(object):
+    '''
+    ## Description
+    ---
+    Drop in replacement for `XbeeComm` that spreads a swarm over several local XBees (e.g. on different serial ports
+    and channels), so that command and telemetry bandwidth grows with the number of radios.
+
+    Every radio is an `XbeeComm` (in `comms`) with its own I/O thread, and every smarticle is assigned to exactly one
+    radio. Broadcasts are sent by all radios in parallel, unicasts by the radio of the smarticle, and `ack_broadcast()`
+    unicasts to each radio's smarticles in parallel. Stream messages from `format_stream_msg()` only carry the rows of
+    each radio's own smarticles. With the send queue running (`start_send_queue()`), every radio is paced independently.
+
+    ## Arguments
+    ---
+
+    | Argument  | Type               | Description                                | Default Value |
+    | :------:  | :--:               | :---------:                                | :-----------: |
+    | ports     | `list` of `string` | USB ports of the local XBees               | `None`        |
+    | baud_rate | `int`              | Baud rate to use for USB serial ports      | 9600          |
+    | debug     | `int`              | Enables/disables print statements in class | 0             |
+    | bases     | `list`             | Objects used in place of `Raw802Device`s, e.g. `VirtualSwarm.VirtualRadio`s; ports are ignored if given | `None` |
+    | backend   | `string`           | Radio implementation of all radios, see `XbeeComm` | `None` |
+    |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+    '''
+
+    def __init__(self, ports=None, baud_rate=9600, debug=0, bases=None, backend=None):
+        if bases is None:
+            self.comms = [XbeeComm(port, baud_rate, debug, backend=backend) for port in ports]
+        else:
+            self.comms = [XbeeComm(baud_rate=baud_rate, debug=debug, base=base, backend=backend) for base in bases]
+        for ii, comm in enumerate(self.comms):
+            comm.radio_index = ii
+        self.baud_rate = baud_rate
+        self.debug = debug
+        self.encoder = MsgEncoder()
+        self.radio_of = {}
+        self._lock = threading.Lock()
+        # one thread per radio, so frames to each radio stay in order and radios transmit in parallel
+        self._io = [ThreadPoolExecutor(max_workers=1, thread_name_prefix='radio{}'.format(ii)) for ii in range(len(self.comms))]
+
+    @property
+    def devices(self):
+        '''
+        `dict` of smarticle number to remote device of all radios
+        '''
+        devices = {}
+        for comm in self.comms:
+            devices.update(comm.devices)
+        return devices
+
+    @devices.setter
+    def devices(self, devices):
+        # devices keep the radio they were assigned to, new devices are added to the first radio
+        for comm in self.comms:
+            comm.devices = {}
+        for n, remote in devices.items():
+            self.comms[self.radio_of.get(n, 0)].devices[n] = remote
+        self._update_radio_of()
+
+    @property
+    def base(self):
+        '''
+        `list` of the local XBees (or their stand ins) of all radios
+        '''
+        return [comm.base for comm in self.comms]
+
+    @property
+    def concurrent_ack(self):
+        '''
+        Default of `ack_broadcast(concurrent=None)`, set on all radios
+        '''
+        return all(comm.concurrent_ack for comm in self.comms)
+
+    @concurrent_ack.setter
+    def concurrent_ack(self, concurrent):
+        for comm in self.comms:
+            comm.concurrent_ack = concurrent
+
+    @property
+    def latency_compensation(self):
+        '''
+        64 bit address -> one way latency (s) by which unicasts with a deadline are sent early, set on all radios
+        '''
+        return {addr: s for comm in self.comms for addr, s in comm.latency_compensation.items()}
+
+    @latency_compensation.setter
+    def latency_compensation(self, compensation):
+        for comm in self.comms:
+            comm.latency_compensation = dict(compensation)
+
+    @property
+    def broadcast_compensation(self):
+        '''
+        One way latency (s) by which broadcasts with a deadline are sent early, set on all radios
+        '''
+        return max(comm.broadcast_compensation for comm in self.comms)
+
+    @broadcast_compensation.setter
+    def broadcast_compensation(self, compensation):
+        for comm in self.comms:
+            comm.broadcast_compensation = compensation
+
+    @property
+    def send_queue(self):
+        '''
+        `list` of the `SendQueue`s of all radios, `None` if the send queues are not running
+        '''
+        queues = [comm.send_queue for comm in self.comms if comm.send_queue is not None]
+        return queues if queues else None
+
+    def _update_radio_of(self):
+        with self._lock:
+            self.radio_of = {n: ii for ii, comm in enumerate(self.comms) for n in comm.devices}
+
+    def _fan_out(self, fun, args_list):
+        # calls fun(*args) for every (radio index, args) pair on the I/O thread of the radio, returns results in order
+        if len(args_list) == 1:
+            return [fun(*args_list[0][1])]
+        futures = [self._io[ii].submit(fun, *args) for ii, args in args_list]
+        return [f.result() for f in futures]
+
+    def _fan_out_all(self, fun, *args):
+        return self._fan_out(fun, [(ii, (comm,)+args) for ii, comm in enumerate(self.comms)])
+
+    def owner(self, remote_device):
+        '''
+        ## Description
+        ---
+        Returns the `XbeeComm` of the radio that serves `remote_device`
+        '''
+        for comm in self.comms:
+            if remote_device in comm.devices.values():
+                return comm
+        raise AssertionError("Remote Device not found in active devices")
+
+    def open_base(self):
+        return min(comm.open_base() for comm in self.comms)
+
+    def close_base(self):
+        for comm in self.comms:
+            comm.close_base()
+        for io in self._io:
+            io.shutdown(wait=False)
+
+    def discover(self, clear=True, timeout=15):
+        '''
+        ## Description
+        ---
+        Runs network discovery on all radios in parallel. A smarticle found by several radios is assigned to the one
+        serving the fewest smarticles; see `XbeeComm.discover()` for arguments
+        '''
+        self._fan_out_all(lambda comm: comm.discover(clear, timeout))
+        seen = {}
+        for ii, comm in enumerate(self.comms):
+            for n in list(comm.devices):
+                seen.setdefault(n, []).append(ii)
+        load = [0]*len(self.comms)
+        for n in sorted(seen, key=lambda n: len(seen[n])):
+            radios = seen[n]
+            keep = min(radios, key=lambda ii: load[ii])
+            load[keep] += 1
+            for ii in radios:
+                if ii != keep:
+                    self.comms[ii].devices.pop(n)
+        self._update_radio_of()
+
+    def save_devices(self, cache_file):
+        '''
+        ## Description
+        ---
+        Saves devices of all radios to a JSON file (see `XbeeComm.save_devices()`), including the radio of each smarticle
+        '''
+        records = [{'number': n, 'node_id': dev.get_node_id(), 'address': str(dev.get_64bit_addr()), 'radio': ii}
+                   for ii, comm in enumerate(self.comms) for n, dev in sorted(comm.devices.items())]
+        with open(cache_file, 'w') as f:
+            json.dump({'devices': records}, f, indent=1)
+
+    def load_devices(self, cache_file, verify=True, verify_timeout=1.0):
+        '''
+        ## Description
+        ---
+        Restores devices saved with `save_devices()` to the radio they were assigned to; see `XbeeComm.load_devices()`
+        '''
+        if not os.path.exists(cache_file):
+            return {}
+        with open(cache_file) as f:
+            records = json.load(f)['devices']
+        for r in records:
+            comm = self.comms[min(r.get('radio', 0), len(self.comms)-1)]
+            remote = comm._remote_from_record(r['address'], r['node_id'])
+            setattr(comm, r['node_id'], remote)
+            comm.devices[r['number']] = remote
+        missing = {}
+        if verify:
+            for ii, comm in enumerate(self.comms):
+                if not comm.devices:
+                    continue
+                timeout = comm.base.get_sync_ops_timeout()
+                comm.base.set_sync_ops_timeout(verify_timeout)
+                try:
+                    report = comm.ack_broadcast(b'\n', concurrent=True)
+                finally:
+                    comm.base.set_sync_ops_timeout(timeout)
+                for n, r in report.items():
+                    if r['status'] != 'ok':
+                        missing[n] = comm.devices.pop(n).get_node_id()
+        self._update_radio_of()
+        return missing
+
+    def send(self, remote_device, msg, asynch=False):
+        return self.owner(remote_device).send(remote_device, msg, asynch)
+
+    def broadcast(self, msg):
+        '''
+        ## Description
+        ---
+        Broadcasts message from all radios in parallel and returns when all radios have sent it
+        '''
+        self._fan_out_all(lambda comm: comm.broadcast(msg))
+
+    def ack_broadcast(self, msg, concurrent=None):
+        '''
+        ## Description
+        ---
+        Unicasts message to every smarticle, the radios in parallel; see `XbeeComm.ack_broadcast()`
+
+        ## Returns
+        ---
+        Delivery report of all radios
+        '''
+        report = {}
+        for r in self._fan_out_all(lambda comm: comm.ack_broadcast(msg, concurrent)):
+            report.update(r)
+        return report
+
+    def _route(self, fun, msg, remote_device, asynch):
+        # sends msg (or per radio messages from format_stream_msg) with fun(comm, msg, remote_device, asynch)
+        if remote_device is None or (isinstance(remote_device, bool) and remote_device):
+            if isinstance(msg, dict):
+                args_list = [(ii, (self.comms[ii], m, remote_device, asynch)) for ii, m in msg.items()]
+            else:
+                args_list = [(ii, (comm, msg, remote_device, asynch)) for ii, comm in enumerate(self.comms)]
+            results = self._fan_out(fun, args_list) if args_list else []
+            if isinstance(remote_device, bool) and results and all(isinstance(r, dict) for r in results):
+                report = {}
+                for r in results:
+                    report.update(r)
+                return report
+            # Dispatches of the messages queued on every radio
+            queued = [r for r in results if isinstance(r, Dispatch)]
+            return queued or None
+        comm = self.owner(remote_device)
+        if isinstance(msg, dict):
+            msg = msg.get(self.comms.index(comm))
+            if msg is None:
+                return None
+        return fun(comm, msg, remote_device, asynch)
+
+    def command(self, msg, remote_device=None, asynch=False, priority=SendQueue.COMMAND, deadline=None):
+        '''
+        ## Description
+        ---
+        Same as `XbeeComm.command()`. `msg` may also be a `dict` of radio index to message as returned by
+        `format_stream_msg()`, in which case every radio sends its own message. Acknowledged broadcasts return the
+        delivery reports of all radios merged; other broadcasts queued with the send queue running return the `list` of
+        `Dispatch`es of all radios
+        '''
+        return self._route(lambda comm, *args: comm.command(*args, priority, deadline), msg, remote_device, asynch)
+
+    def command_now(self, msg, remote_device=None, asynch=False):
+        return self._route(lambda comm, *args: comm.command_now(*args), msg, remote_device, asynch)
+
+    def format_stream_msg(self, poses):
+        '''
+        ## Description
+        ---
+        Formats stream pose messages for every radio containing only the rows of the radio's smarticles.
+        Rows with id 0 (all smarticles) or of unknown smarticles are sent by all radios
+
+        ## Returns
+        ---
+        `dict` of radio index to `bytes` message, to be sent with `command()`
+        '''
+        if len(self.comms) == 1:
+            return {0: self.comms[0].format_stream_msg(poses)}
+        poses = np.asarray(poses)
+        if poses.ndim == 1:
+            msg = self.comms[0].format_stream_msg(poses)
+            return {ii: msg for ii in range(len(self.comms))}
+        radio_of = self.radio_of
+        radio = np.array([radio_of.get(int(n), -1) for n in poses[:, 0]])
+        msgs = {}
+        for ii in range(len(self.comms)):
+            rows = poses[(radio == ii) | (radio == -1)]
+            if len(rows):
+                msgs[ii] = self.comms[ii].format_stream_msg(rows)
+        return msgs
+
+    def start_send_queue(self, consume_s=0.02, buffer_depth=4):
+        return [comm.start_send_queue(consume_s, buffer_depth) for comm in self.comms]
+
+    def stop_send_queue(self):
+        for comm in self.comms:
+            comm.stop_send_queue()
+
+    def flush(self, timeout=None):
+        return all([comm.flush(timeout) for comm in self.comms])
+
+    @property
+    def metrics(self):
+        '''
+        `Metrics` with the counters and histograms of all radios added up. This is a copy: metrics are recorded
+        in the `metrics` of each radio in `comms`
+        '''
+        return Metrics.combine([comm.metrics for comm in self.comms])
+
+    def stats(self):
+        '''
+        ## Description
+        ---
+        Returns a snapshot of the I/O metrics of all radios, see `XbeeComm.stats()`. Counters and histograms are added
+        up over the radios; since the radios send in parallel, `link_utilization` is that of the busiest radio and
+        `send_queue_pending` is the total. The `XbeeComm.stats()` snapshot of every radio is under `radios`
+        '''
+        radios = [comm.stats() for comm in self.comms]
+        snap = self.metrics.snapshot()
+        snap['gauges'] = {'link_utilization': max(r['gauges']['link_utilization'] for r in radios),
+                          'send_queue_pending': sum(r['gauges']['send_queue_pending'] for r in radios)}
+        snap['radios'] = radios
+        return snap
+
+    def start_stats_dump(self, path, period_s=10, fmt='json'):
+        '''
+        ## Description
+        ---
+        Appends a `stats()` snapshot to file `path` every `period_s`, see `XbeeComm.start_stats_dump()`
+        '''
+        if fmt == 'text':
+            for ii, comm in enumerate(self.comms):
+                comm.start_stats_dump('{}.radio{}'.format(path, ii), period_s, fmt)
+        else:
+            self.comms[0].metrics.start_dump(path, period_s, fmt, self.stats)
+
+    def stop_stats_dump(self):
+        for comm in self.comms:
+            comm.stop_stats_dump()
+
+    def add_rx_callback(self, callback_fun):
+        for comm in self.comms:
+            comm.add_rx_callback(callback_fun)
+
+    def del_rx_callback(self, callback_fun):
+        for comm in self.comms:
+            comm.del_rx_callback(callback_fun)
+
+    def add_tx_callback(self, callback_fun, with_radio=False):
+        '''
+        ## Description
+        ---
+        Adds a callback function that is called with every outbound frame of every radio, see
+        `XbeeComm.add_tx_callback()`. With `with_radio`, the index of the sending radio in `comms` is passed as
+        keyword `radio`
+        '''
+        for comm in self.comms:
+            comm.add_tx_callback(callback_fun, with_radio)
+
+    def del_tx_callback(self, callback_fun):
+        for comm in self.comms:
+            comm.del_tx_callback(callback_fun)
@@ -0,0 +1,152 @@
+# PlankController.py
+# Alex Samland
+# October 17, 2026
+# Module for closed loop planking of the whole swarm from the host, based on the smarticles' telemetry
+
+import threading
+import time
+from DeadlineTimer import DeadlineTimer, RunningStats
+from SendQueue import SendQueue, Dispatch
+from LazyImport import lazy_import
+np = lazy_import('numpy', globals(), 'np')
+
+
+def threshold_policy(thresholds, hysteresis=0):
+    '''
+    ## Description
+    ---
+    Returns a policy that planks a smarticle when any sensor value reaches its threshold, like the firmware's light
+    planking, and deplanks it once all values are below their thresholds minus `hysteresis`
+
+    ## Arguments
+    ---
+
+    | Argument        | Type       | Description                                                          | Default Value |
+    | :------:        | :--:       | :---------:                                                          | :-----------: |
+    | thresholds      | array like | [photo_front, photo_back, photo_right, current] thresholds; use `np.inf` to ignore a sensor | N/A |
+    | hysteresis      | `float`    | distance below the thresholds at which planking ends                 | 0             |
+    |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+    '''
+    thresholds = np.asarray(thresholds, dtype=float)
+
+    def policy(t, ids, samples, state):
+        values = samples[:, 1:]
+        on = np.any(values >= thresholds, axis=1)
+        off = np.all(values < thresholds-hysteresis, axis=1)
+        return np.where(on, 1, np.where(off, 0, state))
+    return policy
+
+
+class PlankController(threading.Thread):
+    '''
+    ## Description
+    ---
+    Thread that evaluates a plank policy for all smarticles at once every `period_ms` and sends the resulting plank
+    states with batched `set_plank` messages.
+
+    Every tick, the latest sample of every smarticle is taken from `telemetry` (`Telemetry.latest_all()`) and
+    `policy(t, ids, samples, state)` is called with the time, the N smarticle numbers, the Nx5 array of samples
+    (`[timestamp, photo_front, photo_back, photo_right, current]`) and the current plank states. It returns the N new
+    states (0 or 1). Smarticles without samples newer than `max_age_s` keep their state. Only states that changed are
+    sent, plus every state once every `refresh_ticks` ticks (staggered by smarticle number) in case a message was lost.
+
+    Messages are queued with `SendQueue.STREAM` priority. At 9600 baud a `set_plank` message occupies the link for
+    longer than a 10 ms tick, so while the previous tick's message is still waiting in the send queue, changes are held
+    and sent with the next tick, i.e. only the latest states are ever sent and the queue does not grow.
+
+    Disable the firmware's light planking (`set_light_plank(0)`) when using this controller.
+
+    ## Arguments
+    ---
+
+    | Argument        | Type        | Description                                                          | Default Value |
+    | :------:        | :--:        | :---------:                                                          | :-----------: |
+    | xbee            | `XbeeComm`  | radio to send on                                                     | N/A           |
+    | telemetry       | `Telemetry` | telemetry of the smarticles, see `SmarticleSwarm.start_telemetry()`  | N/A           |
+    | policy          | function    | plank policy, see above and `threshold_policy()`                     | N/A           |
+    | period_ms       | `int`       | controller period                                                    | 10            |
+    | ids             | `list`      | smarticle numbers to control; all devices of `xbee` if `None`        | `None`        |
+    | max_age_s       | `float`     | samples older than this are ignored                                  | 0.1           |
+    | refresh_ticks   | `int`       | every state is resent at least once every `refresh_ticks` ticks      | 100           |
+    | encoder         | `MsgEncoder`| encoder of `set_plank` messages; `xbee.encoder` if `None`            | `None`        |
+    |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+    '''
+
+    def __init__(self, xbee, telemetry, policy, period_ms=10, ids=None, max_age_s=0.1, refresh_ticks=100, encoder=None):
+        self.xb = xbee
+        self.telemetry = telemetry
+        self.policy = policy
+        self.period_s = round(period_ms/1000, 3)
+        self.ids = sorted(xbee.devices.keys()) if ids is None else list(ids)
+        self.max_age_s = max_age_s
+        self.refresh_ticks = max(int(refresh_ticks), 1)
+        self.encoder = xbee.encoder if encoder is None else encoder
+        self.state = np.zeros(len(self.ids), dtype=int)
+        # -1: never sent
+        self._sent = np.full(len(self.ids), -1, dtype=int)
+        self._inflight = []
+        self.timer = DeadlineTimer(self.period_s)
+        self.eval_time = RunningStats()
+        self.counts = {'frames': 0, 'entries': 0, 'held': 0}
+        self.exit_flag = threading.Event()
+        super().__init__(target=self.target_function, daemon=True)
+
+    def kill(self):
+        self.exit_flag.set()
+
+    def stats(self):
+        '''
+        ## Description
+        ---
+        Returns timing statistics of the controller (see `DeadlineTimer.stats()`), the time taken per tick to
+        evaluate the policy and encode the messages (`eval_s`), and the number of messages and entries sent and of
+        ticks whose changes were held because the previous message was still queued
+        '''
+        stats = self.timer.stats()
+        stats['eval_s'] = self.eval_time.summary()
+        stats.update(self.counts)
+        return stats
+
+    def step(self, tick=0):
+        '''
+        ## Description
+        ---
+        Evaluates the policy once for tick `tick`
+
+        ## Returns
+        ---
+        (`list` of `set_plank` messages, boolean mask of the smarticles they contain), or `None` if nothing is to be sent
+        '''
+        now = time.time()
+        ids, samples = self.telemetry.latest_all(self.ids)
+        fresh = now-samples[:, 0] <= self.max_age_s
+        if np.any(fresh):
+            new_state = np.asarray(self.policy(now, ids, samples, self.state)).astype(int)
+            self.state = np.where(fresh, new_state, self.state)
+        ids = np.asarray(ids)
+        send = (self.state != self._sent) | ((ids+tick)%self.refresh_ticks == 0)
+        if not np.any(send):
+            return None
+        entries = np.column_stack((ids[send], self.state[send]))
+        return self.encoder.batch_frames('set_plank', entries), send
+
+    def target_function(self):
+        self.timer.start()
+        while not self.exit_flag.is_set():
+            tick = self.timer.wait()
+            t0 = time.monotonic()
+            if any(d.t_done is None for d in self._inflight):
+                # previous message still queued: keep changes for the next tick
+                self.counts['held'] += 1
+                continue
+            out = self.step(tick)
+            if out is not None:
+                msgs, send = out
+                deadline = self.timer.t_start+tick*self.period_s
+                queued = self.xb.command(msgs, None, priority=SendQueue.STREAM, deadline=deadline)
+                queued = queued if isinstance(queued, list) else [queued]
+                self._inflight = [d for d in queued if isinstance(d, Dispatch)]
+                self._sent[send] = self.state[send]
+                self.counts['frames'] += len(msgs)
+                self.counts['entries'] += int(np.count_nonzero(send))
+            self.eval_time.update(time.monotonic()-t0)
@@ -0,0 +1,83 @@
+# PoseDelta.py
+# Alex Samland
+# October 17, 2026
+# Module for sending only the stream poses that changed since they were last sent
+
+from LazyImport import lazy_import
+np = lazy_import('numpy', globals(), 'np')
+
+
+class PoseDelta(object):
+    '''
+    ## Description
+    ---
+    Filters stream poses so that only entries whose commanded pose changed since they were last sent are transmitted.
+    Smarticles hold their last streamed pose, so unchanged entries can be skipped. To recover from lost frames,
+    every entry is also resent once every `refresh_ticks` ticks; refreshes are staggered by smarticle id, so they are
+    spread over the refresh period instead of producing one full frame burst.
+
+    Used by `StreamThread` and `SmarticleSwarm.stream_pose` with their `delta` argument.
+
+    ## Arguments
+    ---
+
+    | Argument        | Type       | Description                                                          | Default Value |
+    | :------:        | :--:       | :---------:                                                          | :-----------: |
+    | refresh_ticks   | `int`      | every entry is resent at least once every `refresh_ticks` ticks      | 50            |
+    |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+    '''
+    # ids are sent as single characters
+    N_IDS = 256
+
+    def __init__(self, refresh_ticks=50):
+        self.refresh_ticks = max(int(refresh_ticks), 1)
+        self.reset()
+
+    def reset(self):
+        '''
+        ## Description
+        ---
+        Forgets all sent poses, so that the next update sends every entry
+        '''
+        self.tick = 0
+        self._last = np.full((self.N_IDS, 2), -1, dtype=int)
+        self.stats = {'ticks': 0, 'entries': 0, 'sent': 0}
+
+    def update(self, poses):
+        '''
+        ## Description
+        ---
+        Returns the entries of `poses` to send this tick and advances the tick
+
+        ## Arguments
+        ---
+
+        | Argument        | Type       | Description                                                          | Default Value |
+        | :------:        | :--:       | :---------:                                                          | :-----------: |
+        | poses           | `np.array` | Nx3 array of [id, angL, angR] rows, or a single [angL, angR] pose for all smarticles (id 0) | N/A |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        Kx3 `np.array` of the rows that changed or are due for a refresh (K may be 0)
+        '''
+        poses = np.asarray(poses).astype(int)
+        if poses.ndim == 1 and poses.size == 2:
+            poses = np.array([[0, poses[0], poses[1]]])
+        ids = poses[:, 0]
+        send = np.any(self._last[ids] != poses[:, 1:], axis=1)
+        send |= (ids+self.tick)%self.refresh_ticks == 0
+        out = poses[send]
+        broadcast = out[:, 0] == 0
+        if np.any(broadcast):
+            # every smarticle takes an id 0 pose. Smarticles apply the first row matching them, so whether rows sent
+            # along with it take effect depends on their order: they are resent next tick
+            self._last[:] = out[broadcast][0, 1:]
+            self._last[out[~broadcast, 0]] = -1
+        else:
+            self._last[out[:, 0]] = out[:, 1:]
+        self.tick += 1
+        self.stats['ticks'] += 1
+        self.stats['entries'] += len(poses)
+        self.stats['sent'] += len(out)
+        return out
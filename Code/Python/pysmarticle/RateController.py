@@ -0,0 +1,213 @@
+# RateController.py
+# Alex Samland
+# October 17, 2026
+# Module for adapting the telemetry transmit periods of the smarticles to the capacity of the radio link
+
+import math
+import threading
+import time
+
+
+class RateController(threading.Thread):
+    '''
+    ## Description
+    ---
+    Thread that keeps the telemetry of the swarm below a target utilization of the serial link of each radio.
+
+    Every `interval_s` it measures, per smarticle, the received samples (see `Telemetry.count()`), frames and bytes
+    (`rx_msgs.<node id>` and `rx_bytes.<node id>` of `XbeeComm.stats()`). From these it computes the link bytes per
+    sample (API frame overhead included), the sample rate, the link utilization and the loss. For binary records (see
+    `Telemetry`) the loss is the fraction of records missing from their sequence numbers (`Telemetry.lost()`). Text
+    samples carry no sequence number, so their loss is the fraction of the samples expected from the transmit period
+    that did not arrive, only estimated once `MIN_EXPECTED` samples are expected so that single missing samples do
+    not make it jump.
+
+    Of `target_utilization`, the share `command_share` is reserved for commands: with the send queue running,
+    `SendQueue.set_command_budget()` is set to it. The rest is split evenly between the smarticles of each radio, and
+    each smarticle's transmit period is set (with `SmarticleSwarm.set_transmit_period()`) so that its samples fit in its
+    share. Periods are multiples of `SmarticleSwarm.SAMPLE_TIME_MS` within [`min_period_ms`, `max_period_ms`].
+    Smarticles losing more than `max_loss` of their samples get their period multiplied by `backoff` at every
+    interval, which is slowly undone once the loss is gone. Periods are only sent when they change by more than
+    `TOLERANCE`.
+
+    The chosen periods and measurements are returned by `rates()`.
+
+    ## Arguments
+    ---
+
+    | Argument           | Type             | Description                                                       | Default Value |
+    | :------:           | :--:             | :---------:                                                       | :-----------: |
+    | swarm              | `SmarticleSwarm` | swarm whose telemetry is controlled                               | N/A           |
+    | target_utilization | `float`          | fraction of the link capacity to use                              | 0.7           |
+    | command_share      | `float`          | share of `target_utilization` reserved for commands               | 0.2           |
+    | interval_s         | `float`          | time between updates of the transmit periods                      | 1.0           |
+    | min_period_ms      | `int`            | shortest transmit period                                          | 10            |
+    | max_period_ms      | `int`            | longest transmit period                                           | 2000          |
+    | max_loss           | `float`          | fraction of lost samples above which a smarticle backs off        | 0.1           |
+    | backoff            | `float`          | factor applied to the period of a smarticle losing samples        | 1.5           |
+    | baud_rate          | `int`            | baud rate of the serial link to the local XBee; the swarm's if `None` | `None`    |
+    |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+    '''
+    # bytes added by the API frame around the payload of a 64 bit receive packet
+    RX_FRAME_OVERHEAD = 15
+    # link bytes per sample assumed before any samples were received: longest text sample in its own frame
+    DEFAULT_SAMPLE_BYTES = 20+RX_FRAME_OVERHEAD
+    # relative change below which a period is not resent, so that measurement noise does not use the command budget
+    TOLERANCE = 0.1
+    # fewest text samples expected in an interval for their loss to be estimated; a missing sample then changes the
+    # loss by at most 1/MIN_EXPECTED
+    MIN_EXPECTED = 50
+
+    def __init__(self, swarm, target_utilization=0.7, command_share=0.2, interval_s=1.0, min_period_ms=10,
+                 max_period_ms=2000, max_loss=0.1, backoff=1.5, baud_rate=None):
+        self.swarm = swarm
+        self.telemetry = swarm.start_telemetry()
+        self.target_utilization = target_utilization
+        self.command_share = command_share
+        self.interval_s = interval_s
+        self.step_ms = swarm.SAMPLE_TIME_MS
+        self.min_period_ms = max(min_period_ms, self.step_ms)
+        self.max_period_ms = max_period_ms
+        self.max_loss = max_loss
+        self.backoff = backoff
+        self.capacity = (swarm.xb.baud_rate if baud_rate is None else baud_rate)/10
+        self.lock = threading.Lock()
+        # smarticle number -> transmit period sent (ms)
+        self.periods = {}
+        # smarticle number -> backoff factor (>= 1) of its period
+        self._factor = {}
+        # smarticle number -> (time, samples, frames, bytes, records, lost records) at the last update
+        self._last = {}
+        # smarticle number -> bytes per sample measured at the last update
+        self._cost = {}
+        self._changed = set()
+        self._devices = {}
+        self._radios = []
+        self.exit_flag = threading.Event()
+        super().__init__(target=self.target_function, daemon=True)
+
+    def kill(self):
+        self.exit_flag.set()
+
+    def _comms(self):
+        return getattr(self.swarm.xb, 'comms', [self.swarm.xb])
+
+    def command_budget(self):
+        '''
+        ## Description
+        ---
+        Returns the fraction of link time reserved for commands
+        '''
+        return self.target_utilization*self.command_share
+
+    def target_function(self):
+        for comm in self._comms():
+            if comm.send_queue is not None:
+                comm.send_queue.set_command_budget(self.command_budget())
+        try:
+            while True:
+                self.update()
+                if self.exit_flag.wait(self.interval_s):
+                    break
+        finally:
+            for comm in self._comms():
+                if comm.send_queue is not None:
+                    comm.send_queue.set_command_budget(None)
+
+    def _period(self, cost, share, factor):
+        period = 1000*cost/share*factor if share > 0 else self.max_period_ms
+        period = int(math.ceil(period/self.step_ms))*self.step_ms
+        return min(max(period, self.min_period_ms), self.max_period_ms)
+
+    def update(self):
+        '''
+        ## Description
+        ---
+        Measures the telemetry since the last update and sends the transmit periods that changed; called every
+        `interval_s` by the thread
+        '''
+        devices = {}
+        radios = []
+        telemetry_budget = self.target_utilization-self.command_budget()
+        for comm in self._comms():
+            snap = comm.stats()
+            counters = snap['counters']
+            remotes = dict(comm.devices)
+            share = telemetry_budget*self.capacity/len(remotes) if remotes else 0.
+            # periods are not changed while earlier commands are still waiting for the command budget
+            backlog = comm.send_queue is not None and comm.send_queue.pending() > len(remotes)
+            now = time.monotonic()
+            utilization = 0.
+            for n, remote in sorted(remotes.items()):
+                node_id = str(remote.get_node_id())
+                current = (now, self.telemetry.count(n), counters.get('rx_msgs.'+node_id, 0),
+                           counters.get('rx_bytes.'+node_id, 0), self.telemetry.records(n), self.telemetry.lost(n))
+                last = self._last.get(n)
+                period = self.periods.get(n)
+                factor = self._factor.get(n, 1.)
+                device = {'name': node_id, 'rate_hz': None, 'loss': None, 'utilization': None}
+                if last is not None:
+                    dt = current[0]-last[0]
+                    samples, frames, n_bytes, records, lost = [c-l for c, l in zip(current[1:], last[1:])]
+                    link_bytes = n_bytes+frames*self.RX_FRAME_OVERHEAD
+                    if samples:
+                        self._cost[n] = link_bytes/samples
+                    device['rate_hz'] = samples/dt
+                    device['utilization'] = link_bytes/dt/self.capacity
+                    utilization += device['utilization']
+                    expected = dt*1000/period if period else 0
+                    loss = None
+                    if records:
+                        # binary records: missing records are counted from gaps in their sequence numbers
+                        loss = lost/(records+lost)
+                    elif period and n not in self._changed and expected < self.MIN_EXPECTED:
+                        # too few samples to estimate the loss: keep measuring from the same start
+                        current = last
+                    elif period and n not in self._changed and frames:
+                        # firmware periods are approximate, so the loss is only indicative. Silent smarticles
+                        # (transmit off) are not counted as losing samples
+                        loss = max(0., 1-samples/expected)
+                    if loss is not None:
+                        device['loss'] = loss
+                        if loss > self.max_loss:
+                            factor *= self.backoff
+                        else:
+                            factor = max(1., factor/math.sqrt(self.backoff))
+                        self._factor[n] = factor
+                self._last[n] = current
+                cost = self._cost.get(n, self.DEFAULT_SAMPLE_BYTES)
+                new_period = self._period(cost, share, factor)
+                self._changed.discard(n)
+                if period is None or (not backlog and abs(new_period-period) > self.TOLERANCE*period):
+                    self.swarm.set_transmit_period(new_period, remote)
+                    self.periods[n] = new_period
+                    self._changed.add(n)
+                device.update({'period_ms': self.periods[n], 'bytes_per_sample': cost, 'backoff': factor})
+                devices[n] = device
+            radios.append({'devices': sorted(remotes.keys()), 'telemetry_budget': telemetry_budget,
+                           'command_budget': self.command_budget(),
+                           'telemetry_utilization': utilization,
+                           'link_utilization': snap['gauges']['link_utilization']})
+        with self.lock:
+            self._devices = devices
+            self._radios = radios
+
+    def rates(self):
+        '''
+        ## Description
+        ---
+        Returns the state of the controller at the last update
+
+        ## Returns
+        ---
+        `dict` with keys:<br/>
+            &emsp; `devices`: smarticle number to `dict` with the node ID (`name`), chosen transmit period (`period_ms`),
+            measured sample rate (`rate_hz`), fraction of lost samples (`loss`), link bytes per sample
+            (`bytes_per_sample`), fraction of the link capacity used by its telemetry (`utilization`) and
+            backoff factor of its period (`backoff`); measurements are `None` before the second update<br/>
+            &emsp; `radios`: per radio, its smarticle numbers (`devices`), the fractions of link capacity reserved for
+            telemetry and commands (`telemetry_budget`, `command_budget`), the measured `telemetry_utilization` and the
+            host `link_utilization` of `XbeeComm.stats()`
+        '''
+        with self.lock:
+            return {'devices': dict(self._devices), 'radios': list(self._radios)}
@@ -0,0 +1,232 @@
+# Recorder.py
+# Alex Samland
+# October 17, 2026
+# Module for logging telemetry, plank events and outbound commands to disk
+# in chunked columnar .npy files from a background writer thread
+
+import os
+import glob
+import queue
+import threading
+import time
+from LazyImport import lazy_import
+np = lazy_import('numpy', globals(), 'np')
+from Telemetry import Telemetry
+
+
+class Recorder(threading.Thread):
+    '''
+    ## Description
+    ---
+    Records received sensor telemetry, plank events (`PLANK 0/1` lines) and outbound frames to disk.
+
+    The receive and transmit callbacks (`record_rx` and `record_tx`) only put the raw data on a queue, so they
+    do not block the digi reader thread; parsing and writing is done by this thread.
+    Every stream is stored in its own directory with one `.npy` file per column and chunk
+    (`<path>/<stream>/<column>_<chunk>.npy`). A chunk is written when `chunk_size` rows are collected,
+    every `flush_period_s` and when the recorder is stopped. Use `load_recording()` to read a recording.
+    Errors while parsing or writing are counted in `stats['errors']` (the last one is kept in `error`) and reported
+    by `stop()`; rows of a chunk that could not be written are dropped and recording goes on.
+
+    | Stream      | Columns                                                                  |
+    | :------:    | :--:                                                                     |
+    | telemetry   | t, id, photo_front, photo_back, photo_right, current                     |
+    | plank       | t, id, state                                                             |
+    | commands    | t, t_mono, dest (64 bit address, 0xFFFF for broadcast), radio, length, payload |
+    |<img width=250/>|<img width=1000/>|
+
+    `t` is `time.time()` at reception/transmission, `t_mono` is `time.monotonic()`, `radio` is the index of the
+    sending radio with several radios (see `MultiXbeeComm`).
+
+    ## Arguments
+    ---
+
+    | Argument        | Type       | Description                                                          | Default Value |
+    | :------:        | :--:       | :---------:                                                          | :-----------: |
+    | path            | `string`   | directory to write recording to                                      | N/A           |
+    | chunk_size      | `int`      | maximum number of rows per chunk file                                | 65536         |
+    | flush_period_s  | `float`    | maximum time data is held in memory before it is written             | 10            |
+    |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+    '''
+    BROADCAST_ADDR = 0xFFFF
+    MAX_PAYLOAD = 108
+    STREAMS = {
+        'telemetry': [('t', 'f8', ()), ('id', 'u2', ()), ('photo_front', 'u2', ()), ('photo_back', 'u2', ()),
+                      ('photo_right', 'u2', ()), ('current', 'u2', ())],
+        'plank': [('t', 'f8', ()), ('id', 'u2', ()), ('state', 'u1', ())],
+        'commands': [('t', 'f8', ()), ('t_mono', 'f8', ()), ('dest', 'u8', ()), ('radio', 'u1', ()),
+                     ('length', 'u1', ()), ('payload', 'u1', (MAX_PAYLOAD,))]}
+
+    def __init__(self, path, chunk_size=65536, flush_period_s=10):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.flush_period_s = flush_period_s
+        self._queue = queue.SimpleQueue()
+        self._parser = Telemetry(capacity=1)
+        self._exit = threading.Event()
+        self._buf = {}
+        self._fill = {}
+        self._chunk = {}
+        for stream, columns in self.STREAMS.items():
+            os.makedirs(os.path.join(path, stream), exist_ok=True)
+            self._buf[stream] = {name: np.zeros((chunk_size,)+shape, dtype=dtype) for name, dtype, shape in columns}
+            self._fill[stream] = 0
+            self._chunk[stream] = len(glob.glob(os.path.join(path, stream, 't_[0-9]*.npy')))
+        self.stats = {'telemetry': 0, 'plank': 0, 'commands': 0, 'chunks': 0, 'errors': 0}
+        self.error = None
+        super().__init__(target=self.target_function, daemon=True)
+
+    def record_rx(self, xbee_message):
+        '''
+        ## Description
+        ---
+        Data received callback; queues the message for the writer thread
+        '''
+        self._queue.put((0, time.time(), xbee_message.remote_device, bytes(xbee_message.data)))
+
+    def record_tx(self, remote_device, msg, radio=0):
+        '''
+        ## Description
+        ---
+        Transmit callback (see `XbeeComm.add_tx_callback`, with `with_radio` for several radios); queues the frame
+        for the writer thread
+        '''
+        if isinstance(msg, str):
+            msg = msg.encode('utf8', errors='ignore')
+        self._queue.put((1, time.time(), time.monotonic(), remote_device, bytes(msg), radio))
+
+    def stop(self):
+        '''
+        ## Description
+        ---
+        Writes all queued data and stops the writer thread
+
+        ## Returns
+        ---
+        `dict` of the number of rows recorded per stream, of chunks written (`chunks`) and of `errors`
+        '''
+        self._exit.set()
+        self.join()
+        if self.stats['errors']:
+            print("Recorder: {} errors, last: {!r}".format(self.stats['errors'], self.error))
+        return dict(self.stats)
+
+    def _append(self, stream, row):
+        fill = self._fill[stream]
+        buf = self._buf[stream]
+        for name, value in row.items():
+            buf[name][fill] = value
+        self._fill[stream] = fill+1
+        self.stats[stream] += 1
+        if fill+1 == self.chunk_size:
+            self._write(stream)
+
+    def _write(self, stream):
+        fill = self._fill[stream]
+        if fill == 0:
+            return
+        chunk = self._chunk[stream]
+        try:
+            for name, column in self._buf[stream].items():
+                np.save(os.path.join(self.path, stream, '{}_{:06d}.npy'.format(name, chunk)), column[:fill])
+        finally:
+            # rows that could not be written are dropped, so that the buffer does not overflow
+            self._chunk[stream] = chunk+1
+            self._fill[stream] = 0
+        self.stats['chunks'] += 1
+
+    def _handle(self, item):
+        if item[0] == 0:
+            __, t, remote_device, data = item
+            n = self._parser.device_number(remote_device)
+            samples, other = self._parser.parse(n, data)
+            for s in samples:
+                self._append('telemetry', {'t': t, 'id': n, 'photo_front': s[0], 'photo_back': s[1],
+                                           'photo_right': s[2], 'current': s[3]})
+            for line in other:
+                if line.startswith(b'PLANK'):
+                    self._append('plank', {'t': t, 'id': n, 'state': int(line[-1:] == b'1')})
+        else:
+            __, t, t_mono, remote_device, msg, radio = item
+            if remote_device is None:
+                dest = self.BROADCAST_ADDR
+            else:
+                dest = int(str(remote_device.get_64bit_addr()), 16)
+            length = min(len(msg), self.MAX_PAYLOAD)
+            payload = np.zeros(self.MAX_PAYLOAD, dtype=np.uint8)
+            payload[:length] = np.frombuffer(msg[:length], dtype=np.uint8)
+            self._append('commands', {'t': t, 't_mono': t_mono, 'dest': dest, 'radio': radio, 'length': length,
+                                       'payload': payload})
+
+    def flush(self):
+        '''
+        ## Description
+        ---
+        Writes all buffered rows to disk. Called by the writer thread; only call directly after `stop()`
+        '''
+        for stream in self.STREAMS:
+            self._write(stream)
+
+    def _error(self, e):
+        # the writer thread keeps running, so that the queue is still drained
+        self.stats['errors'] += 1
+        self.error = e
+
+    def target_function(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=0.1)
+                self._handle(item)
+            except queue.Empty:
+                if self._exit.is_set():
+                    break
+            except Exception as e:
+                self._error(e)
+            if time.monotonic()-last_flush > self.flush_period_s:
+                last_flush = time.monotonic()
+                self._flush_all()
+        self._flush_all()
+
+    def _flush_all(self):
+        # like flush(), but a stream that fails to be written does not keep the others from being written
+        for stream in self.STREAMS:
+            try:
+                self._write(stream)
+            except Exception as e:
+                self._error(e)
+
+
+def load_recording(path, stream, concatenate=False):
+    '''
+    ## Description
+    ---
+    Loads a stream written by `Recorder`. Chunks are memory mapped, so loading does not read the data unless
+    `concatenate` is True and there is more than one chunk
+
+    ## Arguments
+    ---
+
+    | Argument        | Type       | Description                                                          | Default Value |
+    | :------:        | :--:       | :---------:                                                          | :-----------: |
+    | path            | `string`   | directory of the recording                                           | N/A           |
+    | stream          | `string`   | 'telemetry', 'plank' or 'commands'                                    | N/A           |
+    | concatenate     | `bool`     | concatenate chunks into one array per column (reads the data)        | False         |
+    |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+    ## Returns
+    ---
+    `dict` of column name to array, or to a list of memory mapped chunk arrays if `concatenate` is False
+    '''
+    out = {}
+    for name, dtype, shape in Recorder.STREAMS[stream]:
+        files = sorted(glob.glob(os.path.join(path, stream, '{}_[0-9]*.npy'.format(name))))
+        chunks = [np.load(f, mmap_mode='r') for f in files]
+        if concatenate:
+            if len(chunks) == 1:
+                out[name] = chunks[0]
+            else:
+                out[name] = np.concatenate(chunks) if chunks else np.zeros((0,)+shape, dtype=dtype)
+        else:
+            out[name] = chunks
+    return out
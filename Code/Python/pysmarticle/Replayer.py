@@ -0,0 +1,119 @@
+# Replayer.py
+# Alex Samland
+# October 17, 2026
+# Module for re-sending the outbound frames of a recording with their original timing
+
+import threading
+import time
+from DeadlineTimer import sleep_until, RunningStats
+from Recorder import Recorder, load_recording
+
+
+class Replayer(object):
+    '''
+    ## Description
+    ---
+    Re-sends the `commands` stream of a recording made with `SmarticleSwarm.start_recording()`, frame by frame and
+    byte for byte. With `realtime` every frame is sent at its recorded `t_mono` offset from the first frame
+    (divided by `speed`) using `sleep_until()`, so a session, including the random values drawn for noisy gaits,
+    is reproduced exactly. Without `realtime` frames are sent back to back, e.g. into a `VirtualRadio` to use
+    the recording as a load trace for benchmarks.
+
+    Destinations are matched to the devices of `xbee` by 64 bit address; frames for smarticles that are not in
+    `xbee.devices` are skipped. Every radio of a recording made with several radios broadcast its own frames, so
+    when it is replayed on a `MultiXbeeComm` each broadcast is sent by the radio that recorded it only.
+
+    ## Arguments
+    ---
+
+    | Argument        | Type       | Description                                                          | Default Value |
+    | :------:        | :--:       | :---------:                                                          | :-----------: |
+    | xbee            | `XbeeComm` | radio to send frames on (`XbeeComm` or `MultiXbeeComm`)              | N/A           |
+    | path            | `string`   | directory of the recording                                           | N/A           |
+    | asynch          | `bool`     | send unicast frames without waiting for their ACK                    | True          |
+    | spin_s          | `float`    | time before each send time at which to stop sleeping and spin        | 0.002         |
+    |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+    '''
+
+    def __init__(self, xbee, path, asynch=True, spin_s=0.002):
+        self.xb = xbee
+        self.asynch = asynch
+        self.spin_s = spin_s
+        self.commands = load_recording(path, 'commands', concatenate=True)
+        self._exit = threading.Event()
+        self.stats = {}
+
+    def __len__(self):
+        return len(self.commands['t_mono'])
+
+    def duration_s(self):
+        '''
+        ## Description
+        ---
+        Returns the time between the first and the last recorded frame
+        '''
+        t_mono = self.commands['t_mono']
+        return float(t_mono[-1]-t_mono[0]) if len(t_mono) else 0.
+
+    def stop(self):
+        '''
+        ## Description
+        ---
+        Stops a replay running in another thread after the current frame
+        '''
+        self._exit.set()
+
+    def run(self, realtime=True, speed=1.0):
+        '''
+        ## Description
+        ---
+        Sends all recorded frames and blocks until done or `stop()` is called
+
+        ## Arguments
+        ---
+
+        | Argument        | Type       | Description                                                          | Default Value |
+        | :------:        | :--:       | :---------:                                                          | :-----------: |
+        | realtime        | `bool`     | keep the recorded timing, otherwise send as fast as possible         | True          |
+        | speed           | `float`    | playback speed factor with `realtime`                                | 1.0           |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `dict` with `frames` (sent), `skipped` (unknown destination), `duration_s` and the lateness of sends
+        with respect to their scheduled time: `mean_late_s`, `jitter_s`, `max_late_s`
+        '''
+        self._exit.clear()
+        cmds = self.commands
+        remotes = {int(str(remote.get_64bit_addr()), 16): remote for remote in self.xb.devices.values()}
+        offsets = ((cmds['t_mono']-cmds['t_mono'][0])/speed).tolist() if len(self) else []
+        # with a recording of several radios, broadcast every frame from the radio that recorded it
+        comms = getattr(self.xb, 'comms', None)
+        if comms is None or len(self) == 0 or not cmds['radio'].any():
+            comms = None
+        late = RunningStats()
+        sent = skipped = 0
+        t_start = time.monotonic()
+        for ii in range(len(self)):
+            if self._exit.is_set():
+                break
+            msg = cmds['payload'][ii, :cmds['length'][ii]].tobytes()
+            dest = int(cmds['dest'][ii])
+            if realtime:
+                deadline = t_start+offsets[ii]
+                late.update(sleep_until(deadline, self.spin_s)-deadline)
+            if dest == Recorder.BROADCAST_ADDR:
+                if comms is None:
+                    self.xb.broadcast(msg)
+                else:
+                    comms[int(cmds['radio'][ii])%len(comms)].broadcast(msg)
+            elif dest in remotes:
+                self.xb.send(remotes[dest], msg, asynch=self.asynch)
+            else:
+                skipped += 1
+                continue
+            sent += 1
+        late = late.summary()
+        self.stats = {'frames': sent, 'skipped': skipped, 'duration_s': time.monotonic()-t_start,
+                      'mean_late_s': late['mean'], 'jitter_s': late['std'], 'max_late_s': late['max']}
+        return self.stats
@@ -0,0 +1,312 @@
+# SendQueue.py
+# Alex Samland
+# October 17, 2026
+# Module for dispatching outbound commands, sync pulses and stream ticks to the smarticles from one thread,
+# by priority and deadline, paced so that the serial link and the smarticles' input buffers are not overrun
+
+import heapq
+import itertools
+import threading
+import collections
+import time
+from DeadlineTimer import sleep_until, RunningStats
+
+
+class Dispatch(object):
+    '''
+    ## Description
+    ---
+    A message queued with `SendQueue.put()`. `t_sent` and `t_done` are the monotonic times at which sending the message
+    started and completed (`None` until then); `late_s` is how late it was sent with respect to its deadline.
+    `result` is the value returned by `XbeeComm.command_now()` and `error` the exception it raised, if any
+    '''
+    __slots__ = ('queue', 'msg', 'remote_device', 'asynch', 'priority', 'deadline', 'keys', 't_put', 't_sent', 't_done',
+                 'result', 'error')
+
+    def __init__(self, queue, msg, remote_device, asynch, priority, deadline, keys):
+        self.queue = queue
+        self.msg = msg
+        self.remote_device = remote_device
+        self.asynch = asynch
+        self.priority = priority
+        self.deadline = deadline
+        self.keys = keys
+        self.t_put = time.monotonic()
+        self.t_sent = None
+        self.t_done = None
+        self.result = None
+        self.error = None
+
+    @property
+    def late_s(self):
+        if self.t_sent is None or self.deadline is None:
+            return None
+        return self.t_sent-self.deadline
+
+    def wait(self, timeout=None):
+        '''
+        ## Description
+        ---
+        Blocks until the message was sent and returns the result of sending it, e.g. the delivery report of
+        `XbeeComm.ack_broadcast()`. Raises the exception raised while sending it, or `TimeoutError` if the timeout
+        expired
+        '''
+        with self.queue._cv:
+            if not self.queue._cv.wait_for(lambda: self.t_done is not None, timeout):
+                raise TimeoutError("Message not sent within {} s".format(timeout))
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SendQueue(threading.Thread):
+    '''
+    ## Description
+    ---
+    Dispatcher thread that owns the radio: commands, sync pulses and stream ticks from all threads are put on one
+    timeline and sent by this thread, by priority and deadline, paced by an estimate of the link airtime of each frame
+    and of how fast each smarticle consumes messages.
+
+    Every message has a priority (`SYNC` before `STREAM` before `COMMAND`) and optionally a deadline (monotonic time
+    at which it should be sent). Messages without deadline are due when they are put. Of the due messages, the one
+    with the highest priority (then earliest deadline, then first put) is sent next. A message is held back if sending
+    it would still occupy the link when a message of higher priority falls due, so that e.g. sync pulses are not
+    delayed by commands. How late each message was sent with respect to its deadline is reported per priority by
+    `lateness()` and in the `late_s.<priority>` histograms of `XbeeComm.stats()`.
+
+    Each smarticle buffers at most `buffer_depth` messages (`MSG_BUFF_SIZE` in Smarticle.h) and handles one per
+    iteration of its main loop. The queue keeps, per destination, the estimated time at which each sent message
+    will have been consumed and only sends a frame once fewer than `buffer_depth` messages are outstanding.
+    Broadcasts count against every known smarticle. Sync pulses are handled on reception (`Smarticle::rx_interrupt`)
+    and are only spaced by airtime. Frames are also spaced by their serial airtime at `baud_rate`.
+
+    Commands are added with `put()` which returns immediately; `Dispatch.wait()` blocks until a message was sent
+    and `flush()` until everything was sent. An acknowledged broadcast is one unicast per smarticle and occupies
+    the link for as long.
+
+    `set_command_budget()` limits the fraction of link time used by `COMMAND` messages, leaving the rest of the link
+    to sync pulses, streams and the telemetry the smarticles send back (see `RateController`).
+
+    ## Arguments
+    ---
+
+    | Argument        | Type       | Description                                                          | Default Value |
+    | :------:        | :--:       | :---------:                                                          | :-----------: |
+    | xbee            | `XbeeComm` | XbeeComm object used to send the commands                            | N/A           |
+    | baud_rate       | `int`      | baud rate of the serial link to the local XBee                       | 9600          |
+    | consume_s       | `float`    | estimated time a smarticle needs to handle one message               | 0.02          |
+    | buffer_depth    | `int`      | number of messages a smarticle can buffer                            | 4             |
+    | guard_s         | `float`    | extra time a message is assumed to occupy the link when holding it back for a higher priority one | 0.005 |
+    | spin_s          | `float`    | time before a deadline at which to stop sleeping and spin            | 0.002         |
+    |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+    '''
+    # bytes added by the API frame around the payload of a 64 bit transmit request
+    FRAME_OVERHEAD = 15
+    BROADCAST = 'broadcast'
+    # priorities, lower values are sent first
+    SYNC = 0
+    STREAM = 1
+    COMMAND = 2
+    PRIORITY_NAMES = {SYNC: 'sync', STREAM: 'stream', COMMAND: 'command'}
+
+    def __init__(self, xbee, baud_rate=9600, consume_s=0.02, buffer_depth=4, guard_s=0.005, spin_s=0.002):
+        self.xb = xbee
+        self.baud_rate = baud_rate
+        self.consume_s = consume_s
+        self.buffer_depth = buffer_depth
+        self.guard_s = guard_s
+        self.spin_s = spin_s
+        # due messages: (priority, deadline or put time, seq, dispatch)
+        self._ready = []
+        # messages with a future deadline: (deadline, seq, dispatch)
+        self._timeline = []
+        self._seq = itertools.count()
+        self._cv = threading.Condition()
+        self._pending = 0
+        self._exit = False
+        self._link_free = 0.
+        self._command_free = 0.
+        self.command_budget = None
+        self._consumed = {}
+        self._late = {name: RunningStats() for name in self.PRIORITY_NAMES.values()}
+        self.stats = {'sent': 0, 'errors': 0, 'wait_s': 0., 'held': 0}
+        super().__init__(target=self.target_function, daemon=True)
+
+    def put(self, msg, remote_device=None, asynch=False, priority=COMMAND, deadline=None):
+        '''
+        ## Description
+        ---
+        Adds a message to the timeline; see `XbeeComm.command` for the meaning of `remote_device`
+
+        ## Arguments
+        ---
+
+        | Argument        | Type       | Description                                                          | Default Value |
+        | :------:        | :--:       | :---------:                                                          | :-----------: |
+        | priority        | `int`      | `SYNC`, `STREAM` or `COMMAND`                                        | `COMMAND`     |
+        | deadline        | `float`    | `time.monotonic()` time at which to send, as soon as possible if `None` | `None`     |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `Dispatch` of the message
+        '''
+        keys = [] if priority == self.SYNC else self._dest_keys(remote_device)
+        item = Dispatch(self, msg, remote_device, asynch, priority, deadline, keys)
+        with self._cv:
+            seq = next(self._seq)
+            if deadline is not None and deadline > item.t_put:
+                heapq.heappush(self._timeline, (deadline, seq, item))
+            else:
+                heapq.heappush(self._ready, (priority, item.t_put if deadline is None else deadline, seq, item))
+            self._pending += 1
+            self._cv.notify_all()
+        return item
+
+    def flush(self, timeout=None):
+        '''
+        ## Description
+        ---
+        Blocks until all queued commands have been sent
+
+        ## Returns
+        ---
+        `True` if the queue was emptied, `False` if the timeout expired
+        '''
+        with self._cv:
+            return self._cv.wait_for(lambda: self._pending == 0, timeout)
+
+    def set_command_budget(self, fraction=None):
+        '''
+        ## Description
+        ---
+        Spaces `COMMAND` messages so that they occupy at most `fraction` of the link time; no limit if `None`
+        '''
+        with self._cv:
+            self.command_budget = fraction if fraction else None
+            self._cv.notify_all()
+
+    def pending(self):
+        '''
+        ## Description
+        ---
+        Returns the number of commands that have not been sent yet
+        '''
+        with self._cv:
+            return self._pending
+
+    def lateness(self):
+        '''
+        ## Description
+        ---
+        Returns `dict` of priority name ('sync', 'stream', 'command') to statistics (n, mean, std, min, max) of how late
+        messages with a deadline were sent, in seconds
+        '''
+        with self._cv:
+            return {name: late.summary() for name, late in self._late.items()}
+
+    def kill(self):
+        with self._cv:
+            self._exit = True
+            self._cv.notify_all()
+
+    def _dest_keys(self, remote_device):
+        if remote_device is None or (isinstance(remote_device, bool) and remote_device):
+            return [self.BROADCAST]+[str(d.get_64bit_addr()) for d in list(self.xb.devices.values())]
+        return [str(remote_device.get_64bit_addr())]
+
+    def _airtime(self, item):
+        # an acknowledged broadcast is sent as one unicast per smarticle
+        frames = len(item.keys)-1 if item.remote_device is True else 1
+        return frames*(len(item.msg)+self.FRAME_OVERHEAD)*10/self.baud_rate
+
+    def _ready_time(self, keys, now):
+        ready = max(now, self._link_free)
+        for key in keys:
+            consumed = self._consumed.get(key)
+            if not consumed:
+                continue
+            while consumed and consumed[0] <= now:
+                consumed.popleft()
+            if len(consumed) >= self.buffer_depth:
+                ready = max(ready, consumed[-self.buffer_depth])
+        return ready
+
+    def _update(self, keys, sent, airtime):
+        self._link_free = sent+airtime
+        for key in keys:
+            consumed = self._consumed.setdefault(key, collections.deque())
+            last = consumed[-1] if consumed else 0.
+            consumed.append(max(sent+airtime, last)+self.consume_s)
+
+    def _next(self, now):
+        # returns the message to send now, or None and the time at which to check again (None: when woken)
+        timeline = self._timeline
+        ready = self._ready
+        while timeline and timeline[0][0] <= now:
+            deadline, seq, item = heapq.heappop(timeline)
+            heapq.heappush(ready, (item.priority, deadline, seq, item))
+        if not ready:
+            return None, timeline[0][0] if timeline else None
+        item = ready[0][3]
+        t_send = self._ready_time(item.keys, now)
+        if item.priority == self.COMMAND and self.command_budget is not None:
+            t_send = max(t_send, self._command_free)
+        if t_send > now:
+            return None, t_send if not timeline else min(t_send, timeline[0][0])
+        if item.priority > self.SYNC and timeline:
+            busy_until = now+self._airtime(item)+self.guard_s
+            for deadline, __, other in timeline:
+                if other.priority < item.priority and deadline < busy_until:
+                    self.stats['held'] += 1
+                    return None, timeline[0][0]
+        heapq.heappop(ready)
+        return item, None
+
+    def target_function(self):
+        while True:
+            with self._cv:
+                while True:
+                    now = time.monotonic()
+                    item, wake = self._next(now)
+                    if item is not None:
+                        break
+                    if self._exit and not self._ready and not self._timeline:
+                        return
+                    if wake is not None and wake-now <= self.spin_s:
+                        break
+                    self._cv.wait(None if wake is None else wake-now-self.spin_s)
+            if item is None:
+                # next message is due within spin_s, spin outside of the lock so that puts are not blocked
+                sleep_until(wake, self.spin_s)
+                continue
+            self._send(item)
+
+    def _send(self, item):
+        sent = time.monotonic()
+        item.t_sent = sent
+        due = item.t_put if item.deadline is None else max(item.deadline, item.t_put)
+        metrics = self.xb.metrics
+        metrics.observe('queue_delay_s', sent-item.t_put)
+        try:
+            item.result = self.xb.command_now(item.msg, item.remote_device, item.asynch)
+            self.stats['sent'] += 1
+        except Exception as e:
+            item.error = e
+            self.stats['errors'] += 1
+            if self.xb.debug:
+                print("Queued command failed: {}".format(e))
+        airtime = self._airtime(item)
+        self._update(item.keys, sent, airtime)
+        if item.priority == self.COMMAND and self.command_budget is not None:
+            self._command_free = sent+airtime/self.command_budget
+        name = self.PRIORITY_NAMES.get(item.priority, 'command')
+        with self._cv:
+            self.stats['wait_s'] += max(sent-due, 0.)
+            if item.deadline is not None:
+                self._late[name].update(sent-item.deadline)
+            item.t_done = time.monotonic()
+            self._pending -= 1
+            self._cv.notify_all()
+        if item.deadline is not None:
+            metrics.observe('late_s.'+name, max(sent-item.deadline, 0.))
@@ -3,11 +3,23 @@
 # August 13, 2019
 # Module for communicating with smarticle swarm over Xbee3s
 
+import os
 import time
+import json
+import hashlib
 from XbeeComm import XbeeComm
+from MultiXbeeComm import MultiXbeeComm
 from StreamThread import StreamThread
+from SendQueue import SendQueue
+from DeadlineTimer import DeadlineTimer, RunningStats, sleep_until
+from MsgEncoder import MsgEncoder
+from Telemetry import Telemetry
+from Recorder import Recorder
+from Replayer import Replayer
+from LatencyProbe import LatencyProbe
+from PlankController import PlankController, threshold_policy
+from RateController import RateController
 import threading
-import numpy as np
 
 
 class SmarticleSwarm(object):
@@ -19,19 +31,23 @@ class SmarticleSwarm(object):
 
     Constructor initalizes and opens local base xbee (connected via USB) with given port and baud rate and adds it to attribute `base`
     '''
-    msg_code_dict = {'toggle_led': 0x20, 'set_mode': 0x21, 'toggle_t4_interrupt': 0x22,\
-        'set_transmit_counts': 0x23, 'select_gait': 0x24, 'toggle_read_sensors': 0x25,\
-        'toggle_transmit': 0x26, 'set_gait_epsilon': 0x27, 'set_pose_noise': 0x28,\
-        'toggle_light_plank': 0x29, 'set_debug': 0x2A, 'set_id': 0x2B, 'set_pose': 0x30,\
-        'set_sync_noise': 0x31, 'set_stream_timing_noise': 0x32,\
-        'set_light_plank_threshold': 0x40, 'init_gait': 0x41, 'stream_pose': 0x42, 'set_plank': 0x43}
+    msg_code_dict = MsgEncoder.msg_code_dict
     msg_prefix = bytearray([0x13,0x13])
     msg_end = bytearray([0x0A])
 
     ASCII_OFFSET = 32
     SAMPLE_TIME_MS = 10
-
-    def __init__(self, port='/dev/tty.usbserial-DN050I6Q', baud_rate = 9600, debug = 0):
+    SYNC_MSG = b'\x11'
+    # time before its send time at which a calibrated sync pulse is queued when the send queue is running
+    SYNC_LEAD_S = 0.05
+    # settings of apply(), in the order they are applied
+    SETTINGS = ['mode', 'debug', 'read_sensors', 'transmit_period', 'binary_transmit', 'transmit', 'sensor_threshold',
+                'light_plank', 'pose_epsilon', 'pose_noise', 'sync_noise', 'gaits', 'select_gait', 'servos']
+    # settings after set_mode(0), see Smarticle::init_mode
+    IDLE_SETTINGS = {'servos': 0, 'transmit': 0, 'binary_transmit': 0, 'read_sensors': 0, 'light_plank': 0, 'pose_epsilon': 0, 'pose_noise': 0,
+                     'sync_noise': 0, 'transmit_period': SAMPLE_TIME_MS, 'select_gait': 0}
+
+    def __init__(self, port='/dev/tty.usbserial-DN050I6Q', baud_rate = 9600, debug = 0, base = None, paced = True, backend = None):
         '''
         ## Remote Device
         ---
@@ -49,14 +65,33 @@ class SmarticleSwarm(object):
 
         | Argument            | Type       | Description                                | Default Value                       |
         | :------             | :--        | :---------                                 | :-----------                        |
-        | port                | `string`   | USB port to open for local XBee            | set for your own convenience        |
+        | port                | `string`   | USB port to open for local XBee; a `list` of ports uses several XBees (see `MultiXbeeComm`) | set for your own convenience |
         | baud_rate           | `int`      | Baud rate to use for USB serial port       | 9600                                |
         | debug               | `int`      | Enables/disables print statements in class | 0                                   |
+        | base                | --         | Stand in for the local XBee, e.g. `VirtualSwarm.VirtualRadio`, or a `list` of them | `None` |
+        | paced               | `bool`     | Queue and pace commands (see `XbeeComm.start_send_queue`). Unacknowledged commands then return immediately; use `flush()` to wait | True |
+        | backend             | `string`   | Radio implementation: 'digi' or 'virtual' (in-process `VirtualSwarm`, `port` is then the number of smarticles); see `Backends` | `None` |
         |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
 
         '''
-        self.xb = XbeeComm(port,baud_rate,debug)
+        if isinstance(port, (list, tuple)) or isinstance(base, (list, tuple)):
+            self.xb = MultiXbeeComm(port if isinstance(port, (list, tuple)) else None, baud_rate, debug, base, backend)
+        else:
+            self.xb = XbeeComm(port,baud_rate,debug,base,backend)
+        self.enc = MsgEncoder()
+        if paced:
+            self.xb.start_send_queue()
         self.lock = threading.Lock()
+        # (64 bit address, gait_num) -> hash of the gait uploaded to that slot, see gait_init
+        self.gait_cache = {}
+        # 64 bit address -> timer counts of the gait delay, which is shared by all gait slots of a smarticle
+        self.gait_delay = {}
+        self.gait_cache_file = None
+        # 64 bit address -> {setting: last frame sent}, see apply
+        self.shadow = {}
+        self.latency_probe = None
+        self.plank_controller = None
+        self.rate_controller = None
 
     @classmethod
     def _format_msg(self, msg):
@@ -70,7 +105,7 @@ class SmarticleSwarm(object):
         return [c1,c2]
 
 
-    def build_network(self, exp_n_smarticles=None):
+    def build_network(self, exp_n_smarticles=None, cache_file=None):
         '''
         ## Description
         ---
@@ -79,24 +114,39 @@ class SmarticleSwarm(object):
         Will ask for retries if expected no of smarticles is not discovered
         modified from Digi XBee example DiscoverDevicesSample.py
 
+        If `cache_file` is given, devices saved by a previous run are restored from it and checked for reachability
+        (see `XbeeComm.load_devices`). Network discovery then only runs if no devices could be restored or fewer than
+        `exp_n_smarticles` are reachable. The resulting devices are saved back to `cache_file`
+
         ## Arguments
         ---
 
         | Argument                        | Type     | Description                                | Default Value    |
         | :------:                        | :--:     | :---------:                                | :-----------:    |
         | exp_n_smarticles               | `int`    | Expected number of smarticles to discover  | None             |
+        | cache_file                     | `string` | Path of device cache file                  | None             |
         |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
 
         ## Returns
         ---
         `None`
         '''
-        self.xb.discover()
+        if cache_file is None:
+            self.xb.discover()
+        else:
+            self.xb.devices = {}
+            self.xb.load_devices(cache_file)
+            n_found = len(self.xb.devices)
+            if n_found == 0 or (exp_n_smarticles != None and n_found < exp_n_smarticles):
+                self.xb.discover(clear=False)
+            else:
+                print('Restored {} Smarticles from {}\n'.format(n_found, cache_file))
+            self.xb.save_devices(cache_file)
         if exp_n_smarticles != None:
             if (len(self.xb.devices))<exp_n_smarticles:
                 inp= input('Only discovered {} out of {} expected Smarticles. Retry discovery (Y/N)\n'.format(len(self.xb.devices),exp_n_smarticles))
                 if inp[0].upper()=='Y':
-                    self.build_network(exp_n_smarticles)
+                    self.build_network(exp_n_smarticles, cache_file)
                 else:
                     #purge Smarticle Xbee buffer
                     time.sleep(0.5)
@@ -135,10 +185,9 @@ class SmarticleSwarm(object):
         ---
         `None`
         '''
-        msg_code = self.msg_code_dict['set_id']
         for id in self.xb.devices.keys():
-            msg = self._format_msg(bytearray([msg_code,self.ASCII_OFFSET+id]))
-            self.xb.send(self.xb.devices[id],msg,asynch=False)
+            msg = self.enc.value_frame('set_id', id)
+            self.xb.command(msg,self.xb.devices[id],asynch=False)
 
 
     def close(self):
@@ -151,11 +200,37 @@ class SmarticleSwarm(object):
         ---
         `None`
         '''
+        self.stop_plank_controller()
+        self.stop_rate_control()
+        self.flush()
+        self.stop_recording()
+        if self.latency_probe is not None:
+            self.latency_probe.stop()
         self.xb.close_base()
 
 
 
 
+    def flush(self, timeout = None):
+        '''
+        ## Description
+        ---
+        Blocks until all queued commands have been sent to the smarticles
+
+        ## Arguments
+        ---
+
+        | Argument        | Type                      | Description                                                                   | Default Value |
+        | :------:        | :--:                      | :---------:                                                                   | :-----------: |
+        | timeout         | `float`                   | maximum time to wait in seconds, waits indefinitely if `None`                 | `None`        |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `True` if all commands were sent, `False` if the timeout expired
+        '''
+        return self.xb.flush(timeout)
+
     def set_servos(self, state, remote_device = None):
         '''
         ## Description
@@ -176,11 +251,7 @@ class SmarticleSwarm(object):
         ---
         `None`
         '''
-        msg_code = self.msg_code_dict['toggle_t4_interrupt']
-        if state != 1:
-            state = 0
-        msg = self._format_msg(bytearray([msg_code,self.ASCII_OFFSET+state]))
-        self.xb.command(msg, remote_device)
+        self._command_setting('servos', state, remote_device)
 
 
     def set_transmit(self, state, remote_device = None):
@@ -188,7 +259,8 @@ class SmarticleSwarm(object):
         ## Description
         ---
         Enables/disables smarticle transmitting data.
-        Data sent in following format: '{int Photo_front}, {int photo_back}, {int photo_right} {int current_sense}'(values between 0-1023)
+        Data sent in following format: '{int Photo_front}, {int photo_back}, {int photo_right} {int current_sense}'(values between 0-1023),
+        or as binary records with `set_binary_transmit(1)`
 
         ## Arguments
         ---
@@ -203,11 +275,265 @@ class SmarticleSwarm(object):
         ---
         `None`
         '''
-        msg_code = self.msg_code_dict['toggle_transmit']
         if state != 1:
             state = 0
-        msg = self._format_msg(bytearray([msg_code,self.ASCII_OFFSET+state]))
-        self.xb.command(msg, remote_device)
+        self._command_setting('transmit', state, remote_device)
+
+    def set_binary_transmit(self, state, remote_device = None):
+        '''
+        ## Description
+        ---
+        Makes smarticles send their data as binary records instead of text: a magic byte (0x02), an 8 bit sequence
+        number and the four sensor values as little endian uint16, 10 bytes per sample instead of up to 20. `Telemetry`
+        decodes both formats and counts lost records from the sequence numbers. Has no effect on other output of the
+        smarticles (e.g. debug messages), which stays text
+
+        ## Arguments
+        ---
+
+        | Argument        | Type                                          | Description                                                              | Default Value  |
+        | :------:        | :--:                                          | :---------:                                                              | :-----------:  |
+        | state           | `int`                                         | Value: 1 or 0. binary/text data                                          | N/A            |
+        | remote_device   | -- | see class description | `None`         |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `None`
+        '''
+        if state != 1:
+            state = 0
+        self._command_setting('binary_transmit', state, remote_device)
+
+    def start_telemetry(self, capacity = 4096):
+        '''
+        ## Description
+        ---
+        Creates a `Telemetry` object that parses the data sent by smarticles with `set_transmit(1)` into per-smarticle
+        ring buffers and registers it as a data received callback. The object is also stored in attribute `telemetry`
+
+        ## Arguments
+        ---
+
+        | Argument        | Type                      | Description                                                                   | Default Value |
+        | :------:        | :--:                      | :---------:                                                                   | :-----------: |
+        | capacity        | `int`                     | number of samples kept per smarticle                                          | 4096          |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `Telemetry` object, see `Telemetry.latest()` and `Telemetry.window()`
+        '''
+        if getattr(self, 'telemetry', None) is None:
+            self.telemetry = Telemetry(capacity)
+            self.xb.add_rx_callback(self.telemetry.ingest)
+        return self.telemetry
+
+    def start_recording(self, path, chunk_size = 65536, flush_period_s = 10):
+        '''
+        ## Description
+        ---
+        Starts a `Recorder` that logs received telemetry, plank events and all outbound frames to chunked `.npy` files
+        in directory `path` from its own writer thread. Load recordings with `Recorder.load_recording()`
+
+        ## Arguments
+        ---
+
+        | Argument        | Type                      | Description                                                                   | Default Value |
+        | :------:        | :--:                      | :---------:                                                                   | :-----------: |
+        | path            | `string`                  | directory to write recording to                                               | N/A           |
+        | chunk_size      | `int`                     | maximum number of rows per chunk file                                         | 65536         |
+        | flush_period_s  | `float`                   | maximum time data is held in memory before it is written                      | 10            |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `Recorder` object
+        '''
+        self.stop_recording()
+        self.recorder = Recorder(path, chunk_size, flush_period_s)
+        self.recorder.start()
+        self.xb.add_rx_callback(self.recorder.record_rx)
+        self.xb.add_tx_callback(self.recorder.record_tx, with_radio=True)
+        return self.recorder
+
+    def stop_recording(self):
+        '''
+        ## Description
+        ---
+        Stops the recorder started with `start_recording()` after writing all recorded data
+
+        ## Returns
+        ---
+        `dict` of recorder statistics, see `Recorder.stop()`, or `None` if no recorder was running
+        '''
+        recorder = getattr(self, 'recorder', None)
+        if recorder is not None:
+            self.xb.del_rx_callback(recorder.record_rx)
+            self.xb.del_tx_callback(recorder.record_tx)
+            self.recorder = None
+            return recorder.stop()
+
+    def replay(self, path, realtime = True, speed = 1.0):
+        '''
+        ## Description
+        ---
+        Re-sends the outbound frames of a recording made with `start_recording()` with their original timing,
+        or as fast as possible if `realtime` is False (see `Replayer`). Flushes the send queue first. Since the
+        replayed frames bypass the `set_*` methods, the recorded settings and gaits (`shadow`, `gait_cache`)
+        are forgotten afterwards
+
+        ## Arguments
+        ---
+
+        | Argument        | Type                      | Description                                                                   | Default Value |
+        | :------:        | :--:                      | :---------:                                                                   | :-----------: |
+        | path            | `string`                  | directory of the recording                                                    | N/A           |
+        | realtime        | `bool`                    | keep the recorded timing, otherwise send as fast as possible                  | True          |
+        | speed           | `float`                   | playback speed factor with `realtime`                                         | 1.0           |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `dict` of replay statistics, see `Replayer.run()`
+        '''
+        self.flush()
+        try:
+            return Replayer(self.xb, path).run(realtime, speed)
+        finally:
+            self.invalidate_shadow()
+            self.invalidate_gaits()
+
+    def measure_latency(self, count = 10, interval_s = 0.05, compensate = False, remote_device = None):
+        '''
+        ## Description
+        ---
+        Pings the smarticles to estimate the one way latency, jitter and clock offset of each one (see `LatencyProbe`).
+        Replies keep accumulating in `latency_probe` over repeated calls
+
+        ## Arguments
+        ---
+
+        | Argument        | Type                      | Description                                                                   | Default Value |
+        | :------:        | :--:                      | :---------:                                                                   | :-----------: |
+        | count           | `int`                     | number of pings per smarticle                                                 | 10            |
+        | interval_s      | `float`                   | time between pings                                                            | 0.05          |
+        | compensate      | `bool`                    | send commands with a deadline early by the latency of the smarticles         | False         |
+        | remote_device   | --                        | single remote device to ping, all devices if `None`                           | `None`        |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `dict` of 64 bit address to estimates, see `LatencyProbe.estimates()`
+        '''
+        if self.latency_probe is None:
+            self.latency_probe = LatencyProbe(self.xb)
+        devices = None if remote_device is None else [remote_device]
+        estimates = self.latency_probe.ping(devices, count, interval_s)
+        if compensate:
+            self.latency_probe.compensate()
+        return estimates
+
+    def start_plank_controller(self, policy = None, thresholds = None, period_ms = 10, max_age_s = 0.1, refresh_ticks = 100):
+        '''
+        ## Description
+        ---
+        Starts a `PlankController` that evaluates `policy` for all smarticles every `period_ms` from their telemetry
+        (see `start_telemetry()`) and sends the resulting plank states with batched `set_plank` messages. The
+        controller is stored in attribute `plank_controller`. Smarticles need `set_transmit(1)` and
+        `set_read_sensors(1)`, and `set_light_plank(0)` so that the firmware does not plank on its own
+
+        ## Arguments
+        ---
+
+        | Argument        | Type                      | Description                                                                   | Default Value |
+        | :------:        | :--:                      | :---------:                                                                   | :-----------: |
+        | policy          | function                  | `policy(t, ids, samples, state)` returning the plank states, see `PlankController` | `None`   |
+        | thresholds      | array like                | [photo_front, photo_back, photo_right, current] thresholds of `threshold_policy()` used if `policy` is `None` | `None` |
+        | period_ms       | `int`                     | controller period                                                             | 10            |
+        | max_age_s       | `float`                   | samples older than this are ignored                                           | 0.1           |
+        | refresh_ticks   | `int`                     | every state is resent at least once every `refresh_ticks` ticks               | 100           |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `PlankController` object
+        '''
+        if policy is None:
+            assert thresholds is not None, 'either policy or thresholds is needed'
+            policy = threshold_policy(thresholds)
+        self.stop_plank_controller()
+        self.plank_controller = PlankController(self.xb, self.start_telemetry(), policy, period_ms,
+                                                max_age_s=max_age_s, refresh_ticks=refresh_ticks, encoder=self.enc)
+        self.plank_controller.start()
+        return self.plank_controller
+
+    def stop_plank_controller(self):
+        '''
+        ## Description
+        ---
+        Stops the plank controller started with `start_plank_controller()`
+
+        ## Returns
+        ---
+        `dict` of controller statistics (see `PlankController.stats()`), or `None` if no controller was running
+        '''
+        if self.plank_controller is None:
+            return None
+        self.plank_controller.kill()
+        self.plank_controller.join()
+        stats = self.plank_controller.stats()
+        self.plank_controller = None
+        return stats
+
+    def start_rate_control(self, target_utilization = 0.7, command_share = 0.2, interval_s = 1.0, min_period_ms = 10, max_period_ms = 2000):
+        '''
+        ## Description
+        ---
+        Starts a `RateController` that retunes the transmit period of every smarticle so that their telemetry and
+        the commands sent stay below `target_utilization` of the link capacity. The controller is stored in attribute
+        `rate_controller`; see `RateController.rates()` for the chosen periods. Do not call `set_transmit_period()`
+        while it is running
+
+        ## Arguments
+        ---
+
+        | Argument           | Type                      | Description                                                                | Default Value |
+        | :------:           | :--:                      | :---------:                                                                | :-----------: |
+        | target_utilization | `float`                   | fraction of the link capacity to use                                       | 0.7           |
+        | command_share      | `float`                   | share of `target_utilization` reserved for commands                        | 0.2           |
+        | interval_s         | `float`                   | time between updates of the transmit periods                               | 1.0           |
+        | min_period_ms      | `int`                     | shortest transmit period                                                   | 10            |
+        | max_period_ms      | `int`                     | longest transmit period                                                    | 2000          |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `RateController` object
+        '''
+        self.stop_rate_control()
+        self.rate_controller = RateController(self, target_utilization, command_share, interval_s, min_period_ms,
+                                              max_period_ms, baud_rate=self.xb.baud_rate)
+        self.rate_controller.start()
+        return self.rate_controller
+
+    def stop_rate_control(self):
+        '''
+        ## Description
+        ---
+        Stops the controller started with `start_rate_control()`; transmit periods keep their last values
+
+        ## Returns
+        ---
+        `dict` of the last rates, see `RateController.rates()`, or `None` if no controller was running
+        '''
+        if self.rate_controller is None:
+            return None
+        self.rate_controller.kill()
+        self.rate_controller.join()
+        rates = self.rate_controller.rates()
+        self.rate_controller = None
+        return rates
 
     def set_light_plank(self, state, remote_device = None):
         '''
@@ -229,11 +555,9 @@ class SmarticleSwarm(object):
         `None`
         '''
 
-        msg_code = self.msg_code_dict['toggle_light_plank']
         if state != 1:
             state = 0
-        msg = self._format_msg(bytearray([msg_code,self.ASCII_OFFSET+state]))
-        self.xb.command(msg, remote_device)
+        self._command_setting('light_plank', state, remote_device)
 
     def set_sensor_threshold(self, thresh, remote_device = None):
         '''
@@ -255,13 +579,7 @@ class SmarticleSwarm(object):
         ---
         `None`
         '''
-        assert len(thresh)==4, 'Threshold list must be 4 elements'
-        msg_code = self.msg_code_dict['set_light_plank_threshold']
-        val = bytearray()
-        for t in thresh:
-            val+= self._convert_to_2_chars(t)
-        msg = self._format_msg(bytearray([msg_code]+val))
-        self.xb.command(msg, remote_device)
+        self._command_setting('sensor_threshold', thresh, remote_device)
 
 
 
@@ -285,11 +603,9 @@ class SmarticleSwarm(object):
         ---
         `None`
         '''
-        msg_code = self.msg_code_dict['toggle_read_sensors']
         if state != 1:
             state = 0
-        msg = self._format_msg(bytearray([msg_code,self.ASCII_OFFSET+state]))
-        self.xb.command(msg, remote_device)
+        self._command_setting('read_sensors', state, remote_device)
 
     def set_transmit_period(self, period_ms, remote_device=None):
         '''
@@ -311,11 +627,7 @@ class SmarticleSwarm(object):
         ---
         `None`
         '''
-        msg_code = self.msg_code_dict['set_transmit_counts']
-        counts = period_ms//self.SAMPLE_TIME_MS
-        counts = np.clip(counts, 1, 200)
-        msg = self._format_msg(bytearray([msg_code,self.ASCII_OFFSET+counts]))
-        self.xb.command(msg, remote_device)
+        self._command_setting('transmit_period', period_ms, remote_device)
 
 
 
@@ -340,11 +652,9 @@ class SmarticleSwarm(object):
         ---
         `None`
         '''
-        msg_code = self.msg_code_dict['set_debug']
         if state not in [0,1,2]:
             state = 0
-        msg = self._format_msg(bytearray([msg_code,self.ASCII_OFFSET+state]))
-        self.xb.command(msg, remote_device)
+        self._command_setting('debug', state, remote_device)
 
 
 
@@ -370,11 +680,7 @@ class SmarticleSwarm(object):
         ---
         `None`
         '''
-        # ensure eps is between 0 and 1
-        eps = int(100*round(np.clip(eps,0,1),2))
-        msg_code = self.msg_code_dict['toggle_light_plank']
-        msg = self._format_msg(bytearray([msg_code,self.ASCII_OFFSET+eps]))
-        self.xb.command(msg, remote_device)
+        self._command_setting('pose_epsilon', eps, remote_device)
 
     def set_mode(self, state, remote_device = None):
         '''
@@ -406,10 +712,7 @@ class SmarticleSwarm(object):
         ---
         `None`
         '''
-        assert (state>=0 and state<=2),"Mode must between 0-2"
-        msg_code = self.msg_code_dict['set_mode']
-        msg = self._format_msg(bytearray([msg_code,self.ASCII_OFFSET+state]))
-        self.xb.command(msg, remote_device)
+        self._command_setting('mode', state, remote_device)
 
     def set_plank(self, state_arr, remote_device = None):
         '''
@@ -430,11 +733,8 @@ class SmarticleSwarm(object):
         ---
         `None`
         '''
-        msg_code = self.msg_code_dict['set_plank']
-        l = len(state_arr)+self.ASCII_OFFSET
-        state_arr = list((state_arr+self.ASCII_OFFSET).flatten())
-        msg = self._format_msg(bytearray([msg_code,l]+state_arr))
-        self.xb.command(msg, remote_device)
+        msgs = self.enc.batch_frames('set_plank', state_arr)
+        self.xb.command(msgs, remote_device)
 
     def set_pose(self, posL, posR, remote_device = None):
         '''
@@ -456,17 +756,20 @@ class SmarticleSwarm(object):
         ---
         `None`
         '''
-        msg_code = self.msg_code_dict['set_pose']
-        msg = self._format_msg(bytearray([msg_code,self.ASCII_OFFSET+posL,self.ASCII_OFFSET+posR]))
+        msg = self.enc.two_value_frame('set_pose', posL, posR)
         self.xb.command(msg, remote_device)
 
-    def stream_pose(self, poses, remote_device=None):
+    def stream_pose(self, poses, remote_device=None, delta=None):
         '''
         ## Description
         ---
         Sets smarticle to specified servo positions. Differs from set_pose in
         that it sends angles over the streaming pipeline, which sends a batch message that can specify 
         separate commands for each smarticle in the same message. Specify id as zero to broadcast servo command to whole swarm.
+        Poses of large swarms are packed into the minimum number of messages (at most 11 poses each, the size of the
+        smarticles' message buffer), which are sent back to back. With several radios, broadcasts are formatted with
+        `MultiXbeeComm.format_stream_msg()` so that every radio only sends the poses of its own smarticles. With a
+        `PoseDelta`, only poses that changed since the last call (or are due for a refresh) are sent.
 
         ## Arguments
         ---
@@ -475,17 +778,25 @@ class SmarticleSwarm(object):
         | :------:        | :--:                                          | :---------:                                                                | :-----------:  |
         | poses            | `np.array`                                   | Nx3 array of servo commands. Each row specifies [id, angL, angR]     | N/A            |
         | remote_device   | -- | see class description   | `None`         |
+        | delta           | `PoseDelta`                                   | filters out unchanged poses                                                | `None`         |
         |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
 
         ## Returns
         ---
-        `None`
+        number of messages sent, summed over all radios
         '''
-        msg_code = self.msg_code_dict['stream_pose']
-        l = len(poses)+self.ASCII_OFFSET
-        poses = list((poses+self.ASCII_OFFSET).flatten())
-        msg = self._format_msg(bytearray([msg_code,l]+poses))
+        if delta is not None:
+            poses = delta.update(poses)
+            if len(poses) == 0:
+                return 0
+        if remote_device is None or isinstance(remote_device, bool):
+            # with several radios, each radio only sends the rows of its own smarticles
+            msg = self.xb.format_stream_msg(poses)
+        else:
+            msg = self.enc.batch_frames('stream_pose', poses)
         self.xb.command(msg,remote_device)
+        msgs = msg.values() if isinstance(msg, dict) else [msg]
+        return sum(len(m) if isinstance(m, list) else 1 for m in msgs)
 
 
     def set_delay(self, state=-1, max_val=-1, remote_device = None):
@@ -532,11 +843,7 @@ class SmarticleSwarm(object):
         ---
         `None`
         '''
-        assert max_val < 100, 'value must be less than 100'
-        val=int(2*max_val)
-        msg_code = self.msg_code_dict['set_pose_noise']
-        msg = self._format_msg(bytearray([msg_code,self.ASCII_OFFSET+val]))
-        self.xb.command(msg, remote_device)
+        self._command_setting('pose_noise', max_val, remote_device)
 
 
     def set_sync_noise(self, max_val, remote_device = None):
@@ -558,13 +865,10 @@ class SmarticleSwarm(object):
         ---
         `None`
         '''
-        timer_counts = self._convert_to_2_chars(int(max_val/0.128))
-        msg_code = self.msg_code_dict['set_sync_noise']
-        msg = self._format_msg(bytearray([msg_code]+timer_counts))
-        self.xb.command(msg, remote_device)
+        self._command_setting('sync_noise', max_val, remote_device)
 
 
-    def gait_init(self, gait, delay_ms, gait_num=0, remote_device = None):
+    def gait_init(self, gait, delay_ms, gait_num=0, remote_device = None, force = False):
         '''
         ## Description
         ---
@@ -584,28 +888,113 @@ class SmarticleSwarm(object):
         | :------:        | :--:                                          | :---------:                                                                | :-----------:  |
         | gait            | list of lists of int                          | [gaitLpoints, gaitRpoints]                                                 | N/A            |
         | period_ms       | `int`                                         | period (ms) between gait points                                            | N/A            |
+        | gait_num        | `int`                                         | gait slot to upload to                                                     | 0              |
         | remote_device   | -- | see class description   | `None`         |
+        | force           | `bool`                                        | upload even if the gait cache says the slot already holds this gait        | False          |
         |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
 
+        ## Gait cache
+        ---
+        The hash of every uploaded gait (points and delay) is recorded per smarticle and gait slot in `gait_cache`,
+        and the delay of every smarticle in `gait_delay`, since the firmware keeps one delay for all slots. Uploads
+        of a gait that all targeted smarticles already hold, with their delay already at `delay_ms`, are skipped.
+        A skipped upload does not stop the servos or restart the gait like an upload does; use `force` for that.
+        An upload stops the servos (`set_servos(0)`), which `apply()` takes into account.
+        `set_mode(0)` clears the gaits on the smarticles and invalidates their entries. Call `invalidate_gaits()`
+        after a smarticle was reset or powered off. Use `load_gait_cache()` to keep the cache between runs.
+
         ## Returns
         ---
-        `None`
+        `True` if the gait was sent, `False` if the upload was skipped
         '''
-        msg_code = bytearray([self.msg_code_dict['init_gait']])
         self.delay_ms = delay_ms
         self.gait_len = len(gait[0])
         timer_counts = int(delay_ms/0.128)
-        gaitL=gait[0]
-        gaitR=gait[1]
-        gaitL = [int(x+self.ASCII_OFFSET) for x in gaitL]
-        gaitR = [int(x+self.ASCII_OFFSET) for x in gaitR]
-        assert len(gaitL)==len(gaitR),'Gait lists must be same length'
-        gait_points = self.gait_len+self.ASCII_OFFSET
-        n = gait_num +self.ASCII_OFFSET
-        delay = self._convert_to_2_chars(timer_counts)
-        msg=  self._format_msg(msg_code+bytearray([n, gait_points]+delay+gaitL+gaitR))
+        msg = self.enc.gait_frame(gait_num, timer_counts, gait[0], gait[1])
+        digest = hashlib.sha1(msg).hexdigest()
+        addresses = self._addresses(remote_device)
+        if not force and addresses and all(self.gait_cache.get((addr, gait_num)) == digest and
+                                           self.gait_delay.get(addr) == timer_counts for addr in addresses):
+            return False
         self.xb.command(msg, remote_device)
-        time.sleep(0.1) #ensure messages are not dropped as buffer isn't implemented yet
+        servos_off = self.setting_frame('servos', 0)
+        for addr in addresses:
+            self.gait_cache[(addr, gait_num)] = digest
+            self.gait_delay[addr] = timer_counts
+            # Smarticle::init_gait stops the servo interrupt
+            self.shadow.setdefault(addr, {})['servos'] = servos_off
+        if self.gait_cache_file is not None:
+            self.save_gait_cache(self.gait_cache_file)
+        if self.xb.send_queue is None:
+            time.sleep(0.1) #ensure messages are not dropped when commands are not paced by the send queue
+        return True
+
+    def _addresses(self, remote_device):
+        if remote_device is None or (isinstance(remote_device, bool) and remote_device):
+            devices = self.xb.devices.values()
+        else:
+            devices = [remote_device]
+        return [str(dev.get_64bit_addr()) for dev in devices]
+
+    def invalidate_gaits(self, remote_device = None, gait_num = None):
+        '''
+        ## Description
+        ---
+        Forgets which gaits smarticles hold, so the next `gait_init` uploads them again.
+        Call this after a smarticle was reset or powered off
+
+        ## Arguments
+        ---
+
+        | Argument        | Type                                          | Description                                                                | Default Value  |
+        | :------:        | :--:                                          | :---------:                                                                | :-----------:  |
+        | remote_device   | -- | smarticle to invalidate, or `None`/`True` for all smarticles | `None`         |
+        | gait_num        | `int`                                         | gait slot to invalidate, all slots if `None`                               | `None`         |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `None`
+        '''
+        if remote_device is None or (isinstance(remote_device, bool) and remote_device):
+            addresses = None
+        else:
+            addresses = set(self._addresses(remote_device))
+        for key in list(self.gait_cache):
+            if (addresses is None or key[0] in addresses) and (gait_num is None or key[1] == gait_num):
+                del self.gait_cache[key]
+        if gait_num is None:
+            for addr in list(self.gait_delay):
+                if addresses is None or addr in addresses:
+                    del self.gait_delay[addr]
+        if self.gait_cache_file is not None:
+            self.save_gait_cache(self.gait_cache_file)
+
+    def save_gait_cache(self, cache_file):
+        '''
+        ## Description
+        ---
+        Saves `gait_cache` and `gait_delay` to a JSON file
+        '''
+        records = [{'address': addr, 'gait_num': gait_num, 'hash': digest}
+                   for (addr, gait_num), digest in sorted(self.gait_cache.items())]
+        delays = [{'address': addr, 'timer_counts': counts} for addr, counts in sorted(self.gait_delay.items())]
+        with open(cache_file, 'w') as f:
+            json.dump({'gaits': records, 'delays': delays}, f, indent=1)
+
+    def load_gait_cache(self, cache_file):
+        '''
+        ## Description
+        ---
+        Loads a gait cache saved by a previous run (if the file exists) and saves all later changes to it.
+        Smarticles that were reset since must be invalidated with `invalidate_gaits()`
+        '''
+        if os.path.exists(cache_file):
+            with open(cache_file) as f:
+                cache = json.load(f)
+            self.gait_cache = {(r['address'], r['gait_num']): r['hash'] for r in cache['gaits']}
+            self.gait_delay = {r['address']: r['timer_counts'] for r in cache.get('delays', [])}
+        self.gait_cache_file = cache_file
 
     def select_gait(self, n, remote_device = None):
         '''
@@ -626,42 +1015,287 @@ class SmarticleSwarm(object):
         ---
         `None`
         '''
-        msg_code = self.msg_code_dict['select_gait']
-        msg = self._format_msg(bytearray([msg_code,self.ASCII_OFFSET+n]))
+        self._command_setting('select_gait', n, remote_device)
+
+
+    def setting_frame(self, name, value):
+        '''
+        ## Description
+        ---
+        Encodes the message that changes setting `name` to `value`; the settings are those of `apply()`
+
+        ## Returns
+        ---
+        `bytes` message
+        '''
+        enc = self.enc
+        if name == 'mode':
+            assert (value>=0 and value<=2),"Mode must between 0-2"
+            return enc.value_frame('set_mode', value)
+        elif name == 'servos':
+            return enc.value_frame('toggle_t4_interrupt', 1 if value == 1 else 0)
+        elif name == 'transmit':
+            return enc.value_frame('toggle_transmit', value)
+        elif name == 'binary_transmit':
+            return enc.value_frame('toggle_binary_transmit', value)
+        elif name == 'light_plank':
+            return enc.value_frame('toggle_light_plank', value)
+        elif name == 'sensor_threshold':
+            assert len(value)==4, 'Threshold list must be 4 elements'
+            return enc.wide_value_frame('set_light_plank_threshold', value)
+        elif name == 'read_sensors':
+            return enc.value_frame('toggle_read_sensors', value)
+        elif name == 'transmit_period':
+            counts = int(value//self.SAMPLE_TIME_MS)
+            return enc.value_frame('set_transmit_counts', min(max(counts, 1), 200))
+        elif name == 'debug':
+            return enc.value_frame('set_debug', value)
+        elif name == 'pose_epsilon':
+            # ensure eps is between 0 and 1
+            return enc.value_frame('set_gait_epsilon', int(100*round(min(max(value,0),1),2)))
+        elif name == 'pose_noise':
+            assert value < 100, 'value must be less than 100'
+            return enc.value_frame('set_pose_noise', int(2*value))
+        elif name == 'sync_noise':
+            return enc.wide_value_frame('set_sync_noise', [int(value/0.128)])
+        elif name == 'select_gait':
+            return enc.value_frame('select_gait', value)
+        raise KeyError('Unknown setting: {}'.format(name))
+
+    def _command_setting(self, name, value, remote_device):
+        self._send_setting(name, self.setting_frame(name, value), remote_device)
+
+    def _send_setting(self, name, msg, remote_device):
         self.xb.command(msg, remote_device)
+        addresses = self._addresses(remote_device)
+        if name == 'mode' and msg == self.setting_frame('mode', 0):
+            # smarticles clear their gaits and reset their settings when set to idle
+            self.invalidate_gaits(remote_device)
+            idle = {setting: self.setting_frame(setting, value) for setting, value in self.IDLE_SETTINGS.items()}
+            for addr in addresses:
+                shadow = self.shadow.setdefault(addr, {})
+                shadow.pop('sensor_threshold', None)
+                shadow.update(idle)
+        for addr in addresses:
+            self.shadow.setdefault(addr, {})[name] = msg
+
+    def invalidate_shadow(self, remote_device = None):
+        '''
+        ## Description
+        ---
+        Forgets the settings recorded for smarticles, so the next `apply()` sends all configured settings to them.
+        Call this (and `invalidate_gaits()`) after a smarticle was reset or powered off, or if broadcasts may have been lost
+        '''
+        if remote_device is None or (isinstance(remote_device, bool) and remote_device):
+            self.shadow = {}
+        else:
+            for addr in self._addresses(remote_device):
+                self.shadow.pop(addr, None)
 
+    def apply(self, config):
+        '''
+        ## Description
+        ---
+        Brings the swarm to the configuration `config`, sending only the commands needed to get there from the
+        settings last sent to each smarticle (recorded in `shadow` by `apply()` and the `set_*` methods).
+        A setting that should change on several smarticles is broadcast when that takes fewer messages, with the
+        smarticles that need another value (or must keep theirs) corrected by unicasts afterwards.
+        Settings are applied in the order of `SETTINGS`, so e.g. `mode` 0 (which resets all settings) comes first and
+        `servos` last. Broadcasts are not acknowledged; use `invalidate_shadow()` if a smarticle may have missed one.
 
-    def sync_thread_target(self,sync_period_s, keep_time):
+        ## Config
+        ---
+        `dict` of setting name to value, or to a `dict` of smarticle number to value for per-smarticle values
+        (smarticles not in that `dict` keep their value). Settings are those of the `set_*` methods with the same
+        value arguments: 'mode', 'debug', 'read_sensors', 'transmit_period', 'binary_transmit', 'transmit', 'sensor_threshold',
+        'light_plank', 'pose_epsilon', 'pose_noise', 'sync_noise', 'select_gait', 'servos'.
+        'gaits' is a `dict` of gait_num to (gait, delay_ms), uploaded to all smarticles with `gait_init()`.
+
+        e.g. `swarm.apply({'mode': 2, 'pose_noise': 10, 'sync_noise': {1: 50, 2: 100}, 'gaits': {0: (gait, 250)}, 'servos': 1})`
+
+        ## Returns
+        ---
+        number of messages sent
+        '''
+        unknown = set(config)-set(self.SETTINGS)
+        if unknown:
+            raise KeyError('Unknown settings: {}'.format(sorted(unknown)))
+        devices = self.xb.devices
+        n_sent = 0
+        for name in self.SETTINGS:
+            if name not in config:
+                continue
+            if name == 'gaits':
+                for gait_num, (gait, delay_ms) in sorted(config[name].items()):
+                    n_sent += int(self.gait_init(gait, delay_ms, gait_num))
+                continue
+            n_sent += self._apply_setting(name, config[name], devices)
+        return n_sent
+
+    def _apply_setting(self, name, spec, devices):
+        per_device = isinstance(spec, dict)
+        target = {}
+        current = {}
+        for n, dev in devices.items():
+            current[n] = self.shadow.get(str(dev.get_64bit_addr()), {}).get(name)
+            if not per_device:
+                target[n] = self.setting_frame(name, spec)
+            elif n in spec:
+                target[n] = self.setting_frame(name, spec[n])
+        need = [n for n in target if current[n] != target[n]]
+        if not need:
+            return 0
+        # option 1: unicast to every smarticle that needs a change
+        # option 2: broadcast the most common target, then unicast to smarticles that need another value
+        values = list(target.values())
+        common = max(set(values), key=values.count)
+        fix = []
+        for n in devices:
+            wanted = target.get(n, current[n])
+            if wanted is None:
+                # unknown value of a smarticle that is not configured can not be restored after a broadcast
+                fix = None
+                break
+            if wanted != common:
+                fix.append(n)
+        n_sent = 0
+        if fix is not None and 1+len(fix) < len(need):
+            self._send_setting(name, common, None)
+            n_sent += 1
+            need = fix
+        for n in need:
+            self._send_setting(name, target.get(n, current[n]), devices[n])
+            n_sent += 1
+        return n_sent
+
+    def sync_thread_target(self,sync_period_s, keep_time, calibrate=False):
         '''
         ## Description
         ---
         Thread to keep gaits in sync. Not used directly by user but called in `init_sync_thread`
         
         '''
+        sync_flag = self.sync_flag
+        stop_flag = self.timer_counts
+        if calibrate:
+            self._calibrated_sync(sync_period_s, keep_time, sync_flag, stop_flag)
+            return
         time_adjust_s=sync_period_s-0.0357 #subtract 35ms based on results from timing experiments
-        msg = bytearray(b'\x11')
         #threading.event.wait() blocks until it is a) set and then returns True or b) the specified timeout elapses in which it retrusn nothing
-        while self.sync_flag.wait() and not self.timer_counts.wait(timeout=(time_adjust_s)):
-                self.xb.broadcast(msg)
+        while sync_flag.wait() and not stop_flag.wait(timeout=(time_adjust_s)):
+                self._sync_pulse()
                 if keep_time:
                     t = time.time()
                     with self.lock:
                         self.sync_time_list.append(t)
 
+    def _calibrated_sync(self, sync_period_s, keep_time, sync_flag, stop_flag):
+        # sync pulses are scheduled on absolute deadlines and sent early by the measured dispatch latency,
+        # so that the broadcast completes on the deadline instead of a fixed 35ms correction.
+        # With the send queue running, pulses are queued SYNC_LEAD_S ahead so the queue keeps the link free for them
+        timer = DeadlineTimer(sync_period_s)
+        t_last = None
+        while not stop_flag.is_set():
+            if not sync_flag.is_set():
+                sync_flag.wait()
+                timer.start()
+                t_last = None
+                continue
+            lead_s = self.SYNC_LEAD_S if self.xb.send_queue is not None else 0.
+            timer.wait(-self.sync_correction_s-lead_s)
+            if stop_flag.is_set() or not sync_flag.is_set():
+                continue
+            deadline = timer.t_start+timer.tick*sync_period_s
+            t_call, t_done = self._sync_pulse(deadline-self.sync_correction_s)
+            self._sync_calibration(sync_period_s, deadline, t_call, t_done, t_last, keep_time)
+            t_last = t_done
+
+    def _sync_pulse(self, deadline = None):
+        # sends a sync pulse at `deadline` (monotonic, now if None), through the send queue with the highest
+        # priority if it is running; returns the times at which the broadcast started and completed
+        if self.xb.send_queue is None:
+            if deadline is not None:
+                sleep_until(deadline-self.xb.broadcast_compensation)
+            t_call = time.monotonic()
+            self.xb.broadcast(self.SYNC_MSG)
+            return t_call, time.monotonic()
+        queued = self.xb.command(self.SYNC_MSG, None, priority=SendQueue.SYNC, deadline=deadline)
+        queued = queued if isinstance(queued, list) else [queued]
+        for dispatch in queued:
+            dispatch.wait()
+        return min(d.t_sent for d in queued), max(d.t_done for d in queued)
+
+    def _reset_sync_calibration(self, initial_correction_s, gain):
+        self.sync_correction_s = initial_correction_s
+        self.sync_gain = gain
+        self.sync_latency = RunningStats()
+        self.sync_period_error = RunningStats()
+        self.sync_phase_error = RunningStats()
+
+    def _sync_calibration(self, sync_period_s, deadline, t_call, t_done, t_last, keep_time):
+        # updates the timing statistics with a pulse sent between `t_call` and `t_done` (monotonic clock)
+        # and returns the correction for the next pulse
+        dispatch = t_done-t_call
+        with self.lock:
+            self.sync_latency.update(dispatch)
+            self.sync_phase_error.update(t_done-deadline)
+            if t_last is not None:
+                self.sync_period_error.update((t_done-t_last)-sync_period_s)
+            # exponential moving average of the dispatch latency
+            self.sync_correction_s += self.sync_gain*(dispatch-self.sync_correction_s)
+            if keep_time:
+                self.sync_time_list.append(time.time())
+            return self.sync_correction_s
+
+    def sync_timing(self):
+        '''
+        ## Description
+        ---
+        Returns timing measurements of the sync thread started with `init_sync_thread(calibrate=True)`
 
+        ## Returns
+        ---
+        `dict` with keys:<br/>
+            &emsp; `correction_s`: current latency correction (pulses are sent this long before their deadline)<br/>
+            &emsp; `dispatch_latency_s`: statistics of the time `broadcast()` takes to send a pulse<br/>
+            &emsp; `period_error_s`: statistics of the difference between measured and nominal sync period<br/>
+            &emsp; `phase_error_s`: statistics of the time between each pulse's deadline and its completion<br/>
+        '''
+        with self.lock:
+            return {'correction_s': self.sync_correction_s, 'dispatch_latency_s': self.sync_latency.summary(),
+                    'period_error_s': self.sync_period_error.summary(), 'phase_error_s': self.sync_phase_error.summary()}
 
-    def init_sync_thread(self, keep_time=False):
+    def init_sync_thread(self, keep_time=False, calibrate=False, initial_correction_s=0.0357, gain=0.1):
         '''
         ## Description
         ---
         Initializes gait sync thread. Must be called every time the gait sequence is updated
+
+        With `calibrate` enabled, sync pulses are sent on absolute deadlines, the dispatch latency of each broadcast is measured
+        and the correction applied to the send time is adjusted online (see `sync_timing()`)
+
+        ## Arguments
+        ---
+
+        | Argument              | Type      | Description                                                              | Default Value |
+        | :------:              | :--:      | :---------:                                                              | :-----------: |
+        | keep_time             | `bool`    | record time of every sync pulse in `sync_time_list`                      | False         |
+        | calibrate             | `bool`    | measure dispatch latency and adjust the timing correction online          | False         |
+        | initial_correction_s  | `float`   | correction used until latency has been measured                          | 0.0357        |
+        | gain                  | `float`   | weight of each new latency measurement in the correction (0-1)           | 0.1           |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
         '''
+        # stop previous sync thread
+        if getattr(self, 'sync_thread', None) is not None:
+            self.timer_counts.set()
+            self.sync_flag.set()
         # calculate sync period: approximately 3s but must be a multiple of the gait delay
         self.sync_period_s = (self.gait_len*self.delay_ms)/1000
         print('sync_period: {}'.format(self.sync_period_s))
         if keep_time:
             self.sync_time_list =[]
-        self.sync_thread = threading.Thread(target=self.sync_thread_target, args= (self.sync_period_s,keep_time),  daemon = True)
+        self._reset_sync_calibration(initial_correction_s, gain)
+        self.sync_thread = threading.Thread(target=self.sync_thread_target, args= (self.sync_period_s,keep_time,calibrate),  daemon = True)
         self.timer_counts = threading.Event()
         self.sync_flag = threading.Event()
         self.sync_thread.start()
@@ -679,6 +1313,8 @@ class SmarticleSwarm(object):
         delay_t = self.delay_ms/3000
         #starts gait sequence
         self.set_servos(1)
+        #make sure gait sequence started before timing the sync sequence
+        self.flush()
         #wait 1/3 of gait delay to begin sync sequene
         time.sleep(delay_t)
         #set sync flag so that it returns True and stops blocking
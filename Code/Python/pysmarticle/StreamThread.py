@@ -4,33 +4,98 @@
 # Module built for SmarticleSwarm class for streaming servo commands
 
 import threading
-import time
+from DeadlineTimer import DeadlineTimer
+from GaitTable import GaitTable
+from SendQueue import SendQueue
 
 class StreamThread(threading.Thread):
+    '''
+    ## Description
+    ---
+    Thread that streams servo commands from `gait_f(t)` every `period_ms`.
+    Messages are sent on absolute monotonic deadlines (see `DeadlineTimer`), so the stream period
+    does not drift with the time spent evaluating the gait, and the thread sleeps between ticks
+    instead of busy waiting. `time_noise()` (in seconds) shifts individual ticks without moving later ones.
+    `t` follows the ticks of the timer, so ticks it skips after an overrun are skipped in the gait as well.
+    Timing statistics are available with `stats()`
 
-    def __init__(self,xbee,gait_f, period_ms, remote_device= None, time_noise= None):
+    `gait_f` may also be a `GaitTable` with the same period, in which case the precomputed messages are sent.
+    With a `PoseDelta` as `delta`, only poses that changed (plus periodic refreshes) are sent, and nothing is sent
+    on ticks without changes
+
+    With the send queue running, messages are queued with `SendQueue.STREAM` priority and the tick's deadline, so they
+    are sent after sync pulses but before other commands, and their lateness is reported by the send queue
+    '''
+
+    def __init__(self,xbee,gait_f, period_ms, remote_device= None, time_noise= None, spin_s=0.002, delta=None):
         if time_noise is None:
-            self.time_noise = lambda: 0
+            time_noise = lambda: 0
+        self.time_noise = time_noise
         self.xb = xbee
         self.run_flag = threading.Event()
         self.run_flag.set()
         self.exit_flag = threading.Event()
         self.exit_flag.clear()
         self.period_s = round(period_ms/1000,3)
+        if isinstance(gait_f, GaitTable) and gait_f.period_s != self.period_s:
+            raise ValueError('GaitTable period of {}s does not match stream period of {}s'.format(gait_f.period_s, self.period_s))
         self.gait = gait_f
         self.dev = remote_device
+        self.delta = delta
+        self.timer = DeadlineTimer(self.period_s, spin_s)
+        self.frames = 0
+        self.max_frames = 0
         super().__init__(target=self.target_function, args=(self.gait, self.period_s, self.dev, self.xb, self.time_noise), daemon = True)
 
     def kill(self):
         self.exit_flag.set()
+        # release thread if it is paused
+        self.run_flag.set()
+
+    def stats(self):
+        '''
+        ## Description
+        ---
+        Returns timing statistics of the stream (see `DeadlineTimer.stats()`) and the number of messages sent per tick
+        (`frames_per_tick`, `max_frames_per_tick`); poses that do not fit in one message are split, and with
+        several radios the messages of all radios are counted
+        '''
+        stats = self.timer.stats()
+        stats['frames_per_tick'] = self.frames/stats['ticks'] if stats['ticks'] else 0.
+        stats['max_frames_per_tick'] = self.max_frames
+        return stats
 
     def target_function(self,gaitf,period_s,dev,xb,time_noise):
-        t=0
-        while not self.exit_flag.is_set() and self.run_flag.wait():
-            t0 = time.time()
-            t_noise = time_noise()
-            msg = xb.format_stream_msg(gaitf(t))
-            while ((time.time()-t0<period_s+t_noise)):
-                pass
-            xb.command(msg,remote_device=dev)
-            t+=period_s
+        # ticks streamed before the last pause, so that the gait resumes where it was paused
+        base=0
+        table = gaitf if isinstance(gaitf, GaitTable) else None
+        delta = self.delta
+        self.timer.start()
+        while not self.exit_flag.is_set():
+            if not self.run_flag.is_set():
+                self.run_flag.wait()
+                # rebase deadlines after pausing so that missed ticks are not counted as overruns
+                base+=self.timer.tick
+                self.timer.start()
+                if self.exit_flag.is_set():
+                    break
+            # gait time follows the timer, so ticks it skipped are skipped in the gait too
+            tick=base+self.timer.tick
+            t=tick*period_s
+            if delta is not None:
+                poses = delta.update(table.poses[tick%len(table)] if table is not None else gaitf(t))
+                msg = xb.format_stream_msg(poses) if len(poses) else None
+            elif table is not None:
+                msg = table[tick]
+            else:
+                msg = xb.format_stream_msg(gaitf(t))
+            offset = time_noise()
+            self.timer.wait(offset)
+            if msg is not None:
+                deadline = self.timer.t_start+self.timer.tick*period_s+offset
+                xb.command(msg,remote_device=dev,priority=SendQueue.STREAM,deadline=deadline)
+            # messages of several radios (MultiXbeeComm.format_stream_msg) are counted per radio
+            msgs = [] if msg is None else msg.values() if isinstance(msg, dict) else [msg]
+            n_frames = sum(len(m) if isinstance(m, list) else 1 for m in msgs)
+            self.frames += n_frames
+            self.max_frames = max(self.max_frames, n_frames)
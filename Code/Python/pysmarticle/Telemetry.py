@@ -0,0 +1,353 @@
+# Telemetry.py
+# Alex Samland
+# October 17, 2026
+# Module for ingesting sensor data transmitted by the smarticles into
+# preallocated per-smarticle ring buffers
+
+import threading
+import time
+from LazyImport import lazy_import
+np = lazy_import('numpy', globals(), 'np')
+
+
+class Telemetry(object):
+    '''
+    ## Description
+    ---
+    Parses the sensor data that smarticles transmit when `set_transmit(1)` is enabled
+    (lines of `photo_front,photo_back,photo_right,current`) into one preallocated numpy ring buffer per smarticle.
+    Each row of a buffer is `[timestamp, photo_front, photo_back, photo_right, current]`.
+
+    With `set_binary_transmit(1)` smarticles send `RECORD_SIZE` byte records instead: `MAGIC`, an 8 bit sequence number
+    and the four values as little endian uint16. Payloads made only of records are decoded at once with
+    `np.frombuffer`; records and text lines can also be mixed and are kept in wire order. Gaps in the sequence numbers
+    are counted as lost samples (`lost()`).
+
+    Register `ingest` as a data received callback (see `SmarticleSwarm.start_telemetry`). Lines that are not sensor
+    samples (e.g. `PLANK 1` or debug output) are passed to `line_callback(smarticle_number, timestamp, line)` if given.
+
+    ## Arguments
+    ---
+
+    | Argument        | Type       | Description                                                          | Default Value |
+    | :------:        | :--:       | :---------:                                                          | :-----------: |
+    | capacity        | `int`      | number of samples kept per smarticle                                 | 4096          |
+    | line_callback   | function   | called with (smarticle number, timestamp, `bytes` line) for lines that are not samples | `None` |
+    |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+    '''
+    N_CHANNELS = 4
+    CHANNELS = ['photo_front', 'photo_back', 'photo_right', 'current']
+    # binary records, see Smarticle::transmit_data
+    MAGIC = 0x02
+    RECORD_SIZE = 2+2*N_CHANNELS
+
+    def __init__(self, capacity=4096, line_callback=None):
+        self.capacity = capacity
+        self.line_callback = line_callback
+        self.lock = threading.Lock()
+        self._buf = {}
+        self._count = {}
+        self._partial = {}
+        self._ids = {}
+        self._seq = {}
+        self._lost = {}
+        self._records = {}
+        self.stats = {'samples': 0, 'records': 0, 'lost': 0, 'resyncs': 0, 'other_lines': 0, 'bad_lines': 0}
+
+    def device_number(self, remote_device):
+        '''
+        ## Description
+        ---
+        Returns the smarticle number (digits of the node ID) of a remote device; cached by 64 bit address
+        '''
+        addr = str(remote_device.get_64bit_addr())
+        try:
+            return self._ids[addr]
+        except KeyError:
+            n = int(''.join([s for s in remote_device.get_node_id() if s.isdigit()]))
+            self._ids[addr] = n
+            return n
+
+    def _buffer(self, n):
+        buf = self._buf.get(n)
+        if buf is None:
+            buf = np.zeros((self.capacity, self.N_CHANNELS+1))
+            self._buf[n] = buf
+            self._count[n] = 0
+        return buf
+
+    def ingest(self, xbee_message):
+        '''
+        ## Description
+        ---
+        Data received callback. Takes an `XbeeMessage` and stores all complete sensor samples it contains.
+        Lines split across messages are reassembled
+        '''
+        t = time.time()
+        n = self.device_number(xbee_message.remote_device)
+        samples, other = self.parse(n, xbee_message.data)
+        if self.line_callback is not None:
+            for line in other:
+                self.line_callback(n, t, line)
+        if len(samples):
+            self.add_samples(n, t, samples)
+
+    def parse(self, n, data):
+        '''
+        ## Description
+        ---
+        Splits received data of smarticle `n` into sensor samples, in the order they were sent, and other lines. An
+        incomplete trailing line or record is kept and prepended to the next data of the same smarticle. Data that
+        starts with the end of a record whose start was lost is skipped up to the next record (counted in
+        `stats['resyncs']`)
+
+        ## Returns
+        ---
+        (`list` or Kx4 `np.array` of [photo_front, photo_back, photo_right, current] samples, `list` of other `bytes` lines)
+        '''
+        partial = self._partial.pop(n, b'')
+        data = partial+bytes(data)
+        size = self.RECORD_SIZE
+        if data and data[0] == self.MAGIC and len(data)%size == 0 and data[::size].count(self.MAGIC) == len(data)//size:
+            # only binary records
+            return self._decode_records(n, data), []
+        # samples are kept in wire order: text samples and runs of records are collected as consecutive chunks
+        chunks = []
+        rows = []
+        records = []
+        other = []
+        pos = 0
+        if not partial and n in self._seq and data and data[0] != self.MAGIC:
+            pos = self._resync(n, data)
+        end = len(data)
+        while pos < end:
+            if data[pos] == self.MAGIC:
+                if end-pos < size:
+                    self._partial[n] = data[pos:]
+                    break
+                if rows:
+                    chunks.append(np.array(rows).reshape(-1, self.N_CHANNELS))
+                    rows = []
+                records.append(data[pos:pos+size])
+                pos += size
+                continue
+            eol = data.find(b'\n', pos)
+            if eol < 0:
+                self._partial[n] = data[pos:]
+                break
+            line = data[pos:eol]
+            pos = eol+1
+            fields = line.split(b',')
+            if len(fields) == self.N_CHANNELS:
+                try:
+                    row = [int(f) for f in fields]
+                    if records:
+                        chunks.append(self._decode_records(n, b''.join(records)))
+                        records = []
+                    rows.append(row)
+                    continue
+                except ValueError:
+                    self.stats['bad_lines'] += 1
+            elif line:
+                self.stats['other_lines'] += 1
+            if line:
+                other.append(line)
+        if not chunks and not records:
+            return rows, other
+        if records:
+            chunks.append(self._decode_records(n, b''.join(records)))
+        if rows:
+            chunks.append(np.array(rows).reshape(-1, self.N_CHANNELS))
+        return np.concatenate(chunks), other
+
+    def _resync(self, n, data):
+        # data of smarticle n in binary mode that does not continue a kept partial record may start with the end of a
+        # record whose start was lost. Returns the offset of the first whole record: a MAGIC byte within the first
+        # RECORD_SIZE bytes followed by the expected sequence number (or the one after it, if the split record was the
+        # expected one) or by a record with the next sequence number; 0 if there is none or the bytes before it are a
+        # text line
+        size = self.RECORD_SIZE
+        expected = (self._seq[n]+1)%256
+        for pos in range(1, min(size, len(data)-1)):
+            if data[pos] != self.MAGIC:
+                continue
+            seq = data[pos+1]
+            nxt = pos+size
+            if seq in (expected, (expected+1)%256) or (nxt+1 < len(data) and data[nxt] == self.MAGIC
+                                                       and data[nxt+1] == (seq+1)%256):
+                break
+        else:
+            return 0
+        head = data[:pos]
+        if head.endswith(b'\n') and all(0x20 <= c < 0x7f for c in head[:-1]):
+            return 0
+        self.stats['resyncs'] += 1
+        return pos
+
+    def _decode_records(self, n, data):
+        size = self.RECORD_SIZE
+        k = len(data)//size
+        first, last = data[1], data[-size+1]
+        prev = self._seq.get(n)
+        # records missing between the sequence numbers (mod 256), assuming records are not reordered
+        lost = (last-first+1-k)%256 if prev is None else (last-prev-k)%256
+        self._seq[n] = last
+        if lost:
+            self._lost[n] = self._lost.get(n, 0)+lost
+            self.stats['lost'] += lost
+        self._records[n] = self._records.get(n, 0)+k
+        self.stats['records'] += k
+        # a record is a uint16 (MAGIC and sequence number) followed by the values
+        return np.frombuffer(data, dtype='<u2').reshape(k, size//2)[:, 1:]
+
+    def add_samples(self, n, t, samples):
+        '''
+        ## Description
+        ---
+        Writes samples for smarticle `n` into its ring buffer
+
+        ## Arguments
+        ---
+
+        | Argument        | Type       | Description                                                          | Default Value |
+        | :------:        | :--:       | :---------:                                                          | :-----------: |
+        | n               | `int`      | smarticle number                                                     | N/A           |
+        | t               | `float`    | timestamp of the samples                                             | N/A           |
+        | samples         | array like | Kx4 sensor values                                                    | N/A           |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+        '''
+        k = len(samples)
+        with self.lock:
+            buf = self._buffer(n)
+            count = self._count[n]
+            if k == 1:
+                idx = count%self.capacity
+                buf[idx, 0] = t
+                buf[idx, 1:] = samples[0]
+            else:
+                idx = np.arange(count, count+k)%self.capacity
+                buf[idx, 0] = t
+                buf[idx, 1:] = samples
+            self._count[n] = count+k
+            self.stats['samples'] += k
+
+    def ids(self):
+        '''
+        ## Description
+        ---
+        Returns sorted list of smarticle numbers that have sent samples
+        '''
+        with self.lock:
+            return sorted(self._buf.keys())
+
+    def count(self, n):
+        '''
+        ## Description
+        ---
+        Returns total number of samples received from smarticle `n`
+        '''
+        return self._count.get(n, 0)
+
+    def records(self, n):
+        '''
+        ## Description
+        ---
+        Returns the number of binary records received from smarticle `n`
+        '''
+        return self._records.get(n, 0)
+
+    def lost(self, n):
+        '''
+        ## Description
+        ---
+        Returns the number of binary records of smarticle `n` that did not arrive, from gaps in their sequence numbers
+        '''
+        return self._lost.get(n, 0)
+
+    def latest(self, n):
+        '''
+        ## Description
+        ---
+        Returns the latest sample of smarticle `n` as `[timestamp, photo_front, photo_back, photo_right, current]`,
+        or `None` if it has not sent any samples
+        '''
+        with self.lock:
+            count = self._count.get(n, 0)
+            if count == 0:
+                return None
+            return self._buf[n][(count-1)%self.capacity].copy()
+
+    def latest_all(self, ids=None):
+        '''
+        ## Description
+        ---
+        Returns the latest sample of several smarticles at once
+
+        ## Arguments
+        ---
+
+        | Argument        | Type       | Description                                                          | Default Value |
+        | :------:        | :--:       | :---------:                                                          | :-----------: |
+        | ids             | `list`     | smarticle numbers; all smarticles that sent samples if `None`        | `None`        |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        (`ids`, `np.array`) where row i of the Nx5 array is the latest sample of `ids[i]`; rows of smarticles without samples are `nan`
+        '''
+        with self.lock:
+            if ids is None:
+                ids = sorted(self._buf.keys())
+            out = np.full((len(ids), self.N_CHANNELS+1), np.nan)
+            for ii, n in enumerate(ids):
+                count = self._count.get(n, 0)
+                if count:
+                    out[ii] = self._buf[n][(count-1)%self.capacity]
+            return ids, out
+
+    def window(self, n, seconds=None):
+        '''
+        ## Description
+        ---
+        Returns samples of smarticle `n` in chronological order
+
+        ## Arguments
+        ---
+
+        | Argument        | Type       | Description                                                          | Default Value |
+        | :------:        | :--:       | :---------:                                                          | :-----------: |
+        | n               | `int`      | smarticle number                                                     | N/A           |
+        | seconds         | `float`    | only return samples within this many seconds of the latest; all buffered samples if `None` | `None` |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        Kx5 `np.array` of samples
+        '''
+        with self.lock:
+            count = self._count.get(n, 0)
+            if count == 0:
+                return np.zeros((0, self.N_CHANNELS+1))
+            buf = self._buf[n]
+            if count <= self.capacity:
+                out = buf[:count].copy()
+            else:
+                start = count%self.capacity
+                out = np.concatenate((buf[start:], buf[:start]))
+        if seconds is not None:
+            out = out[np.searchsorted(out[:, 0], out[-1, 0]-seconds):]
+        return out
+
+    def clear(self):
+        '''
+        ## Description
+        ---
+        Discards all buffered samples
+        '''
+        with self.lock:
+            self._buf = {}
+            self._count = {}
+            self._partial = {}
+            self._seq = {}
+            self._lost = {}
+            self._records = {}
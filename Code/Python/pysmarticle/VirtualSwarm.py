@@ -0,0 +1,661 @@
+# VirtualSwarm.py
+# Alex Samland
+# October 17, 2026
+# Module providing an in-process stand in for the local Raw802Device and a swarm
+# of virtual smarticles that interpret messages the same way Smarticle.cpp does
+
+import threading
+import random
+import struct
+import time
+
+try:
+    from digi.xbee.models.status import NetworkDiscoveryStatus
+    from digi.xbee.exception import TimeoutException
+    DISCOVERY_SUCCESS = NetworkDiscoveryStatus.SUCCESS
+except ImportError:
+    class TimeoutException(Exception):
+        '''Raised when a virtual smarticle does not acknowledge a unicast'''
+        pass
+
+    class _DiscoveryStatus(object):
+        description = 'Success'
+    DISCOVERY_SUCCESS = _DiscoveryStatus()
+
+
+# constants mirrored from Smarticle.h
+MAX_GAIT_SIZE = 15
+MAX_GAIT_NUM = 8
+SENSOR_COUNT = 4
+GAIT_OFFSET = 7
+VALUE_OFFSET = 3
+ASCII_OFFSET = 32
+MAX_DATA_PAYLOAD = 108
+MAX_MSG_SIZE = 40
+MSG_BUFF_SIZE = 4
+DEFAULT_SAMPLE_TIME_MS = 10
+TELEMETRY_MAGIC = 0x02
+T4_TICK_MS = 0.128
+
+IDLE, STREAM, INTERP = 0, 1, 2
+
+
+class VirtualAddress(object):
+    '''
+    ## Description
+    ---
+    Minimal stand in for `XBee64BitAddress`. `str()` returns the address as a hex string
+    '''
+    def __init__(self, address):
+        self.address = address
+
+    def __str__(self):
+        return '{:016X}'.format(self.address)
+
+    def __eq__(self, other):
+        return str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+
+class VirtualRemote(object):
+    '''
+    ## Description
+    ---
+    Stand in for `RemoteRaw802Device`. Exposes the node ID and 64 bit address of a `VirtualSmarticle`
+    '''
+    def __init__(self, node_id, address):
+        self._node_id = node_id
+        self._address = VirtualAddress(address)
+
+    def get_node_id(self):
+        return self._node_id
+
+    def get_64bit_addr(self):
+        return self._address
+
+    def __repr__(self):
+        return '{} - {}'.format(self._address, self._node_id)
+
+
+class VirtualMessage(object):
+    '''
+    ## Description
+    ---
+    Stand in for `XBeeMessage` passed to data received callbacks
+    '''
+    def __init__(self, data, remote_device, timestamp, broadcast=False):
+        self.data = bytearray(data)
+        self.remote_device = remote_device
+        self.timestamp = timestamp
+        self.is_broadcast = broadcast
+
+
+class VirtualTransmitStatus(object):
+    '''
+    ## Description
+    ---
+    Stand in for the transmit status response returned by `send_data`
+    '''
+    def __init__(self, frame_id):
+        self.frame_id = frame_id
+        self.transmit_status = 'SUCCESS'
+
+
+class VirtualSmarticle(object):
+    '''
+    ## Description
+    ---
+    Emulates the message handling of a single smarticle (`Smarticle::rx_interrupt`, `Smarticle::manage_msg`
+    and `Smarticle::_interp_msg`) and keeps track of the resulting state.
+    Servo outputs are not simulated in time; `pose` holds the last commanded pose.
+
+    ## Arguments
+    ---
+
+    | Argument        | Type       | Description                                                          | Default Value |
+    | :------:        | :--:       | :---------:                                                          | :-----------: |
+    | number          | `int`      | smarticle number used for the node ID                                | N/A           |
+    | sensor_fn       | function   | function of (smarticle, t) returning 4 sensor values (0-1023)        | `None`        |
+    | ack_latency_s   | `float`    | simulated round trip time of a unicast acknowledgement               | 0             |
+    | reachable       | `bool`     | if False unicasts time out and broadcasts are not received           | True          |
+    | latency_s       | `float`    | one way link latency simulated for ping replies                      | 0             |
+    |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+    '''
+
+    def __init__(self, number, sensor_fn=None, ack_latency_s=0, reachable=True, latency_s=0):
+        self.number = number
+        self.remote = VirtualRemote('S{:02d}'.format(number), 0x0013A20041000000+number)
+        self.sensor_fn = sensor_fn
+        self.ack_latency_s = ack_latency_s
+        self.reachable = reachable
+        self.latency_s = latency_s
+        self.tx_fun = None
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        '''
+        ## Description
+        ---
+        Resets smarticle to its power on state and clears its statistics
+        '''
+        with self.lock:
+            self.id = 0
+            self.mode = IDLE
+            self.led = 0
+            self.debug = 0
+            self.servos_attached = 0
+            self.t4_enabled = 0
+            self.plank = 0
+            self.pose = [90, 90]
+            self.gait_num = 0
+            self.gait_pts = [1]*MAX_GAIT_NUM
+            self.gaitL = [[90] for ii in range(MAX_GAIT_NUM)]
+            self.gaitR = [[90] for ii in range(MAX_GAIT_NUM)]
+            self.t4_top = 3906
+            self.pose_noise = 0
+            self.gait_epsilon = 0
+            self.sync_noise = 0
+            self.stream_timing_noise = 0
+            self.transmit_counts = 10
+            self.read_sensors = 0
+            self.transmit = 0
+            self.binary_transmit = 0
+            self.light_plank = 0
+            self.sensor_threshold = [1500]*SENSOR_COUNT
+            self.sensor_dat = [0]*SENSOR_COUNT
+            self._transmit_seq = 0
+            self._rx_buf = bytearray()
+            self._msg_buf = []
+            self._transmit_count = 0
+            self.stats = {'rx_bytes': 0, 'rx_msgs': 0, 'processed_msgs': 0, 'bad_format': 0,
+                          'overflows': 0, 'dropped_msgs': 0, 'sync_pulses': 0, 'tx_msgs': 0}
+            self.last_sync_time = None
+            self.msg_log = []
+            # millis() counts from power on
+            self._t_boot = time.monotonic()
+
+    def millis(self, t=None):
+        return int(((time.monotonic() if t is None else t)-self._t_boot)*1000)
+
+    def state(self):
+        '''
+        ## Description
+        ---
+        Returns a snapshot of the smarticle state
+
+        ## Returns
+        ---
+        `dict` of mode, pose, gaits, noise settings and flags
+        '''
+        with self.lock:
+            gaits = {}
+            for n in range(MAX_GAIT_NUM):
+                pts = self.gait_pts[n]
+                gaits[n] = [self.gaitL[n][:pts], self.gaitR[n][:pts]]
+            return {'id': self.id, 'mode': self.mode, 'led': self.led, 'debug': self.debug,
+                    'servos': self.t4_enabled, 'plank': self.plank, 'pose': list(self.pose),
+                    'gait_num': self.gait_num, 'gaits': gaits, 't4_top': self.t4_top,
+                    'delay_ms': self.t4_top*T4_TICK_MS, 'pose_noise': self.pose_noise,
+                    'gait_epsilon': self.gait_epsilon, 'sync_noise': self.sync_noise,
+                    'stream_timing_noise': self.stream_timing_noise,
+                    'transmit_counts': self.transmit_counts, 'read_sensors': self.read_sensors,
+                    'transmit': self.transmit, 'binary_transmit': self.binary_transmit,
+                    'light_plank': self.light_plank,
+                    'sensor_threshold': list(self.sensor_threshold)}
+
+    def receive(self, data):
+        '''
+        ## Description
+        ---
+        Feeds received bytes through the equivalent of `Smarticle::rx_interrupt` and interprets completed messages
+        '''
+        if isinstance(data, str):
+            data = data.encode('utf8', errors='ignore')
+        with self.lock:
+            self.stats['rx_bytes'] += len(data)
+            for c in data:
+                if c == 0x11:
+                    self.stats['sync_pulses'] += 1
+                    self.last_sync_time = time.time()
+                elif c != 0x0A:
+                    if len(self._rx_buf) >= MAX_MSG_SIZE-1:
+                        self.stats['overflows'] += 1
+                    self._rx_buf.append(c)
+                else:
+                    self.stats['rx_msgs'] += 1
+                    if len(self._msg_buf) >= MSG_BUFF_SIZE:
+                        self._msg_buf.pop(0)
+                        self.stats['dropped_msgs'] += 1
+                    self._msg_buf.append(bytes(self._rx_buf))
+                    self._rx_buf = bytearray()
+            self.manage_msg()
+
+    def manage_msg(self):
+        '''
+        ## Description
+        ---
+        Interprets all buffered messages, equivalent to `Smarticle::manage_msg`
+        '''
+        with self.lock:
+            while self._msg_buf:
+                msg = self._msg_buf.pop(0)
+                if len(msg) > 2 and msg[0] == 0x13 and msg[1] == 0x13:
+                    self.stats['processed_msgs'] += 1
+                    self.msg_log.append((time.time(), msg))
+                    self._interp_msg(msg)
+                else:
+                    self.stats['bad_format'] += 1
+
+    def _val(self, msg, ii):
+        return (msg[ii]-ASCII_OFFSET) if ii < len(msg) else 0
+
+    def _convert_to_16bit(self, c1, c2):
+        return ((c1 << 7) | (c2 & 0x7f)) & 0x3fff
+
+    def _interp_msg(self, msg):
+        code = msg[2]
+        if 0x20 <= code < 0x30:
+            value1 = self._val(msg, VALUE_OFFSET)
+            if code == 0x20:
+                self.led = 1 if value1 == 1 else 0
+            elif code == 0x21:
+                self.set_mode(value1)
+            elif code == 0x22:
+                self.t4_enabled = 1 if (self.mode == INTERP and value1 == 1) else 0
+            elif code == 0x23:
+                self.transmit_counts = value1
+            elif code == 0x24:
+                self.gait_num = value1
+            elif code == 0x25:
+                self.read_sensors = 1 if value1 == 1 else 0
+            elif code == 0x26:
+                self.transmit = 1 if value1 == 1 else 0
+            elif code == 0x27:
+                self.gait_epsilon = value1
+            elif code == 0x28:
+                self.pose_noise = value1
+            elif code == 0x29:
+                self.light_plank = value1
+            elif code == 0x2A:
+                self.debug = value1
+            elif code == 0x2B:
+                self.id = value1
+            elif code == 0x2C:
+                self._echo(value1)
+            elif code == 0x2D:
+                self.binary_transmit = 1 if value1 == 1 else 0
+        elif 0x30 <= code <= 0x34:
+            value1 = self._val(msg, VALUE_OFFSET)
+            value2 = self._val(msg, VALUE_OFFSET+1)
+            if code == 0x30:
+                self.pose = [value1, value2]
+            elif code == 0x31:
+                self.sync_noise = self._convert_to_16bit(value1, value2)
+            elif code == 0x32:
+                self.stream_timing_noise = self._convert_to_16bit(value1, value2)
+        elif code == 0x40:
+            # mirrors firmware, which reads overlapping character pairs without removing the ascii offset
+            self.sensor_threshold = [self._convert_to_16bit(msg[VALUE_OFFSET+ii], msg[VALUE_OFFSET+ii+1])
+                                     for ii in range(SENSOR_COUNT)]
+        elif code == 0x41:
+            self._init_gait(msg)
+        elif code == 0x42:
+            if self.mode == STREAM:
+                self._interp_batch(msg, 3)
+        elif code == 0x43:
+            self._interp_batch(msg, 2)
+
+    def set_mode(self, m):
+        self.mode = m if m in (IDLE, STREAM, INTERP) else IDLE
+        if self.mode == IDLE:
+            self.t4_enabled = 0
+            self.servos_attached = 0
+            self.read_sensors = 0
+            self.transmit = 0
+            self.binary_transmit = 0
+            self.plank = 0
+            self.light_plank = 0
+            self.sync_noise = 0
+            self.pose_noise = 0
+            self.gait_epsilon = 0
+            self.transmit_counts = 1
+            self.stream_timing_noise = 0
+            self.sensor_threshold = [1500]*SENSOR_COUNT
+            self.gait_num = 0
+            self.t4_top = 3906
+            for ii in range(MAX_GAIT_NUM):
+                self.gaitL[ii] = [90]
+                self.gaitR[ii] = [90]
+                self.gait_pts[ii] = 1
+        elif not self.servos_attached:
+            self.servos_attached = 1
+            self.pose = [90, 90]
+
+    def _echo(self, seq):
+        # reply as Smarticle::echo; the message is taken to arrive latency_s after it was sent and the reply
+        # is delivered latency_s after it was sent
+        t_rx = time.monotonic()+self.latency_s
+        data = 'E{},{},{}\n'.format(seq, self.millis(t_rx), self.millis(t_rx)).encode()
+        if self.latency_s:
+            threading.Timer(2*self.latency_s, self._tx, args=(data,)).start()
+        else:
+            self._tx(data)
+
+    def _init_gait(self, msg):
+        self.t4_enabled = 0
+        n = self._val(msg, VALUE_OFFSET)
+        gait_len = self._val(msg, VALUE_OFFSET+1)
+        if n >= MAX_GAIT_NUM or gait_len > MAX_GAIT_SIZE:
+            self.stats['bad_format'] += 1
+            return
+        self.gait_pts[n] = gait_len
+        self.t4_top = self._convert_to_16bit(self._val(msg, VALUE_OFFSET+2), self._val(msg, VALUE_OFFSET+3))
+        self.gaitL[n] = [self._val(msg, GAIT_OFFSET+ii) for ii in range(gait_len)]
+        self.gaitR[n] = [self._val(msg, GAIT_OFFSET+gait_len+ii) for ii in range(gait_len)]
+
+    def _interp_batch(self, msg, width):
+        msg_len = self._val(msg, VALUE_OFFSET)
+        for ii in range(VALUE_OFFSET+1, width*msg_len+VALUE_OFFSET+1, width):
+            val = self._val(msg, ii)
+            if val == 0 or val == self.id:
+                if width == 3:
+                    self.pose = [self._val(msg, ii+1), self._val(msg, ii+2)]
+                else:
+                    self.plank = 1 if self._val(msg, ii+1) == 1 else 0
+                break
+
+    def loop(self, t=None):
+        '''
+        ## Description
+        ---
+        Runs one iteration of the firmware main loop: reads sensors, evaluates light planking and transmits data
+        '''
+        if t is None:
+            t = time.time()
+        out = []
+        with self.lock:
+            if self.read_sensors:
+                if self.sensor_fn is None:
+                    self.sensor_dat = [random.randint(0, 1023) for ii in range(SENSOR_COUNT)]
+                else:
+                    self.sensor_dat = [int(v) for v in self.sensor_fn(self, t)]
+                if self.light_plank and self.mode == INTERP:
+                    trigger = any(s >= th for s, th in zip(self.sensor_dat, self.sensor_threshold))
+                    if self.plank == 0 and trigger:
+                        self.plank = 1
+                        out.append(b'PLANK 1\n')
+                    elif self.plank == 1 and not trigger:
+                        self.plank = 0
+                        out.append(b'PLANK 0\n')
+            if self.transmit:
+                self._transmit_count += 1
+                if self._transmit_count >= self.transmit_counts:
+                    if self.binary_transmit:
+                        out.append(struct.pack('<BB4H', TELEMETRY_MAGIC, self._transmit_seq, *self.sensor_dat))
+                        self._transmit_seq = (self._transmit_seq+1)&0xFF
+                    else:
+                        out.append('{},{},{},{}\n'.format(*self.sensor_dat).encode())
+                    self._transmit_count = 0
+        for data in out:
+            self._tx(data)
+
+    def _tx(self, data):
+        self.stats['tx_msgs'] += 1
+        if self.tx_fun is not None:
+            self.tx_fun(self, data)
+
+
+class VirtualNetwork(object):
+    '''
+    ## Description
+    ---
+    Stand in for `XBeeNetwork` used during discovery
+    '''
+    def __init__(self, radio):
+        self.radio = radio
+        self.discovery_timeout = 15
+        self._discovered = []
+        self._device_cbs = []
+        self._finished_cbs = []
+
+    def clear(self):
+        self._discovered = []
+
+    def set_discovery_timeout(self, timeout):
+        self.discovery_timeout = timeout
+
+    def add_device_discovered_callback(self, callback):
+        self._device_cbs.append(callback)
+
+    def add_discovery_process_finished_callback(self, callback):
+        self._finished_cbs.append(callback)
+
+    def start_discovery_process(self):
+        for smart in self.radio.smarticles.values():
+            if smart.reachable and smart.remote not in self._discovered:
+                self._discovered.append(smart.remote)
+                for cb in self._device_cbs:
+                    cb(smart.remote)
+        for cb in self._finished_cbs:
+            cb(DISCOVERY_SUCCESS)
+
+    def is_discovery_running(self):
+        return False
+
+    def discover_device(self, node_id):
+        for smart in self.radio.smarticles.values():
+            if smart.reachable and smart.remote.get_node_id() == node_id:
+                if smart.remote not in self._discovered:
+                    self._discovered.append(smart.remote)
+                return smart.remote
+        return None
+
+    def get_devices(self):
+        return list(self._discovered)
+
+
+class VirtualRadio(object):
+    '''
+    ## Description
+    ---
+    In-process stand in for `digi.xbee.devices.Raw802Device` connected to a swarm of `VirtualSmarticle`s.
+    Pass it to `XbeeComm` or `SmarticleSwarm` with the `base` argument to run without hardware.
+
+    ## Arguments
+    ---
+
+    | Argument        | Type       | Description                                                               | Default Value |
+    | :------:        | :--:       | :---------:                                                               | :-----------: |
+    | n               | `int`      | number of virtual smarticles, numbered 1 to n                             | 8             |
+    | baud_rate       | `int`      | baud rate used to simulate serial airtime                                 | 9600          |
+    | airtime         | `bool`     | if True, sending blocks for the serial transmission time of the frame and received frames are dropped when more than `RX_BUFFER_BYTES` wait for the serial link | False |
+    | ack_timeout_s   | `float`    | time before a unicast to an unreachable smarticle raises a timeout        | 0.5           |
+    | sensor_fn       | function   | function of (smarticle, t) returning 4 sensor values, see `VirtualSmarticle` | `None`     |
+    |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+    '''
+    # bytes added by the API frame around the payload of a 64 bit transmit request
+    FRAME_OVERHEAD = 15
+    # bytes added by the API frame around the payload of a 64 bit receive packet
+    RX_FRAME_OVERHEAD = 15
+    # serial buffer of the local XBee for received frames
+    RX_BUFFER_BYTES = 256
+    # name of the backend `XbeeComm` uses with this base, see `Backends`
+    backend = 'virtual'
+
+    def __init__(self, n=8, baud_rate=9600, airtime=False, ack_timeout_s=0.5, sensor_fn=None):
+        self.smarticles = {}
+        for ii in range(1, n+1):
+            self.add_smarticle(VirtualSmarticle(ii, sensor_fn=sensor_fn))
+        self.baud_rate = baud_rate
+        self.airtime = airtime
+        self.ack_timeout_s = ack_timeout_s
+        self.network = VirtualNetwork(self)
+        self._open = False
+        self._rx_callbacks = []
+        self._link_lock = threading.Lock()
+        self._frame_id = 0
+        self._rx_lock = threading.Lock()
+        self._rx_free = 0.
+        self._loop_thread = None
+        self._loop_exit = threading.Event()
+        self.stats = {'tx_frames': 0, 'tx_bytes': 0, 'broadcast_frames': 0, 'unicast_frames': 0,
+                      'timeouts': 0, 'rx_frames': 0, 'rx_dropped': 0}
+
+    def add_smarticle(self, smarticle):
+        smarticle.tx_fun = self._deliver
+        self.smarticles[smarticle.number] = smarticle
+        return smarticle
+
+    def states(self):
+        '''
+        ## Description
+        ---
+        Returns `dict` of smarticle number to `VirtualSmarticle.state()`
+        '''
+        return {n: s.state() for n, s in self.smarticles.items()}
+
+    def open(self):
+        self._open = True
+
+    def close(self):
+        self.stop()
+        self._open = False
+
+    def is_open(self):
+        return self._open
+
+    def get_network(self):
+        return self.network
+
+    def get_sync_ops_timeout(self):
+        return self.ack_timeout_s
+
+    def set_sync_ops_timeout(self, timeout):
+        self.ack_timeout_s = timeout
+
+    def add_data_received_callback(self, callback):
+        self._rx_callbacks.append(callback)
+
+    def del_data_received_callback(self, callback):
+        if callback in self._rx_callbacks:
+            self._rx_callbacks.remove(callback)
+
+    def create_remote(self, address, node_id):
+        '''
+        ## Description
+        ---
+        Returns a remote device for the given 64 bit address (hex string) and node ID, used to restore cached devices
+        '''
+        return VirtualRemote(node_id, int(address, 16))
+
+    def _lookup(self, remote_device):
+        for smart in self.smarticles.values():
+            if smart.remote is remote_device or smart.remote.get_64bit_addr() == remote_device.get_64bit_addr():
+                return smart
+        return None
+
+    def _transmit(self, data, broadcast):
+        if isinstance(data, str):
+            data = data.encode('utf8', errors='ignore')
+        if not self._open:
+            raise RuntimeError('Virtual radio is not open')
+        if len(data) > MAX_DATA_PAYLOAD:
+            raise ValueError('Payload exceeds {} bytes'.format(MAX_DATA_PAYLOAD))
+        with self._link_lock:
+            if self.airtime:
+                time.sleep((len(data)+self.FRAME_OVERHEAD)*10/self.baud_rate)
+            self.stats['tx_frames'] += 1
+            self.stats['tx_bytes'] += len(data)
+            self.stats['broadcast_frames' if broadcast else 'unicast_frames'] += 1
+            self._frame_id = self._frame_id%0xFF+1
+            frame_id = self._frame_id
+        return data, frame_id
+
+    def get_next_frame_id(self):
+        with self._link_lock:
+            self._frame_id = self._frame_id%0xFF+1
+            return self._frame_id
+
+    def send_data(self, remote_device, data):
+        data, frame_id = self._transmit(data, False)
+        smart = self._lookup(remote_device)
+        if smart is None or not smart.reachable:
+            time.sleep(self.ack_timeout_s)
+            self.stats['timeouts'] += 1
+            raise TimeoutException('Response not received in the configured timeout.')
+        smart.receive(data)
+        if smart.ack_latency_s:
+            time.sleep(smart.ack_latency_s)
+        return VirtualTransmitStatus(frame_id)
+
+    def send_data_async(self, remote_device, data):
+        data, frame_id = self._transmit(data, False)
+        smart = self._lookup(remote_device)
+        if smart is not None and smart.reachable:
+            smart.receive(data)
+
+    def send_data_broadcast(self, data):
+        data, frame_id = self._transmit(data, True)
+        for smart in list(self.smarticles.values()):
+            if smart.reachable:
+                smart.receive(data)
+
+    def _deliver(self, smarticle, data):
+        if self.airtime:
+            with self._rx_lock:
+                now = time.monotonic()
+                if (self._rx_free-now)*self.baud_rate/10 > self.RX_BUFFER_BYTES:
+                    self.stats['rx_dropped'] += 1
+                    return
+                self._rx_free = max(self._rx_free, now)+(len(data)+self.RX_FRAME_OVERHEAD)*10/self.baud_rate
+        self.stats['rx_frames'] += 1
+        msg = VirtualMessage(data, smarticle.remote, time.time())
+        for cb in list(self._rx_callbacks):
+            cb(msg)
+
+    def step(self):
+        '''
+        ## Description
+        ---
+        Runs one firmware loop iteration on every smarticle
+        '''
+        t = time.time()
+        for smart in list(self.smarticles.values()):
+            if smart.reachable:
+                smart.loop(t)
+
+    def start(self, sample_time_ms=DEFAULT_SAMPLE_TIME_MS):
+        '''
+        ## Description
+        ---
+        Starts a background thread that calls `step()` every `sample_time_ms`, emulating the firmware main loop
+        so that smarticles transmit sensor data and evaluate light planking
+        '''
+        if self._loop_thread is not None and self._loop_thread.is_alive():
+            return
+        period_s = sample_time_ms/1000
+        self._loop_exit.clear()
+
+        def loop_target():
+            deadline = time.monotonic()
+            while not self._loop_exit.is_set():
+                self.step()
+                deadline += period_s
+                self._loop_exit.wait(max(0, deadline-time.monotonic()))
+
+        self._loop_thread = threading.Thread(target=loop_target, daemon=True)
+        self._loop_thread.start()
+
+    def stop(self):
+        '''
+        ## Description
+        ---
+        Stops the firmware loop thread started with `start()`
+        '''
+        self._loop_exit.set()
+        if self._loop_thread is not None:
+            self._loop_thread.join()
+            self._loop_thread = None
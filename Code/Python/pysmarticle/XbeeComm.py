@@ -3,12 +3,19 @@
 # August 1, 2019
 # Module for communicating with smarticle swarm over Xbee3s
 
+import os
+import json
 import time
-import numpy as np
-from digi.xbee.models.status import NetworkDiscoveryStatus
-from digi.xbee.devices import Raw802Device
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from Backends import get_backend
+from MsgEncoder import MsgEncoder
+from SendQueue import SendQueue
+from DeadlineTimer import sleep_until
+from Metrics import Metrics
 
 default_port = '/dev/tty.usbserial-DN050I6Q'
+msg_code_names = {code: name for name, code in MsgEncoder.msg_code_dict.items()}
 
 class XbeeComm(object):
     ''''
@@ -19,10 +26,11 @@ class XbeeComm(object):
         https://github.com/digidotcom/xbee-python
         <br/>
         
-    The Constructor initalizes and opens local base xbee (connected via USB) with given port and baud rate and adds it to attribute `base`'''
+    The local base xbee (connected via USB) is created with the backend and opened with given port and baud rate the
+    first time attribute `base` is used, so no radio is needed until something is sent or received'''
 
 
-    def __init__(self, port='/dev/tty.usbserial-DN050I6Q', baud_rate = 9600, debug = 0):
+    def __init__(self, port='/dev/tty.usbserial-DN050I6Q', baud_rate = 9600, debug = 0, base = None, backend = None):
         '''
 
         ## Arguments
@@ -33,22 +41,61 @@ class XbeeComm(object):
         | port      | `string` | USB port to open for local XBee            | set for your own convenience |
         | baud_rate | `int`    | Baud rate to use for USB serial port       | 9600                                |
         | debug     | `int`    | Enables/disables print statements in class | 0                                   |
+        | base      | --       | Object used in place of `Raw802Device`, e.g. `VirtualSwarm.VirtualRadio`; port and baud rate are ignored if given | `None` |
+        | backend   | `string` | Radio implementation, see `Backends`: 'digi' (`Raw802Device`) or 'virtual' (`VirtualSwarm.VirtualRadio`). Defaults to the `backend` attribute of `base` if it has one, else 'digi' | `None` |
         |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
 
         '''
 
-        self.base = Raw802Device(port, baud_rate)
+        self.port = port
+        self.baud_rate = baud_rate
         self.debug = debug
-        self.open_base()
+        self.backend_name = backend or getattr(base, 'backend', 'digi')
+        self._base = base
+        self._base_lock = threading.Lock()
+        self._opened = False
+        self._rx_counting = False
         self.callbacks_added = False
         self.ascii_offset = 32
+        self.devices = {}
+        self.encoder = MsgEncoder()
+        self.concurrent_ack = False
+        self.max_in_flight = 16
+        self._ack_pool = None
+        self.send_queue = None
+        self._tx_callbacks = []
+        self.metrics = Metrics()
+        self._rx_wrappers = {}
+        self._tx_wrappers = {}
+        # index of this radio in a MultiXbeeComm
+        self.radio_index = 0
+        # 64 bit address -> one way latency (s) by which unicasts with a deadline are sent early, see LatencyProbe
+        self.latency_compensation = {}
+        # one way latency (s) by which broadcasts with a deadline are sent early, see LatencyProbe
+        self.broadcast_compensation = 0.
+
+    @property
+    def backend(self):
+        '''
+        Backend object of `backend_name`, see `Backends.get_backend()`
+        '''
+        return get_backend(self.backend_name)
 
+    @property
+    def base(self):
+        '''
+        Local xbee; created and opened on first use
+        '''
+        if not self._opened:
+            self.open_base()
+        return self._base
 
     def open_base(self):
         '''
         ## Description
         ---
-        Opens local xbee defined by attribute 'base' which is set in `__init__`
+        Opens local xbee defined by attribute 'base', creating it with the backend if none was given to `__init__`.
+        Called on first use of `base`
 
         ## Arguments
         ---
@@ -60,8 +107,16 @@ class XbeeComm(object):
         This function returns a 1 if it successfully opens the local port and a 0 otherwise.
         '''
         success = 0
-        self.base.open()
-        if self.base is not None and self.base.is_open():
+        with self._base_lock:
+            if self._base is None:
+                self._base = self.backend.create_base(self.port, self.baud_rate)
+            if not self._opened:
+                self._base.open()
+                self._opened = True
+                if not self._rx_counting:
+                    self._base.add_data_received_callback(self._count_rx)
+                    self._rx_counting = True
+        if self._base.is_open():
             success = 1
         elif self.debug:
             print("Failed to open device")
@@ -82,8 +137,14 @@ class XbeeComm(object):
         ---
         `None`
         '''
-        if self.base is not None and self.base.is_open():
-            self.base.close()
+        self.stop_send_queue()
+        self.stop_stats_dump()
+        if self._ack_pool is not None:
+            self._ack_pool.shutdown(wait=False)
+            self._ack_pool = None
+        if self._opened and self._base.is_open():
+            self._base.close()
+        self._opened = False
 
     def add_callbacks(self):
         '''
@@ -98,7 +159,7 @@ class XbeeComm(object):
 
         # Callback for discovery finished.
         def callback_discovery_finished(status):
-            if status == NetworkDiscoveryStatus.SUCCESS:
+            if status == self.backend.DISCOVERY_SUCCESS:
                 # print("Discovery process finished successfully.\nDevices: {}".format(self.devices))
                 print("Discovery cycle finished\n")
             else:
@@ -135,7 +196,7 @@ class XbeeComm(object):
         self.devices[smarticle_number]=remote_device
 
 
-    def discover(self):
+    def discover(self, clear = True, timeout = 15):
         '''
         ## Description
         ---
@@ -146,16 +207,21 @@ class XbeeComm(object):
         ## Arguments
         ---
 
-        None
+        | Argument        | Type                      | Description                                                                   | Default Value |
+        | :------:        | :--:                      | :---------:                                                                   | :-----------: |
+        | clear           | `bool`                    | If False, devices already in `devices` (e.g. loaded from cache) are kept      | True          |
+        | timeout         | `int`                     | Discovery timeout in seconds                                                  | 15            |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
 
         ## Returns
         ---
         `None`
         '''
-        self.devices ={}
+        if clear:
+            self.devices ={}
         self.network = self.base.get_network()
         self.network.clear()
-        self.network.set_discovery_timeout(15)  # 15 seconds.
+        self.network.set_discovery_timeout(timeout)
 
         if self.callbacks_added == False:
             self.add_callbacks()
@@ -168,6 +234,78 @@ class XbeeComm(object):
             time.sleep(0.1)
 
 
+    def save_devices(self, cache_file):
+        '''
+        ## Description
+        ---
+        Saves smarticle number, node ID and 64 bit address of all devices in `devices` dictionary to a JSON file,
+        so they can be restored with `load_devices()` instead of running network discovery
+
+        ## Arguments
+        ---
+
+        | Argument        | Type                      | Description                                                                   | Default Value |
+        | :------:        | :--:                      | :---------:                                                                   | :-----------: |
+        | cache_file      | `string`                  | path of device cache file                                                     | N/A           |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `None`
+        '''
+        records = [{'number': n, 'node_id': dev.get_node_id(), 'address': str(dev.get_64bit_addr())}
+                   for n, dev in sorted(self.devices.items())]
+        with open(cache_file, 'w') as f:
+            json.dump({'devices': records}, f, indent=1)
+
+    def load_devices(self, cache_file, verify = True, verify_timeout = 1.0):
+        '''
+        ## Description
+        ---
+        Rebuilds remote devices saved with `save_devices()` and adds them to the `devices` dictionary.
+        If `verify` is True, an empty message (ignored by the smarticle firmware) is sent to all restored devices concurrently,
+        and devices that do not acknowledge it are dropped
+
+        ## Arguments
+        ---
+
+        | Argument        | Type                      | Description                                                                   | Default Value |
+        | :------:        | :--:                      | :---------:                                                                   | :-----------: |
+        | cache_file      | `string`                  | path of device cache file                                                     | N/A           |
+        | verify          | `bool`                    | Check that restored devices are reachable                                     | True          |
+        | verify_timeout  | `float`                   | Acknowledgement timeout in seconds used for verification                      | 1.0           |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `dict` of smarticle number to node ID of cached devices that were not reachable
+        '''
+        if not os.path.exists(cache_file):
+            return {}
+        with open(cache_file) as f:
+            records = json.load(f)['devices']
+        for r in records:
+            remote = self._remote_from_record(r['address'], r['node_id'])
+            setattr(self,r['node_id'],remote)
+            self.devices[r['number']] = remote
+        missing = {}
+        if verify and self.devices:
+            timeout = self.base.get_sync_ops_timeout()
+            self.base.set_sync_ops_timeout(verify_timeout)
+            try:
+                report = self.ack_broadcast(b'\n', concurrent = True)
+            finally:
+                self.base.set_sync_ops_timeout(timeout)
+            for n, r in report.items():
+                if r['status'] != 'ok':
+                    missing[n] = self.devices.pop(n).get_node_id()
+        if self.debug:
+            print("Restored {} devices from {}, {} unreachable".format(len(self.devices), cache_file, len(missing)))
+        return missing
+
+    def _remote_from_record(self, address, node_id):
+        return self.backend.create_remote(self.base, address, node_id)
+
     def send(self, remote_device, msg, asynch = False):
         '''
         ## Description
@@ -187,7 +325,7 @@ class XbeeComm(object):
 
         ## Returns
         ---
-        `None`
+        Transmit status response if sent with acknowledgement, `None` otherwise
 
         More info on RemoteXbeeDevice:
         https://xbplib.readthedocs.io/en/stable/api/digi.xbee.devices.html#digi.xbee.devices.RemoteXBeeDevice
@@ -200,13 +338,27 @@ class XbeeComm(object):
         if self.debug:
             print("Sending data to {} >> {}...".format(remote_device.get_node_id(), msg))
 
+        base = self.base
+        self._notify_tx(remote_device, msg)
         if asynch is True:
-            self.base.send_data_async(remote_device, msg)
+            self._count_tx('unicast_async', msg)
+            base.send_data_async(remote_device, msg)
         else:
-            self.base.send_data(remote_device, msg)
+            self._count_tx('unicast', msg)
+            t0 = time.monotonic()
+            try:
+                response = base.send_data(remote_device, msg)
+            except self.backend.TimeoutException:
+                self.metrics.count('ack_timeouts')
+                raise
+            except Exception:
+                self.metrics.count('tx_errors')
+                raise
+            self.metrics.observe('ack_latency_s', time.monotonic()-t0)
 
             if self.debug:
                 print("Success")
+            return response
 
 
     def broadcast(self, msg):
@@ -227,34 +379,84 @@ class XbeeComm(object):
         ---
         `None`
         '''
-        self.base.send_data_broadcast(msg)
+        base = self.base
+        self._notify_tx(None, msg)
+        self._count_tx('broadcast', msg)
+        t0 = time.monotonic()
+        base.send_data_broadcast(msg)
+        self.metrics.observe('broadcast_call_s', time.monotonic()-t0)
 
 
-    def ack_broadcast(self,msg):
+    def ack_broadcast(self,msg, concurrent = None):
         '''
         ## Description
         ---
         Broadcasts to all xbees on network by sending message individually to each remote xbee in `devices` dictionary.
         This broadcast includes acknowledgements.
 
+        By default the unicasts are sent one after another and a timeout raises an exception.
+        In concurrent mode up to `max_in_flight` unicasts are in flight at once, each tracked by the frame ID of its
+        transmit request, so the broadcast costs about one round trip and a missing smarticle only delays its own entry.
+        Timeouts and transmit errors are reported instead of raised.
+
         ## Arguments
         ---
 
         | Argument        | Type                      | Description                                                                   | Default Value |
         | :------:        | :--:                      | :---------:                                                                   | :-----------: |
         | msg             | `string` or `bytearray`   | Message to send to XBee. Maximum of 108 bytes                                 | N/A           |
+        | concurrent      | `bool`                    | Send unicasts concurrently. If `None`, uses attribute `concurrent_ack`        | `None`        |
         |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
 
         ## Returns
         ---
-        `None`
+        Delivery report: `dict` of smarticle number to `dict` with keys `status` ('ok', 'timeout' or 'error'),
+        `latency_s` (time until acknowledgement or failure) and `frame_id` (`None` if unknown)
         '''
-
-        for remote_dev in list(self.devices.values()):
-            self.send(remote_dev,msg)
+        if concurrent is None:
+            concurrent = self.concurrent_ack
+        devices = list(self.devices.items())
+        report = {}
+        if not concurrent:
+            for n, remote_dev in devices:
+                t0 = time.monotonic()
+                response = self.send(remote_dev,msg)
+                report[n] = {'status': 'ok', 'latency_s': time.monotonic()-t0,
+                             'frame_id': getattr(response, 'frame_id', None)}
+            return report
+
+        if self._ack_pool is None:
+            self._ack_pool = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='ack_broadcast')
+        futures = [(n, self._ack_pool.submit(self._tracked_send, remote_dev, msg)) for n, remote_dev in devices]
+        for n, f in futures:
+            report[n] = f.result()
+        return report
+
+    def _tracked_send(self, remote_device, msg):
+        self._notify_tx(remote_device, msg)
+        self._count_tx('unicast', msg)
+        t0 = time.monotonic()
+        try:
+            response = self.base.send_data(remote_device, msg)
+            status = 'ok'
+        except self.backend.TimeoutException:
+            response = None
+            status = 'timeout'
+        except Exception as e:
+            # TransmitException carries the failed transmit status
+            response = getattr(e, 'transmit_status', None)
+            status = 'error'
+        latency = time.monotonic()-t0
+        if status == 'ok':
+            self.metrics.observe('ack_latency_s', latency)
+        else:
+            self.metrics.count('ack_timeouts' if status == 'timeout' else 'tx_errors')
+        if self.debug and status != 'ok':
+            print("No acknowledgement from {}: {}".format(remote_device.get_node_id(), status))
+        return {'status': status, 'latency_s': latency, 'frame_id': getattr(response, 'frame_id', None)}
 
 
-    def command(self, msg, remote_device = None, asynch = False):
+    def command(self, msg, remote_device = None, asynch = False, priority = SendQueue.COMMAND, deadline = None):
         '''
         ## Description
         ---
@@ -268,26 +470,141 @@ class XbeeComm(object):
         | msg             | `string` or `bytearray`                       | Message to send to XBee. Maximum of 108 bytes                            | N/A              |
         | remote_device   | -- | see class description | `None`           |
         | asynch           | `bool`                                        | Determines whether to send asynchronously (without ack) or not           | False            |
+        | priority        | `int`                                         | `SendQueue.SYNC`, `SendQueue.STREAM` or `SendQueue.COMMAND`              | `SendQueue.COMMAND` |
+        | deadline        | `float`                                       | `time.monotonic()` time at which to send, as soon as possible if `None`  | `None`           |
         |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
 
         ## Returns
         ---
-        `None`
+        Delivery report from `ack_broadcast()` when `remote_device` is `True`, else `Dispatch` of the queued message if
+        the send queue is running and the message is not acknowledged, and `None` otherwise
+
+        If the send queue is running (see `start_send_queue()`), the message is put on its timeline. Unacknowledged
+        messages return immediately; acknowledged broadcasts and unicasts (`asynch` False) wait until the queue sent
+        them (`Dispatch.wait()`), so that their delivery report and errors reach the caller as without the queue.
+        Without the send queue this function blocks until `deadline` and sends. Unicasts are sent early by the latency
+        of their smarticle in `latency_compensation` and broadcasts by `broadcast_compensation`, so that they arrive
+        at `deadline`. `msg` may also be a `list` of messages, which are sent back to back
         '''
-
+        if isinstance(msg, list):
+            reports = [self.command(m, remote_device, asynch, priority, deadline) for m in msg]
+            return reports[-1] if reports else None
+        if deadline is not None:
+            if remote_device is None or isinstance(remote_device, bool):
+                deadline -= self.broadcast_compensation
+            elif self.latency_compensation:
+                deadline -= self.latency_compensation.get(str(remote_device.get_64bit_addr()), 0.)
+        queue = self.send_queue
+        if queue is not None and threading.current_thread() is not queue:
+            if not self._opened:
+                # open here, so that a missing radio is reported to the caller rather than the queue thread
+                self.open_base()
+            self.metrics.count('commands_queued')
+            dispatch = queue.put(msg, remote_device, asynch, priority, deadline)
+            if remote_device is True or (remote_device is not None and not asynch):
+                return dispatch.wait()
+            return dispatch
+        if deadline is not None:
+            sleep_until(deadline)
+        return self.command_now(msg, remote_device, asynch)
+
+    def command_now(self, msg, remote_device = None, asynch = False):
+        '''
+        ## Description
+        ---
+        Same as `command()` but always sends immediately, bypassing the send queue
+        '''
+        if isinstance(msg, list):
+            reports = [self.command_now(m, remote_device, asynch) for m in msg]
+            return reports[-1] if reports else None
         if remote_device == None:
             self.broadcast(msg)
         elif (isinstance(remote_device,bool) and remote_device==True):
-            self.ack_broadcast(msg)
+            return self.ack_broadcast(msg)
         else:
             assert remote_device in self.devices.values(),"Remote Device not found in active devices"
             self.send(remote_device,msg, asynch)
 
+    def start_send_queue(self, consume_s = 0.02, buffer_depth = 4):
+        '''
+        ## Description
+        ---
+        Starts a `SendQueue` so that `command()` queues messages and returns immediately (acknowledged messages once
+        they were sent).
+        Messages are paced by their airtime at `baud_rate` and by the rate at which the smarticles consume messages
+
+        ## Arguments
+        ---
+
+        | Argument        | Type                                          | Description                                                              | Default Value    |
+        | :------:        | :--:                                          | :---------:                                                              | :-----------:    |
+        | consume_s       | `float`                                       | estimated time a smarticle needs to handle one message                   | 0.02             |
+        | buffer_depth    | `int`                                         | number of messages a smarticle can buffer (`MSG_BUFF_SIZE`)               | 4                |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `SendQueue` object
+        '''
+        if self.send_queue is None:
+            self.send_queue = SendQueue(self, self.baud_rate, consume_s, buffer_depth)
+            self.send_queue.start()
+        return self.send_queue
+
+    def stop_send_queue(self):
+        '''
+        ## Description
+        ---
+        Sends all queued messages and stops the send queue. `command()` sends immediately afterwards
+        '''
+        queue = self.send_queue
+        if queue is not None:
+            self.send_queue = None
+            queue.kill()
+            queue.join()
+
+    def flush(self, timeout = None):
+        '''
+        ## Description
+        ---
+        Blocks until all queued messages have been sent
+
+        ## Returns
+        ---
+        `True` if all messages were sent (or no queue is running), `False` if the timeout expired
+        '''
+        if self.send_queue is None:
+            return True
+        return self.send_queue.flush(timeout)
+
+    def format_stream_msg(self, poses):
+        '''
+        ## Description
+        ---
+        Formats a stream pose message, used by `StreamThread` on every tick. Poses that do not fit in one message
+        are packed into as few messages as possible (see `MsgEncoder.stream_frames()`)
+
+        ## Arguments
+        ---
+
+        | Argument        | Type                                          | Description                                                              | Default Value    |
+        | :------:        | :--:                                          | :---------:                                                              | :-----------:    |
+        | poses           | `np.array` or `list`                          | Nx3 array of [id, angL, angR] rows, or single [angL, angR] pose sent to all smarticles | N/A |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `bytes` message, or `list` of `bytes` messages to be sent back to back with `command()`
+        '''
+        frames = self.encoder.stream_frames(poses)
+        return frames[0] if len(frames) == 1 else frames
+
     def add_rx_callback(self, callback_fun):
         '''
         ## Description
         ---
-        Adds a data received callback function that is called everytime a message is received
+        Adds a data received callback function that is called everytime a message is received.
+        The time spent in callbacks is recorded in the `rx_callback_s` histogram (see `stats()`)
 
         ## Arguments
         ---
@@ -301,5 +618,139 @@ class XbeeComm(object):
         ---
         `None`
         '''
-        self.base.add_data_received_callback(callback_fun)
+        metrics = self.metrics
+        def timed_callback(xbee_message):
+            t0 = time.monotonic()
+            try:
+                callback_fun(xbee_message)
+            finally:
+                metrics.observe('rx_callback_s', time.monotonic()-t0)
+        self._rx_wrappers[callback_fun] = timed_callback
+        self.base.add_data_received_callback(timed_callback)
+
+    def del_rx_callback(self, callback_fun):
+        '''
+        ## Description
+        ---
+        Removes a data received callback function added with `add_rx_callback()`
+        '''
+        self.base.del_data_received_callback(self._rx_wrappers.pop(callback_fun, callback_fun))
+
+    def add_tx_callback(self, callback_fun, with_radio=False):
+        '''
+        ## Description
+        ---
+        Adds a callback function that is called with every outbound frame right before it is handed to the local XBee
 
+        ## Arguments
+        ---
+
+        | Argument        | Type                                          | Description                                                              | Default Value    |
+        | :------:        | :--:                                          | :---------:                                                              | :-----------:    |
+        | callback_fun    | function                                      | Function that takes (remote_device, msg); remote_device is `None` for broadcasts | N/A      |
+        | with_radio      | `bool`                                        | also pass `radio_index` (the index of this radio in a `MultiXbeeComm`) as keyword `radio` | False |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `None`
+        '''
+        if with_radio:
+            self._tx_wrappers[callback_fun] = lambda remote_device, msg: callback_fun(remote_device, msg, radio=self.radio_index)
+        self._tx_callbacks.append(self._tx_wrappers.get(callback_fun, callback_fun))
+
+    def del_tx_callback(self, callback_fun):
+        '''
+        ## Description
+        ---
+        Removes a callback function added with `add_tx_callback()`
+        '''
+        callback_fun = self._tx_wrappers.pop(callback_fun, callback_fun)
+        if callback_fun in self._tx_callbacks:
+            self._tx_callbacks.remove(callback_fun)
+
+    def _notify_tx(self, remote_device, msg):
+        for callback_fun in self._tx_callbacks:
+            callback_fun(remote_device, msg)
+
+    def _count_tx(self, kind, msg):
+        if isinstance(msg, str):
+            msg = msg.encode('utf8', errors='ignore')
+        n = len(msg)
+        if msg[:1] == b'\x11':
+            msg_type = 'sync'
+        elif n > 2 and msg[:2] == MsgEncoder.msg_prefix:
+            msg_type = msg_code_names.get(msg[2], 'unknown')
+        else:
+            msg_type = 'raw'
+        metrics = self.metrics
+        with metrics.lock:
+            counters = metrics.counters
+            for name, value in (('tx_frames.'+kind, 1), ('tx_bytes.'+kind, n), ('tx_type.'+msg_type, 1),
+                                ('tx_airtime_s', (n+SendQueue.FRAME_OVERHEAD)*10/self.baud_rate)):
+                counters[name] = counters.get(name, 0)+value
+
+    def _count_rx(self, xbee_message):
+        metrics = self.metrics
+        with metrics.lock:
+            counters = metrics.counters
+            node_id = str(xbee_message.remote_device.get_node_id())
+            n_bytes = len(xbee_message.data)
+            for name, value in (('rx_msgs.'+node_id, 1), ('rx_bytes.'+node_id, n_bytes), ('rx_bytes', n_bytes)):
+                counters[name] = counters.get(name, 0)+value
+
+    def stats(self):
+        '''
+        ## Description
+        ---
+        Returns a snapshot of the I/O metrics of this radio
+
+        ## Returns
+        ---
+        `dict` with keys:<br/>
+            &emsp; `counters`: `tx_frames.<kind>` and `tx_bytes.<kind>` (kind: broadcast, unicast, unicast_async),
+            `tx_type.<message type>`, `tx_airtime_s`, `ack_timeouts`, `tx_errors`, `commands_queued`,
+            `rx_msgs.<node id>`, `rx_bytes.<node id>`, `rx_bytes`<br/>
+            &emsp; `histograms`: `ack_latency_s`, `broadcast_call_s`, `queue_delay_s` (time commands wait in the send queue),
+            `rx_callback_s`<br/>
+            &emsp; `histograms` with the send queue running: `late_s.<priority>`, how late messages were sent after
+            their deadline<br/>
+            &emsp; `gauges`: `link_utilization` (estimated fraction of time the serial link was busy sending),
+            `send_queue_pending`<br/>
+        '''
+        snap = self.metrics.snapshot()
+        airtime = snap['counters'].get('tx_airtime_s', 0.)
+        queue = self.send_queue
+        snap['gauges'] = {'link_utilization': airtime/snap['uptime_s'] if snap['uptime_s'] > 0 else 0.,
+                          'send_queue_pending': queue.pending() if queue is not None else 0}
+        return snap
+
+    def start_stats_dump(self, path, period_s = 10, fmt = 'json'):
+        '''
+        ## Description
+        ---
+        Appends a `stats()` snapshot to file `path` every `period_s` until the base is closed
+
+        ## Arguments
+        ---
+
+        | Argument        | Type                                          | Description                                                              | Default Value    |
+        | :------:        | :--:                                          | :---------:                                                              | :-----------:    |
+        | path            | `string`                                      | file to append snapshots to                                              | N/A              |
+        | period_s        | `float`                                       | time between snapshots                                                   | 10               |
+        | fmt             | `string`                                      | 'json' (one JSON object per line) or 'text'                              | 'json'           |
+        |<img width=400/>|<img width=250/>|<img width=1000/>|<img width=550/>|
+
+        ## Returns
+        ---
+        `None`
+        '''
+        self.metrics.start_dump(path, period_s, fmt, self.stats)
+
+    def stop_stats_dump(self):
+        '''
+        ## Description
+        ---
+        Writes a last snapshot and stops the periodic dump started with `start_stats_dump()`
+        '''
+        self.metrics.stop_dump()